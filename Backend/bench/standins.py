@@ -0,0 +1,134 @@
+"""
+Local stand-ins for the services the backend depends on, for benchmarks.
+
+- make_sky_fits writes a deterministic synthetic sky (noise, stars, a nebula).
+- build_pyramid tiles it with generate_fits_tiles into {root}/n-large/{image_set},
+  the bucket layout, so the same run doubles as the tiler benchmark.
+- BucketServer serves {root} over HTTP from a thread, with ETags and an optional
+  per-request delay standing in for the bucket round trip. The backend runs with
+  GCS_BASE_URL pointing at it.
+- seed_labels fills nlarge and tile_labels with a synthetic label for every tile.
+"""
+import os
+import sys
+import time
+import random
+import threading
+import contextlib
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tile_prefetch import level_grid
+
+BUCKET_NAME = "n-large"
+LABELS = ["star", "galaxy", "nebula", "empty", "artifact"]
+
+
+def make_sky_fits(path, size, seed=0):
+    """size x size float32 image: Gaussian background, point sources and one diffuse blob."""
+    from astropy.io import fits
+    rng = np.random.default_rng(seed)
+    data = rng.normal(100.0, 5.0, (size, size)).astype(np.float32)
+    axis = np.arange(size, dtype=np.float32) / size
+    data += 400.0 * np.outer(np.exp(-(axis - 0.6) ** 2 / 0.02), np.exp(-(axis - 0.4) ** 2 / 0.02))
+    count = size * size // 2000
+    ys, xs = rng.integers(2, size - 2, count), rng.integers(2, size - 2, count)
+    flux = rng.pareto(1.5, count).astype(np.float32) * 200.0
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            np.add.at(data, (ys + dy, xs + dx), flux / (1 + 2 * (abs(dx) + abs(dy))))
+    fits.PrimaryHDU(data).writeto(path, overwrite=True)
+
+
+def build_pyramid(source_path, root, image_set, encode_workers=None):
+    """Tile source_path into {root}/n-large/{image_set}; returns (seconds, tile count)."""
+    import generate_fits_tiles
+    sink = generate_fits_tiles.LocalDirectorySink(os.path.join(root, BUCKET_NAME), image_set)
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        generate_fits_tiles.create_and_upload_tiles(
+            sink, source_path, encode_workers=encode_workers or generate_fits_tiles.ENCODE_WORKERS,
+        )
+    seconds = time.perf_counter() - started
+    tiles = sum(len(files) for _, _, files in os.walk(sink.root)) - 1  # minus config.json
+    return seconds, tiles
+
+
+def all_tiles(config):
+    """Every (z, x, y) of the pyramid, by the grid math of get_tiles_for_image."""
+    for z in range(config["maxLevel"] + 1):
+        cols, rows = level_grid(config, z)
+        for x in range(cols + 1):
+            for y in range(rows + 1):
+                yield z, x, y
+
+
+class _BucketHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+        self.etag = None
+        path = self.translate_path(self.path)
+        if os.path.isfile(path):
+            st = os.stat(path)
+            self.etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+        super().do_GET()
+
+    def end_headers(self):
+        if getattr(self, "etag", None):
+            self.send_header("ETag", self.etag)
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BucketServer:
+    def __init__(self, root, port=0, delay=0.0):
+        handler = type("Handler", (_BucketHandler,), {"delay": delay})
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), lambda *a: handler(*a, directory=root))
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="bucket-standin", daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+async def seed_labels(dsn, image_set, config, url_base, seed=0):
+    """Replace image_set's labels in nlarge and tile_labels with one synthetic label per tile."""
+    import asyncpg
+    from migrate_labels import ADD_MODEL_VERSION, CREATE_TABLE
+    rng = random.Random(seed)
+    rows = [(image_set, z, x, y, rng.choice(LABELS), "bench") for z, x, y in all_tiles(config)]
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute("CREATE TABLE IF NOT EXISTS nlarge (file_path TEXT PRIMARY KEY, value TEXT)")
+        await conn.execute(CREATE_TABLE)
+        await conn.execute(ADD_MODEL_VERSION)
+        async with conn.transaction():
+            await conn.execute("DELETE FROM tile_labels WHERE image_set = $1", image_set)
+            await conn.execute("DELETE FROM nlarge WHERE file_path LIKE $1", f"{url_base}/{image_set}/%")
+            await conn.copy_records_to_table(
+                "tile_labels", records=rows, columns=["image_set", "z", "x", "y", "value", "model_version"],
+            )
+            await conn.copy_records_to_table("nlarge", records=[
+                (f"{url_base}/{image_set}/{z}/{x}/{y}.png", value) for image_set, z, x, y, value, _ in rows
+            ], columns=["file_path", "value"])
+    finally:
+        await conn.close()
+    return len(rows)
@@ -0,0 +1,169 @@
+"""
+On-demand tile classification for the API.
+
+Requests are queued and grouped into micro-batches: a batch is flushed as soon
+as it holds max_batch tiles or its first tile has waited max_wait seconds, so a
+lone request pays at most max_wait of extra latency while a burst shares one
+forward pass, and a tile requested twice in one batch is classified once. The
+DB write-through of a finished batch runs as its own task (at most
+max_writes at a time), so the next batch's inference doesn't wait on the
+database; each request is still answered only once its label is stored. The
+model runs in a dedicated worker process (loaded once by the
+pool initializer), so inference never blocks the event loop.
+
+The model is an artifact exported by ai/src/export.py; its class names and
+version come from the artifact itself.
+"""
+import io
+import time
+import asyncio
+import numpy as np
+from PIL import Image
+
+from model_artifact import load_artifact
+from tile_classifier import INPUT_SIZE
+
+# Worker-process state, set by init_worker
+_model = None
+_meta = None
+_torch = None
+
+
+def init_worker(model_path, threads=None):
+    global _model, _meta, _torch
+    import torch
+    if threads:
+        torch.set_num_threads(threads)
+    _torch = torch
+    _model, _meta = load_artifact(model_path)
+
+
+def model_info():
+    """The loaded artifact's metadata (classes, model_version), so the API process never imports torch."""
+    return _meta
+
+
+def classify_pngs(pngs):
+    """Class indices for a list of PNG tiles. Runs in the worker process."""
+    batch = np.empty((len(pngs), INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)
+    for i, data in enumerate(pngs):
+        with Image.open(io.BytesIO(data)) as img:
+            batch[i] = np.asarray(img.convert("RGB").resize((INPUT_SIZE, INPUT_SIZE), Image.Resampling.BILINEAR))
+    inputs = _torch.from_numpy(batch).permute(0, 3, 1, 2).float().div_(255.0)
+    with _torch.inference_mode():
+        return _model(inputs).argmax(dim=1).tolist()
+
+
+class MicroBatcher:
+    """
+    Collects (key, png) requests into batches for run_batch(pngs) -> labels and
+    hands every finished batch to write(list of (key, label)) before answering.
+    """
+
+    def __init__(self, run_batch, write, max_batch=32, max_wait=0.01, max_writes=2):
+        self.run_batch = run_batch
+        self.write = write
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_writes = max_writes
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.write_slots = asyncio.Semaphore(max_writes)
+        self.writes = set()
+        self.batches = 0
+        self.tiles = 0
+        self.duplicates = 0
+        self.batch_seconds = 0.0
+        self.errors = 0
+        self.write_errors = 0
+
+    async def classify(self, key, png):
+        if self.task is None:
+            self.task = asyncio.create_task(self._loop())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((key, png, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _loop(self):
+        while True:
+            batch = await self._collect()
+            # key -> (png, futures): every request for a key gets the one label
+            waiters = {}
+            for key, png, future in batch:
+                waiters.setdefault(key, (png, []))[1].append(future)
+            self.duplicates += len(batch) - len(waiters)
+            started = time.perf_counter()
+            try:
+                labels = await self.run_batch([png for png, _ in waiters.values()])
+            except Exception as e:
+                self.errors += 1
+                self._fail(waiters, e)
+                continue
+            finally:
+                self.batches += 1
+                self.tiles += len(waiters)
+                self.batch_seconds += time.perf_counter() - started
+            results = list(zip(waiters, labels))
+            # Bounded: with max_writes batches waiting on the DB, inference waits too
+            await self.write_slots.acquire()
+            task = asyncio.create_task(self._write(results, waiters))
+            self.writes.add(task)
+            task.add_done_callback(self.writes.discard)
+
+    async def _write(self, results, waiters):
+        try:
+            await self.write(results)
+        except Exception as e:
+            self.write_errors += 1
+            self._fail(waiters, e)
+            return
+        finally:
+            self.write_slots.release()
+        for key, label in results:
+            for future in waiters[key][1]:
+                if not future.done():
+                    future.set_result(label)
+
+    @staticmethod
+    def _fail(waiters, error):
+        for _, futures in waiters.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        # Let batches that were already classified reach the database
+        if self.writes:
+            await asyncio.gather(*self.writes, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "batches": self.batches,
+            "tiles": self.tiles,
+            "duplicates": self.duplicates,
+            "errors": self.errors,
+            "writing": len(self.writes),
+            "write_errors": self.write_errors,
+            "avg_batch_size": round(self.tiles / self.batches, 2) if self.batches else 0.0,
+            "avg_batch_ms": round(self.batch_seconds / self.batches * 1000, 3) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_writes": self.max_writes,
+        }
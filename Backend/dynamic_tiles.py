@@ -0,0 +1,172 @@
+"""
+On-the-fly tile rendering from memory-mapped scientific data.
+
+Sources live under the dynamic sources directory as either
+    {image_set}.pyramid/   float32 levels written by generate_fits_tiles.py --float-pyramid
+    {image_set}.fits       a FITS image, decimated by striding for coarse levels
+
+render_tile runs in a worker process. Each worker opens a source once and keeps
+the memmaps and default stretch limits around, so a render is a slice, a
+vectorized stretch, a colormap lookup and a fast PNG encode. A source is
+reopened when its source_version changes (a regenerated pyramid or a replaced
+FITS file), and the API puts the version in the render cache key.
+"""
+import io
+import os
+import json
+import math
+import numpy as np
+from PIL import Image
+
+from pyramid import FITSSource, calculate_max_zoom
+from stretch import DEFAULT_CLIP, STRETCHES, apply_stretch, compute_limits, subsample
+
+# Matches the generator
+MIN_LEVEL_SIZE = 512
+TILE_SIZE = 512
+# zlib level 1: several times faster than the default for a modest size cost
+PNG_COMPRESS_LEVEL = 1
+
+_sources = {}
+_colormaps = {}
+
+
+class SourceNotFound(Exception):
+    pass
+
+
+class PyramidSource:
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.levels = {}
+        for name in os.listdir(path):
+            if name.endswith(".npy"):
+                self.levels[int(name[:-4])] = np.load(os.path.join(path, name), mmap_mode="r")
+        # The coarsest level is small enough to take statistics from directly
+        self.sample = self.levels[min(self.levels)]
+
+    def region(self, z, x, y, tile_size):
+        level = self.levels.get(z)
+        if level is None or x < 0 or y < 0:
+            return None
+        return level[y * tile_size:(y + 1) * tile_size, x * tile_size:(x + 1) * tile_size]
+
+
+class FITSRenderSource:
+    def __init__(self, path):
+        self.fits = FITSSource(path, stretch="linear")
+        self.meta = {
+            "width": self.fits.width,
+            "height": self.fits.height,
+            "tileSize": TILE_SIZE,
+            "maxLevel": calculate_max_zoom(self.fits.width, MIN_LEVEL_SIZE),
+        }
+        self.sample = self.fits._physical(subsample(self.fits.data))
+
+    def region(self, z, x, y, tile_size):
+        if not 0 <= z <= self.meta["maxLevel"] or x < 0 or y < 0:
+            return None
+        # Nearest-neighbour decimation: a coarse tile reads tile_size**2 pixels, not the whole footprint
+        step = 2**(self.meta["maxLevel"] - z)
+        top = y * tile_size * step
+        left = x * tile_size * step
+        if top >= self.fits.height or left >= self.fits.width:
+            return None
+        bottom = min(top + tile_size * step, self.fits.height)
+        # Display row r is FITS row height - 1 - r
+        first = self.fits.height - 1 - top
+        last = self.fits.height - 1 - (bottom - 1)
+        rows = self.fits.data[last:first + 1][::-1][::step, left:left + tile_size * step:step]
+        return self.fits._physical(rows)
+
+
+def source_version(root, image_set):
+    """
+    Identifies the current contents of a source: the mtime and size of the FITS file,
+    or of a pyramid's meta.json, which write_float_pyramid writes after the levels.
+    """
+    pyramid_path = os.path.join(root, f"{image_set}.pyramid")
+    fits_path = os.path.join(root, f"{image_set}.fits")
+    for path in (os.path.join(pyramid_path, "meta.json"), fits_path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+    raise SourceNotFound(image_set)
+
+
+def get_source(root, image_set):
+    key = (root, image_set)
+    version = source_version(root, image_set)
+    source = _sources.get(key)
+    if source is None or source.version != version:
+        pyramid_path = os.path.join(root, f"{image_set}.pyramid")
+        fits_path = os.path.join(root, f"{image_set}.fits")
+        if os.path.isdir(pyramid_path):
+            source = PyramidSource(pyramid_path)
+        elif os.path.exists(fits_path):
+            source = FITSRenderSource(fits_path)
+        else:
+            raise SourceNotFound(image_set)
+        source.version = version
+        source.limits = {}
+        _sources[key] = source
+    return source
+
+
+def get_colormap(name):
+    """256-entry RGB lookup table, or None for plain grayscale."""
+    if name == "gray":
+        return None
+    lut = _colormaps.get(name)
+    if lut is None:
+        import matplotlib
+        try:
+            cmap = matplotlib.colormaps[name]
+        except KeyError:
+            raise ValueError(f"Unknown colormap: {name}")
+        lut = (cmap(np.linspace(0.0, 1.0, 256))[:, :3] * 255 + 0.5).astype(np.uint8)
+        _colormaps[name] = lut
+    return lut
+
+
+def describe_source(root, image_set):
+    return dict(get_source(root, image_set).meta)
+
+
+def render_tile(root, image_set, z, x, y, stretch="asinh", vmin=None, vmax=None, cmap="gray"):
+    """PNG bytes for one tile, or None if the tile is outside the image."""
+    if stretch not in STRETCHES:
+        raise ValueError(f"Unknown stretch: {stretch}")
+    if any(limit is not None and not math.isfinite(limit) for limit in (vmin, vmax)):
+        raise ValueError("vmin and vmax must be finite")
+    source = get_source(root, image_set)
+    tile_size = source.meta["tileSize"]
+    lut = get_colormap(cmap)
+
+    region = source.region(z, x, y, tile_size)
+    if region is None or region.size == 0:
+        return None
+
+    if vmin is None or vmax is None:
+        limits = source.limits.get(stretch)
+        if limits is None:
+            limits = source.limits[stretch] = compute_limits(source.sample, stretch, DEFAULT_CLIP)
+        vmin = limits[0] if vmin is None else vmin
+        vmax = limits[1] if vmax is None else vmax
+    if vmax <= vmin:
+        raise ValueError("vmax must be greater than vmin")
+
+    # Pad edge tiles with black like the static pyramid
+    pixels = np.zeros((tile_size, tile_size), dtype=np.uint8)
+    scaled = apply_stretch(region, stretch, vmin, vmax)
+    scaled *= 255.0
+    scaled += 0.5
+    pixels[:region.shape[0], :region.shape[1]] = scaled
+    tile = Image.fromarray(pixels if lut is None else lut[pixels])
+
+    in_mem_file = io.BytesIO()
+    tile.save(in_mem_file, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    return in_mem_file.getvalue()
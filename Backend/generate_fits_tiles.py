@@ -1,9 +1,14 @@
 import os
 import io
 import json
-import math # <-- Import the math library
-from PIL import Image
-from google.cloud import storage
+import time
+import argparse
+import threading
+from pyramid import build_pyramid, calculate_max_zoom, open_source, write_float_pyramid
+from stretch import DEFAULT_CLIP, STRETCHES
+from tile_archive import TileArchiveWriter
+from tile_manifest import JobManifest
+from tile_pipeline import TilePipeline
 
 # --- CONFIGURATION ---
 SOURCE_IMAGE_PATH = './tiles/sample4.tif'
@@ -14,69 +19,259 @@ TILE_SIZE = 512 # <-- Updated tile size
 # The desired size of the smallest dimension at the most zoomed-out level.
 # This helps determine how many zoom levels are needed.
 MIN_LEVEL_SIZE = 512 
+# Pipeline sizing: PNG encoder processes, upload threads and tiles waiting for upload
+ENCODE_WORKERS = os.cpu_count() or 1
+UPLOAD_WORKERS = 16
+QUEUE_SIZE = 64
+# Finished tiles are recorded here so an interrupted run can pick up where it stopped
+JOBS_DIR = './jobs'
 
-# --- SCRIPT ---
+# --- OUTPUT SINKS ---
+# put_tile(z, x, y, data, sha256) stores one PNG and may return a dict describing
+# where it went, which is kept in the job manifest; the tile must be durable by the
+# time put_tile returns. resume(entries) is given the manifest entries of an
+# interrupted run, removes the ones whose output is missing, and returns False if
+# none of them can be trusted.
+
+class GCSSink:
+    """Uploads every tile as its own object: {prefix}/{z}/{x}/{y}.png"""
+
+    def __init__(self, prefix):
+        from google.cloud import storage
+        # Initialize the Google Cloud Storage client
+        print("Initializing Google Cloud Storage client...")
+        storage_client = storage.Client(project=YOUR_PROJECT_ID)
+        self.bucket = storage_client.bucket(BUCKET_NAME)
+        self.prefix = prefix
+        print(f"Uploading to bucket: gs://{self.bucket.name}")
+
+    def describe(self):
+        return f"gs://{BUCKET_NAME}/{self.prefix}"
+
+    def resume(self, entries):
+        return True
+
+    def put_tile(self, z, x, y, data, sha256=None):
+        # Viewers load these objects by path straight from the bucket, so each
+        # tile stays its own object even when its bytes repeat
+        blob = self.bucket.blob(f"{self.prefix}/{z}/{x}/{y}.png")
+        blob.upload_from_file(io.BytesIO(data))
+
+    def put_config(self, config_data):
+        # Define the path for the config file in the bucket
+        config_blob_path = f"{self.prefix}/config.json"
+        config_blob = self.bucket.blob(config_blob_path)
+
+        # Convert the dictionary to a JSON string and upload it
+        # The 'indent=2' makes the file readable
+        config_string = json.dumps(config_data, indent=2)
+        config_blob.upload_from_string(config_string, content_type='application/json')
+        print(f"✅ Successfully uploaded config to gs://{self.bucket.name}/{config_blob_path}")
+
+    def close(self):
+        pass
+
+
+class LocalDirectorySink:
+    """
+    Writes the bucket layout to a local directory: {root}/{prefix}/{z}/{x}/{y}.png
+    A tile whose bytes were already written is hardlinked to the first copy instead.
+    """
+
+    def __init__(self, root, prefix):
+        self.root = os.path.join(root, prefix)
+        self.lock = threading.Lock()
+        self.blobs = {}  # sha256 -> path of the first tile with those bytes
+        print(f"Writing tiles to directory: {self.root}")
+
+    def describe(self):
+        return os.path.abspath(self.root)
+
+    def tile_path(self, z, x, y):
+        return os.path.join(self.root, str(z), str(x), f"{y}.png")
+
+    def resume(self, entries):
+        lost = [key for key in entries if not os.path.isfile(self.tile_path(*key))]
+        for key in lost:
+            del entries[key]
+        if lost:
+            print(f"{len(lost)} recorded tiles are missing from {self.root} and will be redone")
+        if not entries:
+            return False
+        self.blobs = {e["sha256"]: self.tile_path(*key) for key, e in entries.items()}
+        return True
+
+    def put_tile(self, z, x, y, data, sha256=None):
+        tile_dir = os.path.join(self.root, str(z), str(x))
+        os.makedirs(tile_dir, exist_ok=True)
+        path = os.path.join(tile_dir, f"{y}.png")
+        # Written under a temporary name and renamed, so a reader or a rerun never
+        # sees a torn tile and replacing a tile never rewrites a linked copy in place
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with self.lock:
+            first = self.blobs.setdefault(sha256, path) if sha256 else path
+        if first != path and self._link(first, tmp_path):
+            os.replace(tmp_path, path)
+        else:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        # The manifest records the tile as soon as this returns, so the new
+        # directory entry has to be durable too
+        _fsync_dir(tile_dir)
+
+    @staticmethod
+    def _link(source, link_path):
+        try:
+            if os.path.exists(link_path):
+                os.remove(link_path)  # left over from an interrupted run
+            os.link(source, link_path)
+            return True
+        except OSError:
+            # No hardlinks here (or the first copy is not written yet): store a copy
+            return False
+
+    def put_config(self, config_data):
+        with open(os.path.join(self.root, "config.json"), "w") as f:
+            json.dump(config_data, f, indent=2)
+
+    def close(self):
+        print(f"✅ Wrote {len(self.blobs)} unique tiles to {self.root}")
 
-def create_and_upload_tiles():
-    # Initialize the Google Cloud Storage client
-    print("Initializing Google Cloud Storage client...")
-    storage_client = storage.Client(project=YOUR_PROJECT_ID)
-    bucket = storage_client.bucket(BUCKET_NAME)
-    print(f"Uploading to bucket: gs://{bucket.name}")
 
+def _fsync_dir(path):
+    # Directories cannot be opened for fsync on Windows; there a file fsync is the best we get
+    if os.name == "nt":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ArchiveSink:
+    """
+    Packs the whole pyramid and its config into one indexed archive file (see tile_archive.py).
+    Blobs are content-addressed: identical tiles are stored once and share an index entry target.
+    """
+
+    def __init__(self, path, resume=False):
+        self.writer = TileArchiveWriter(path, resume=resume)
+        self.lock = threading.Lock()
+        self.blobs = {}  # sha256 -> (offset, length)
+        print(f"Writing tile archive: {path}")
+
+    def describe(self):
+        return os.path.abspath(self.writer.path)
+
+    def resume(self, entries):
+        # Without the partial file from the interrupted run there is nothing to resume
+        if not self.writer.resumed:
+            return False
+        kept = self.writer.restore({key: (e["offset"], e["length"]) for key, e in entries.items()})
+        lost = [key for key in entries if key not in kept]
+        for key in lost:
+            del entries[key]
+        if lost:
+            print(f"{len(lost)} recorded tiles are missing from the partial archive and will be redone")
+        self.blobs = {e["sha256"]: (e["offset"], e["length"]) for e in entries.values()}
+        return True
+
+    def put_tile(self, z, x, y, data, sha256):
+        # Uploader threads share one file handle
+        with self.lock:
+            location = self.blobs.get(sha256)
+            if location is None:
+                location = self.writer.add_tile(z, x, y, data)
+                # The manifest records the tile as soon as this returns
+                self.writer.sync()
+                self.blobs[sha256] = location
+            else:
+                self.writer.add_alias(z, x, y, location)
+        return {"offset": location[0], "length": location[1]}
+
+    def put_config(self, config_data):
+        self.writer.set_config(config_data)
+
+    def close(self):
+        self.writer.close()
+        print(f"✅ Wrote {len(self.writer.index)} tiles ({len(self.blobs)} unique) to {self.writer.path}")
+
+
+# --- SCRIPT ---
+
+def create_and_upload_tiles(sink, source_path=SOURCE_IMAGE_PATH, strip=False,
+                            encode_workers=ENCODE_WORKERS, upload_workers=UPLOAD_WORKERS, queue_size=QUEUE_SIZE,
+                            manifest_path=None, fits_options=None, classifier=None):
     print("Opening source image...")
-    Image.MAX_IMAGE_PIXELS = None # Allow Pillow to open very large images
-    source_image = Image.open(SOURCE_IMAGE_PATH)
-    original_width, original_height = source_image.size
+    source = open_source(source_path, **(fits_options or {}))
+    original_width, original_height = source.width, source.height
     print(f"Source image size: {original_width}x{original_height}")
+    if getattr(source, "requires_strip", False) and not strip:
+        print("FITS input is tiled straight from the memmap in strip mode")
+        strip = True
 
     # --- DYNAMICALLY CALCULATE MAX_ZOOM ---
     # This logic is now inside the function because it depends on the image dimensions.
-    if original_width <= 0:
-        raise ValueError("Source image width must be positive.")
-    MAX_ZOOM = int(math.ceil(math.log2(original_width / MIN_LEVEL_SIZE)))
+    MAX_ZOOM = calculate_max_zoom(original_width, MIN_LEVEL_SIZE)
     print(f"Dynamically calculated MAX_ZOOM: {MAX_ZOOM}")
     # ------------------------------------
 
-    # Loop through each zoom level to create and upload tiles
-    for z in range(MAX_ZOOM + 1):
-        print(f"--- Processing zoom level {z} ---")
-        scale = 2**(MAX_ZOOM - z)
-        scaled_width = original_width // scale
-        scaled_height = original_height // scale
-        
-        if scaled_width == 0 or scaled_height == 0:
-            print(f"Skipping zoom level {z} due to zero size.")
-            continue
-
-        print(f"Resizing image to {scaled_width}x{scaled_height} for this level...")
-        scaled_image = source_image.resize((scaled_width, scaled_height), Image.Resampling.LANCZOS)
-        
-        cols = scaled_width // TILE_SIZE
-        rows = scaled_height // TILE_SIZE
-        
-        for y in range(rows + 1):
-            for x in range(cols + 1):
-                left = x * TILE_SIZE
-                upper = y * TILE_SIZE
-                right = left + TILE_SIZE
-                lower = upper + TILE_SIZE
-
-                tile = scaled_image.crop((left, upper, right, lower))
-
-                blob_path = f"{OUTPUT_PREFIX}/{z}/{x}/{y}.png"
-                blob = bucket.blob(blob_path)
-
-                in_mem_file = io.BytesIO()
-                tile.save(in_mem_file, format='PNG')
-                in_mem_file.seek(0)
-
-                blob.upload_from_file(in_mem_file)
-
-    print("--- Tiling and image upload complete! ---")
+    manifest = None
+    if manifest_path:
+        job = {
+            "source": os.path.abspath(source_path),
+            "width": original_width,
+            "height": original_height,
+            "tileSize": TILE_SIZE,
+            "maxLevel": MAX_ZOOM,
+            "strip": strip,
+            "fits": fits_options or None,
+            "output": sink.describe(),
+        }
+        manifest = JobManifest(manifest_path, job)
+        if manifest.done and not sink.resume(manifest.done):
+            print("Partial output of the previous run is gone; starting over")
+            manifest.reset()
+
+    # Crops are PNG-encoded in worker processes and uploaded from a thread pool
+    pipeline = TilePipeline(sink, encode_workers, upload_workers, queue_size, manifest)
+    emit = pipeline.submit
+    skip = pipeline.is_done
+    if classifier is not None:
+        # Labels are committed in large batches, so a crash can lose labels of tiles the
+        # manifest already lists. Those tiles are cropped again, for the classifier only.
+        labeled = classifier.labeled_tiles()
+
+        def skip(z, x, y):
+            return (z, x, y) in labeled and pipeline.is_done(z, x, y)
+
+        # The classifier gets the same in-memory crop, so labelling needs no download or PNG decode
+        def emit(z, x, y, tile):
+            classifier.submit(z, x, y, tile)
+            if manifest is None or not manifest.is_done(z, x, y):
+                pipeline.submit(z, x, y, tile)
+
+    # Build the finest level once and derive each coarser level from the one below it
+    start = time.perf_counter()
+    try:
+        stats = build_pyramid(source, MAX_ZOOM, TILE_SIZE, emit, strip=strip, skip=skip)
+    finally:
+        try:
+            pipeline.close()
+        finally:
+            if classifier is not None:
+                classifier.close()
+            if manifest is not None:
+                manifest.close()
+    stats.report()
+    print(f"--- Tiling and image upload complete in {time.perf_counter() - start:.1f} s! ---")
     
     # --- CREATE AND UPLOAD CONFIG.JSON ---
-    print("--- Creating and uploading config.json ---")
+    print("--- Creating and writing config.json ---")
     
     # 1. Create the configuration dictionary
     config_data = {
@@ -86,19 +281,75 @@ def create_and_upload_tiles():
         "maxLevel": MAX_ZOOM
     }
 
-    # 2. Define the path for the config file in the bucket
-    config_blob_path = f"{OUTPUT_PREFIX}/config.json"
-    config_blob = bucket.blob(config_blob_path)
+    # 2. Hand it to the sink (a config.json object, or the archive header)
+    sink.put_config(config_data)
+    sink.close()
 
-    # 3. Convert the dictionary to a JSON string and upload it
-    # The 'indent=2' makes the file readable
-    config_string = json.dumps(config_data, indent=2)
-    config_blob.upload_from_string(config_string, content_type='application/json')
-    
-    print(f"✅ Successfully uploaded config to gs://{bucket.name}/{config_blob_path}")
-    # --- END OF NEW SECTION ---
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build a tile pyramid from a large image.")
+    parser.add_argument("--source", default=SOURCE_IMAGE_PATH,
+                        help="Source image path (.fits and .npy inputs are memory-mapped)")
+    parser.add_argument("--prefix", default=OUTPUT_PREFIX, help="Image set name / bucket prefix")
+    parser.add_argument("--archive", metavar="PATH",
+                        help="Write a single-file tile archive (e.g. tiles/<prefix>.tiles) instead of uploading to GCS")
+    parser.add_argument("--output-dir", metavar="DIR",
+                        help="Write {prefix}/{z}/{x}/{y}.png under a local directory instead of uploading to GCS")
+    parser.add_argument("--encode-workers", type=int, default=ENCODE_WORKERS,
+                        help="PNG encoder processes (0 encodes in the main process)")
+    parser.add_argument("--upload-workers", type=int, default=UPLOAD_WORKERS, help="Upload threads")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="Encoded tiles waiting for upload")
+    parser.add_argument("--manifest", metavar="PATH",
+                        help=f"Job manifest used to resume interrupted runs (default: {JOBS_DIR}/<prefix>.manifest.jsonl)")
+    parser.add_argument("--no-resume", action="store_true", help="Ignore any existing manifest and start over")
+    parser.add_argument("--stretch", choices=STRETCHES, default="asinh", help="Display stretch for FITS input")
+    parser.add_argument("--clip", type=float, nargs=2, metavar=("LOW", "HIGH"), default=list(DEFAULT_CLIP),
+                        help="Percentile clip for the linear/log/asinh stretches")
+    parser.add_argument("--hdu", type=int, help="FITS HDU index (default: first image HDU)")
+    parser.add_argument("--float-pyramid", metavar="DIR",
+                        help="For FITS input, write DIR/<prefix>.pyramid (float32 levels for /dynamic rendering) "
+                             "instead of PNG tiles")
+    parser.add_argument("--strip", action="store_true",
+                        help="Process the source in bands of TILE_SIZE rows to bound peak memory")
+    parser.add_argument("--classify", metavar="MODEL",
+                        help="Label every tile with this classifier while tiling: an artifact from ai/src/export.py "
+                             "(ai/models/space_model.ts) or a train.py state dict; labels go to DATABASE_URL")
+    parser.add_argument("--classes-dir", default="dataset/train",
+                        help="Training set whose folder names are the classes of a raw state dict")
+    parser.add_argument("--classify-batch", type=int, default=64, help="Tiles per forward pass")
+    parser.add_argument("--classify-threads", type=int, help="torch CPU threads (default: torch's own)")
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    create_and_upload_tiles()
+    args = parse_args()
+    fits_options = None
+    if args.source.lower().endswith((".fits", ".fit", ".fts")):
+        fits_options = {"stretch": args.stretch, "clip": list(args.clip), "hdu": args.hdu}
+    if args.float_pyramid:
+        if fits_options is None:
+            raise SystemExit("--float-pyramid needs a FITS source")
+        source = open_source(args.source, **fits_options)
+        write_float_pyramid(source, os.path.join(args.float_pyramid, f"{args.prefix}.pyramid"),
+                            calculate_max_zoom(source.width, MIN_LEVEL_SIZE), TILE_SIZE)
+        raise SystemExit(0)
 
+    manifest_path = args.manifest or os.path.join(JOBS_DIR, f"{args.prefix}.manifest.jsonl")
+    if args.no_resume and os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    if args.archive:
+        sink = ArchiveSink(args.archive, resume=not args.no_resume)
+    elif args.output_dir:
+        sink = LocalDirectorySink(args.output_dir, args.prefix)
+    else:
+        sink = GCSSink(args.prefix)
+    classifier = None
+    if args.classify:
+        from dotenv import load_dotenv
+        from tile_classifier import TileClassifier
+        load_dotenv()
+        classifier = TileClassifier(args.classify, args.classes_dir, args.prefix, os.environ["DATABASE_URL"],
+                                    batch_size=args.classify_batch, threads=args.classify_threads)
+    create_and_upload_tiles(sink, args.source, strip=args.strip, encode_workers=args.encode_workers,
+                            upload_workers=args.upload_workers, queue_size=args.queue_size,
+                            manifest_path=manifest_path, fits_options=fits_options, classifier=classifier)
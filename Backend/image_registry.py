@@ -0,0 +1,116 @@
+"""
+In-process registry of image sets and their config.json.
+
+Pyramids are immutable once generated, so a config only needs fetching once:
+the registry preloads every image set's config at startup (concurrently) and
+answers /info and /images from memory afterwards. A background loop re-lists
+the storage backend every refresh_interval seconds; it fetches the configs of
+newly listed image sets only and drops the sets no longer listed. An image set that isn't known yet (uploaded since the
+last refresh) is fetched on first request and kept.
+
+When the backend can't list its image sets, the names in `extra` (IMAGE_SETS)
+are loaded instead, and the configs already held are kept.
+"""
+import time
+import asyncio
+import logging
+
+from tile_storage import StorageError, TileNotFound
+
+logger = logging.getLogger(__name__)
+
+
+class ImageSetRegistry:
+    def __init__(self, storage, refresh_interval=300.0, extra=(), concurrency=16):
+        self.storage = storage
+        self.refresh_interval = refresh_interval
+        self.extra = list(extra)
+        self.concurrency = concurrency
+        self.configs = {}
+        self.loaded = asyncio.Event()
+        self.task = None
+        self.refreshes = 0
+        self.last_refresh = None
+        self.last_refresh_seconds = None
+        self.last_error = None
+
+    async def get(self, image_set):
+        """config.json of one image set; raises TileNotFound / StorageError like the storage backend."""
+        config = self.configs.get(image_set)
+        if config is None:
+            config = self.configs[image_set] = await self.storage.get_config(image_set)
+        return config
+
+    def list(self):
+        return sorted(self.configs.items())
+
+    async def refresh(self):
+        started = time.perf_counter()
+        try:
+            names = await self.storage.list_image_sets()
+            listed = True
+        except (NotImplementedError, StorageError) as e:
+            logger.warning(f"Image set listing unavailable, using IMAGE_SETS and known sets: {e}")
+            names, listed = list(self.configs), False
+        names = list(dict.fromkeys([*names, *self.extra]))
+
+        limit = asyncio.Semaphore(self.concurrency)
+
+        async def load(name):
+            async with limit:
+                try:
+                    return name, await self.storage.get_config(name)
+                except TileNotFound:
+                    return name, None
+                except StorageError as e:
+                    logger.warning(f"Failed to load config for {name}: {e}")
+                    return name, None
+
+        # Configs never change, so only sets not held yet are fetched
+        new = [name for name in names if name not in self.configs]
+        fetched = {name: config for name, config in await asyncio.gather(*[load(n) for n in new]) if config}
+        if listed:
+            # Held sets that are no longer listed have been deleted
+            configs = {name: self.configs[name] for name in names if name in self.configs}
+        else:
+            configs = dict(self.configs)
+        configs.update(fetched)
+        self.configs = configs
+        self.refreshes += 1
+        self.last_refresh = time.time()
+        self.last_refresh_seconds = time.perf_counter() - started
+        self.last_error = None if listed else "listing unavailable"
+        self.loaded.set()
+        logger.info(f"Image set registry: {len(configs)} sets ({len(fetched)} new) loaded in {self.last_refresh_seconds:.2f} s")
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Image set registry refresh failed: {e}")
+                # An empty registry still serves lazily; don't hold up readiness
+                self.loaded.set()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        """Preload in the background, then refresh periodically."""
+        if self.task is None:
+            self.task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def stats(self):
+        return {
+            "image_sets": len(self.configs),
+            "loaded": self.loaded.is_set(),
+            "refreshes": self.refreshes,
+            "last_refresh": self.last_refresh,
+            "last_refresh_ms": round(self.last_refresh_seconds * 1000, 1) if self.last_refresh_seconds else None,
+            "refresh_interval": self.refresh_interval,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,127 @@
+"""
+Per-image label bundles: every label of an image set in one small file.
+
+Labels of a finished image don't change, so instead of asking the database
+tile by tile a viewer downloads {image_set}.labels once (revalidated with its
+ETag) and looks labels up locally.
+
+Layout (little-endian):
+
+    preamble  "NLLB" magic, u16 version, u32 header length
+    header    UTF-8 JSON: imageSet, classes, dtype, labelCount, and per level
+              {z, cols, rows, offset, length} locating its block after the header
+    blocks    one zlib stream per zoom level: a row-major (rows, cols) grid of
+              class ids, 0 for no label and i + 1 for classes[i]
+
+The grids are mostly runs of a few values, so they compress to a few KB even
+for deep pyramids. Browsers can inflate a block with DecompressionStream("deflate").
+
+    DATABASE_URL=... python label_bundle.py --image-set star_birth --output-dir ./tiles
+"""
+import os
+import json
+import zlib
+import struct
+import asyncio
+import argparse
+import numpy as np
+
+MAGIC = b"NLLB"
+VERSION = 1
+PREAMBLE = struct.Struct("<4sHI")
+SELECT_IMAGE_LABELS = "SELECT z, x, y, value FROM tile_labels WHERE image_set = $1"
+
+
+def bundle_path(root, image_set):
+    return os.path.join(root, f"{image_set}.labels")
+
+
+def build_bundle(image_set, rows):
+    """Bundle bytes for an iterable of (z, x, y, value) rows."""
+    classes = {}
+    by_level = {}
+    for z, x, y, value in rows:
+        class_id = classes.setdefault(value, len(classes) + 1)
+        by_level.setdefault(z, []).append((x, y, class_id))
+
+    dtype = np.uint8 if len(classes) < 256 else np.uint16
+    levels = []
+    blocks = []
+    offset = 0
+    for z in sorted(by_level):
+        coords = np.array(by_level[z], dtype=np.int64)
+        cols = int(coords[:, 0].max()) + 1
+        grid_rows = int(coords[:, 1].max()) + 1
+        grid = np.zeros((grid_rows, cols), dtype=dtype)
+        grid[coords[:, 1], coords[:, 0]] = coords[:, 2]
+        block = zlib.compress(grid.astype(grid.dtype.newbyteorder("<")).tobytes(), 9)
+        levels.append({"z": z, "cols": cols, "rows": grid_rows, "offset": offset, "length": len(block)})
+        blocks.append(block)
+        offset += len(block)
+
+    header = json.dumps({
+        "imageSet": image_set,
+        "classes": list(classes),
+        "dtype": np.dtype(dtype).name,
+        "labelCount": sum(len(entries) for entries in by_level.values()),
+        "levels": levels,
+    }).encode("utf-8")
+    return PREAMBLE.pack(MAGIC, VERSION, len(header)) + header + b"".join(blocks)
+
+
+def bundle_header(data):
+    magic, version, header_length = PREAMBLE.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a label bundle (or an unsupported version)")
+    return json.loads(bytes(data[PREAMBLE.size:PREAMBLE.size + header_length]))
+
+
+def read_bundle(data):
+    """(header, {z: class id grid}) from bundle bytes."""
+    header = bundle_header(data)
+    base = PREAMBLE.size + PREAMBLE.unpack_from(data)[2]
+    dtype = np.dtype(header["dtype"]).newbyteorder("<")
+    grids = {}
+    for level in header["levels"]:
+        block = data[base + level["offset"]:base + level["offset"] + level["length"]]
+        grids[level["z"]] = np.frombuffer(zlib.decompress(block), dtype=dtype).reshape(level["rows"], level["cols"])
+    return header, grids
+
+
+def write_bundle(path, data):
+    """Replace the bundle atomically so readers never see a partial file."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+async def export_bundle(store, image_set, root):
+    """Build {root}/{image_set}.labels from tile_labels. Returns the bundle header."""
+    rows = await store.fetch(SELECT_IMAGE_LABELS, image_set)
+    data = await asyncio.to_thread(build_bundle, image_set, ((r["z"], r["x"], r["y"], r["value"]) for r in rows))
+    await asyncio.to_thread(write_bundle, bundle_path(root, image_set), data)
+    return {**bundle_header(data), "bytes": len(data)}
+
+
+async def main(image_set, root):
+    from label_store import LabelStore
+    store = LabelStore(os.environ["DATABASE_URL"], min_size=1, max_size=1, query_timeout=300)
+    await store.open()
+    try:
+        header = await export_bundle(store, image_set, root)
+    finally:
+        await store.close()
+    print(f"✅ Wrote {bundle_path(root, image_set)}: {header['labelCount']} labels, "
+          f"{len(header['classes'])} classes, {len(header['levels'])} levels, {header['bytes']} bytes")
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Export the labels of an image set as a label bundle.")
+    parser.add_argument("--image-set", required=True)
+    parser.add_argument("--output-dir", default=os.environ.get("LABEL_BUNDLES_DIR", "./tiles"))
+    args = parser.parse_args()
+    asyncio.run(main(args.image_set, args.output_dir))
@@ -0,0 +1,161 @@
+import sys
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+# Rough per-entry overhead of the OrderedDict slot and the (value, expires_at) tuple
+ENTRY_OVERHEAD = 120
+
+
+class LabelCache:
+    """
+    Bounded LRU of tile label lookups with TTL expiry.
+
+    Each entry is a (value, expires_at) tuple; value None records that the
+    database has no label for the key (negative caching, with its own TTL).
+    Label strings are interned, so the handful of class names is stored once.
+    Expired entries are dropped lazily when they are looked up or reach the
+    LRU end.
+
+    get_many coalesces concurrent misses: a key that is already being loaded
+    by another request is awaited instead of queried again.
+    """
+
+    def __init__(self, max_entries=100_000, max_bytes=32 * 1024 * 1024, ttl=300.0, negative_ttl=60.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def _size(key: str) -> int:
+        return sys.getsizeof(key) + ENTRY_OVERHEAD
+
+    def _remove(self, key: str):
+        self.entries.pop(key)
+        self.current_bytes -= self._size(key)
+
+    def lookup(self, key: str, now: Optional[float] = None):
+        """(found, value) where value None is a cached 'no label'."""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        value, expires_at = entry
+        if expires_at <= (now if now is not None else time.monotonic()):
+            self._remove(key)
+            self.expired += 1
+            self.misses += 1
+            return False, None
+        self.entries.move_to_end(key)
+        if value is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return True, value
+
+    def put(self, key: str, value: Optional[str], now: Optional[float] = None):
+        now = now if now is not None else time.monotonic()
+        if key in self.entries:
+            self._remove(key)
+        if value is not None:
+            value = sys.intern(value)
+        self.entries[key] = (value, now + (self.ttl if value is not None else self.negative_ttl))
+        self.current_bytes += self._size(key)
+        while len(self.entries) > self.max_entries or self.current_bytes > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, key: str):
+        if key in self.entries:
+            self._remove(key)
+
+    async def get_many(
+        self,
+        keys: Iterable[str],
+        loader: Callable[[List[str]], Awaitable[Dict[str, str]]],
+    ) -> Dict[str, str]:
+        """
+        Labels for the keys that have one. Keys that are neither cached nor being
+        loaded elsewhere are fetched with a single loader(keys) call.
+        """
+        now = time.monotonic()
+        result = {}
+        missing = []
+        waiting = []
+        for key in dict.fromkeys(keys):
+            found, value = self.lookup(key, now)
+            if found:
+                if value is not None:
+                    result[key] = value
+                continue
+            future = self.inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                waiting.append((key, future))
+                continue
+            missing.append(key)
+
+        if missing:
+            loop = asyncio.get_running_loop()
+            futures = {key: loop.create_future() for key in missing}
+            self.inflight.update(futures)
+            # The load runs as its own task so a cancelled request can't abort it for the waiters
+            loaded = await asyncio.shield(asyncio.ensure_future(self._load(missing, futures, loader)))
+            for key in missing:
+                value = loaded.get(key)
+                if value is not None:
+                    result[key] = value
+
+        for key, future in waiting:
+            # shield: a cancelled waiter must not cancel the load other requests share
+            value = await asyncio.shield(future)
+            if value is not None:
+                result[key] = value
+        return result
+
+    async def _load(self, missing, futures, loader):
+        try:
+            loaded = await loader(missing)
+        except Exception as e:
+            for future in futures.values():
+                future.set_exception(e)
+                future.exception()  # waiters re-raise it; don't warn if there are none
+            raise
+        finally:
+            for key in missing:
+                self.inflight.pop(key, None)
+        now = time.monotonic()
+        for key in missing:
+            value = loaded.get(key)
+            self.put(key, value, now)
+            futures[key].set_result(value)
+        return loaded
+
+    def stats(self):
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.current_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "coalesced": self.coalesced,
+            "inflight": len(self.inflight),
+            "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,175 @@
+"""
+Async access to the label database.
+
+An asyncpg pool replaces the psycopg2 SimpleConnectionPool: queries no longer
+block the event loop, and the pool is safe to share between concurrent
+requests. Every query runs with an acquire timeout and a statement timeout, so
+a slow or saturated database turns into a quick error instead of piling up
+requests. asyncpg prepares each distinct statement once per connection and
+reuses it, so the label lookups are parsed and planned once.
+
+Pool-wait metrics (how long requests queue for a connection) are the signal
+for sizing the pool: steady waits mean max_size is too small, idle connections
+mean it is too large.
+"""
+import time
+import asyncio
+import asyncpg
+
+import metrics
+
+SELECT_LABELS = "SELECT file_path, value FROM nlarge WHERE file_path = ANY($1::text[])"
+# Range scan on the (image_set, z, x, y) primary key of tile_labels (see migrate_labels.py)
+SELECT_LABELS_IN_RECT = (
+    "SELECT x, y, value FROM tile_labels "
+    "WHERE image_set = $1 AND z = $2 AND x BETWEEN $3 AND $4 AND y BETWEEN $5 AND $6 "
+    "ORDER BY x, y"
+)
+UPSERT_TILE_LABEL = (
+    "INSERT INTO tile_labels (image_set, z, x, y, value, model_version) VALUES ($1, $2, $3, $4, $5, $6) "
+    "ON CONFLICT (image_set, z, x, y) DO UPDATE "
+    "SET value = EXCLUDED.value, model_version = EXCLUDED.model_version, updated_at = now()"
+)
+UPSERT_URL_LABEL = (
+    "INSERT INTO nlarge (file_path, value) VALUES ($1, $2) "
+    "ON CONFLICT (file_path) DO UPDATE SET value = EXCLUDED.value"
+)
+
+
+class LabelStoreTimeout(Exception):
+    """No connection became free, or a query ran past its timeout."""
+
+
+class LabelStore:
+    def __init__(self, dsn, min_size=2, max_size=20, acquire_timeout=2.0, query_timeout=5.0,
+                 statement_cache_size=100):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.query_timeout = query_timeout
+        self.statement_cache_size = statement_cache_size
+        self.pool = None
+        self.open_lock = asyncio.Lock()
+        self.acquires = 0
+        self.waiting = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.acquire_timeouts = 0
+        self.queries = 0
+        self.query_total = 0.0
+        self.query_timeouts = 0
+        self.errors = 0
+
+    async def open(self):
+        """Create the pool unless it exists; concurrent callers wait for the same one."""
+        async with self.open_lock:
+            if self.pool is not None:
+                return
+            # A statement_cache_size of 0 disables prepared statements, for poolers
+            # (e.g. PgBouncer in transaction mode) that can't keep them per session
+            self.pool = await asyncpg.create_pool(
+                self.dsn,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                command_timeout=self.query_timeout,
+                statement_cache_size=self.statement_cache_size,
+            )
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def _run(self, operation):
+        """operation(conn) on a pooled connection, waiting at most acquire_timeout for one."""
+        if self.pool is None:
+            raise LabelStoreTimeout("Database pool is not open yet")
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            conn = await self.pool.acquire(timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.acquire_timeouts += 1
+            raise LabelStoreTimeout(f"No database connection free within {self.acquire_timeout} s")
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - started
+        self.acquires += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        metrics.DB_ACQUIRE_SECONDS.observe(waited)
+        metrics.record_timing("db_wait", waited)
+
+        try:
+            query_started = time.perf_counter()
+            try:
+                return await operation(conn)
+            except asyncio.TimeoutError:
+                self.query_timeouts += 1
+                raise LabelStoreTimeout(f"Query ran longer than {self.query_timeout} s")
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                elapsed = time.perf_counter() - query_started
+                self.queries += 1
+                self.query_total += elapsed
+                metrics.DB_QUERY_SECONDS.observe(elapsed)
+                metrics.record_timing("db", elapsed)
+        finally:
+            await self.pool.release(conn)
+
+    async def fetch(self, query, *args):
+        """Rows for a query, waiting at most acquire_timeout for a connection."""
+        return await self._run(lambda conn: conn.fetch(query, *args, timeout=self.query_timeout))
+
+    async def upsert_labels(self, rows, model_version, url_base):
+        """
+        Store (image_set, z, x, y, value) labels in tile_labels and nlarge in one
+        transaction; executemany pipelines the rows over the connection.
+        """
+        async def upsert(conn):
+            async with conn.transaction():
+                await conn.executemany(UPSERT_TILE_LABEL, [(*row, model_version) for row in rows],
+                                       timeout=self.query_timeout)
+                await conn.executemany(UPSERT_URL_LABEL, [
+                    (f"{url_base}/{image_set}/{z}/{x}/{y}.png", value) for image_set, z, x, y, value in rows
+                ], timeout=self.query_timeout)
+        await self._run(upsert)
+
+    async def load_labels(self, file_paths):
+        """file_path -> value for the paths that have a label."""
+        rows = await self.fetch(SELECT_LABELS, list(file_paths))
+        return {row["file_path"]: row["value"] for row in rows}
+
+    async def labels_in_rect(self, image_set, z, x0, y0, x1, y1):
+        """
+        Labels of the tiles x0..x1, y0..y1 (inclusive) at one zoom level, column-wise:
+        x and y lists, an index into classes for each tile, and the classes themselves.
+        """
+        rows = await self.fetch(SELECT_LABELS_IN_RECT, image_set, z, x0, x1, y0, y1)
+        classes = {}
+        xs, ys, labels = [], [], []
+        for row in rows:
+            xs.append(row["x"])
+            ys.append(row["y"])
+            labels.append(classes.setdefault(row["value"], len(classes)))
+        return {"x": xs, "y": ys, "label": labels, "classes": list(classes)}
+
+    def stats(self):
+        return {
+            "size": self.pool.get_size() if self.pool else 0,
+            "idle": self.pool.get_idle_size() if self.pool else 0,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "waiting": self.waiting,
+            "acquires": self.acquires,
+            "acquire_timeouts": self.acquire_timeouts,
+            "wait_avg_ms": round(self.wait_total / self.acquires * 1000, 3) if self.acquires else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+            "queries": self.queries,
+            "query_avg_ms": round(self.query_total / self.queries * 1000, 3) if self.queries else 0.0,
+            "query_timeouts": self.query_timeouts,
+            "errors": self.errors,
+        }
@@ -0,0 +1,53 @@
+"""
+Logging setup for the API server.
+
+LOG_LEVEL picks the level (INFO by default; DEBUG used to be hard-coded and
+logged every upstream request); an unknown name falls back to INFO with a
+warning instead of stopping the server at startup. LOG_FORMAT=json writes one JSON object per
+line with any `extra={...}` fields of the record as top-level keys, for log
+pipelines that index fields instead of parsing messages.
+"""
+import json
+import logging
+import time
+
+# Attributes every LogRecord has; anything else came from extra={...}
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level="INFO", fmt="text"):
+    requested = level
+    if isinstance(level, str):
+        # getLevelName maps unknown names to the string "Level X" rather than raising
+        level = logging.getLevelName(level.strip().upper())
+    invalid = not isinstance(level, int)
+    if invalid:
+        level = logging.INFO
+    handler = logging.StreamHandler()
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+    logging.basicConfig(level=level, handlers=[handler], force=True)
+    if invalid:
+        logging.getLogger(__name__).warning(f"Unknown log level {requested!r}, using INFO")
+    # httpx logs every upstream request at INFO; only let that through when debugging
+    for name in ("httpx", "httpcore"):
+        logging.getLogger(name).setLevel(level if level <= logging.DEBUG else logging.WARNING)
@@ -1,35 +1,162 @@
 import os
-import io
 import json
-from fastapi import FastAPI, HTTPException, Response, Query, Body
-from fastapi.responses import FileResponse
+import struct
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Response, Query, Body, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image, ImageDraw, ImageFont
+from starlette.background import BackgroundTask
 from typing import List
 import logging
 
 # --- New Imports ---
 from dotenv import load_dotenv
-import psycopg2
-from psycopg2.pool import SimpleConnectionPool
-import time
+import httpx
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import classify_service
+import dynamic_tiles
+from image_registry import ImageSetRegistry
+import metrics
+import tile_transcode
+from tile_prefetch import TilePrefetcher
+from label_bundle import bundle_path, export_bundle
+from label_cache import LabelCache
+from label_store import LabelStore, LabelStoreTimeout
+from log_format import configure_logging
+from profiler import SamplingProfiler
+from tile_cache import CachedTile, TieredTileCache, etag_matches, make_etag
+from tile_storage import (
+    ArchiveStorage, GCSHTTPStorage, LocalDirectoryStorage, StorageError, TileFile, TileNotFound, TileStream,
+    check_segment,
+)
 # --------------------
 
-# Simple in-memory cache for labels
-label_cache = {}
-CACHE_EXPIRY = 300  # 5 minutes
-app = FastAPI()
 
-# --- Logging Setup ---
-logging.basicConfig(level=logging.DEBUG)  # Set to DEBUG for detailed output
-logger = logging.getLogger(__name__)
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Startup returns right away: the DB pool and the image-set registry come up in
+    the background and /health/ready says when. Shutdown closes what was opened.
+    """
+    start_background_resources()
+    try:
+        yield
+    finally:
+        await close_resources()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # --- Load environment variables from .env file ---
 load_dotenv()
 # --------------------------------------------------------
 
+# --- Logging Setup ---
+# LOG_LEVEL=DEBUG for detailed output (including every upstream request); LOG_FORMAT=json for structured logs
+configure_logging(os.environ.get("LOG_LEVEL", "INFO"), os.environ.get("LOG_FORMAT", "text"))
+logger = logging.getLogger(__name__)
+
 # --- Configuration ---
-TILESETS_DIR = "./tiles"
+# Where pyramids are read from: "gcs" (public bucket over HTTP), "local" (directories
+# under TILESETS_DIR) or "archive" ({image_set}.tiles archives under TILESETS_DIR)
+TILE_STORAGE = os.environ.get("TILE_STORAGE", "gcs")
+TILESETS_DIR = os.environ.get("TILESETS_DIR", "./tiles")
+BUCKET_NAME = 'n-large'
+GCS_BASE_URL = os.environ.get("GCS_BASE_URL", "https://storage.googleapis.com").rstrip("/")
+
+# --- Upstream HTTP client configuration ---
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "15"))
+HTTP_POOL_TIMEOUT = float(os.environ.get("HTTP_POOL_TIMEOUT", "10"))
+TILE_STREAM_CHUNK_SIZE = 64 * 1024
+
+# --- Tile cache configuration ---
+# Pyramids are immutable once generated, so clients may keep tiles for a year.
+# The disk tier's byte budget is tracked per process: with several workers, give
+# each its own TILE_CACHE_DIR and a share of TILE_CACHE_DISK_BYTES.
+TILE_CACHE_MEMORY_BYTES = int(os.environ.get("TILE_CACHE_MEMORY_BYTES", str(256 * 1024 * 1024)))
+TILE_CACHE_DIR = os.environ.get("TILE_CACHE_DIR", "./tile_cache")
+TILE_CACHE_DISK_BYTES = int(os.environ.get("TILE_CACHE_DISK_BYTES", str(4 * 1024 * 1024 * 1024)))
+TILE_CACHE_CONTROL = os.environ.get("TILE_CACHE_CONTROL", "public, max-age=31536000, immutable")
+
+tile_cache = TieredTileCache(TILE_CACHE_MEMORY_BYTES, TILE_CACHE_DIR, TILE_CACHE_DISK_BYTES)
+
+# --- Tile format negotiation ---
+# Formats offered to clients that accept them, in order of preference; stored PNGs are
+# transcoded on first request and cached per (tile, format, quality). Off by default:
+# a negotiated tile is always read whole and served from memory, so it gives up the
+# streaming proxy on remote misses and sendfile for local tiles in exchange for
+# smaller responses. Browsers send image/webp in Accept, so e.g. TILE_FORMATS=webp
+# moves nearly all viewer traffic onto the transcoding path.
+TILE_FORMATS = [f.strip() for f in os.environ.get("TILE_FORMATS", "").split(",") if f.strip() and f.strip() != "png"]
+TILE_QUALITY = {
+    "webp": int(os.environ.get("TILE_QUALITY_WEBP", "80")),
+    "avif": int(os.environ.get("TILE_QUALITY_AVIF", "60")),
+    "jpeg": int(os.environ.get("TILE_QUALITY_JPEG", "85")),
+}
+for tile_format in TILE_FORMATS:
+    if tile_format not in tile_transcode.FORMATS:
+        raise ValueError(f"Unknown tile format in TILE_FORMATS: {tile_format}")
+
+# --- Image set registry ---
+# Every config.json is preloaded at startup and re-listed this often (seconds).
+# IMAGE_SETS names sets to load when the backend can't list them (e.g. no bucket listing access).
+IMAGE_REGISTRY_REFRESH = float(os.environ.get("IMAGE_REGISTRY_REFRESH", "300"))
+IMAGE_SETS = [name.strip() for name in os.environ.get("IMAGE_SETS", "").split(",") if name.strip()]
+
+# --- Batch fetch and prefetching ---
+# Most tiles one /tiles-batch request may ask for, and how many it reads at once
+TILE_BATCH_MAX = int(os.environ.get("TILE_BATCH_MAX", "256"))
+TILE_BATCH_CONCURRENCY = int(os.environ.get("TILE_BATCH_CONCURRENCY", "16"))
+# Warm the cache with the neighbours and children of every requested tile (remote backends only)
+TILE_PREFETCH = os.environ.get("TILE_PREFETCH", "0") == "1"
+TILE_PREFETCH_BUDGET = int(os.environ.get("TILE_PREFETCH_BUDGET", "12"))
+TILE_PREFETCH_CONCURRENCY = int(os.environ.get("TILE_PREFETCH_CONCURRENCY", "8"))
+
+# --- Observability ---
+# /debug/profiler endpoints; they can start a sampling profiler in the running server
+PROFILER_ENABLED = os.environ.get("PROFILER_ENABLED", "0") == "1"
+
+# --- Dynamic rendering configuration ---
+# {image_set}.pyramid/ float levels or {image_set}.fits sources for /dynamic tiles
+DYNAMIC_SOURCES_DIR = os.environ.get("DYNAMIC_SOURCES_DIR", TILESETS_DIR)
+DYNAMIC_RENDER_WORKERS = int(os.environ.get("DYNAMIC_RENDER_WORKERS", str(os.cpu_count() or 1)))
+
+# --- On-demand classification ---
+# Exported model artifact (ai/src/export.py); the /classify endpoints are off without it
+CLASSIFIER_MODEL = os.environ.get("CLASSIFIER_MODEL")
+CLASSIFY_MAX_BATCH = int(os.environ.get("CLASSIFY_MAX_BATCH", "32"))
+CLASSIFY_MAX_WAIT_MS = float(os.environ.get("CLASSIFY_MAX_WAIT_MS", "10"))
+# Finished batches whose labels may be in flight to the DB at once
+CLASSIFY_MAX_WRITES = int(os.environ.get("CLASSIFY_MAX_WRITES", "2"))
+CLASSIFY_TORCH_THREADS = int(os.environ.get("CLASSIFY_TORCH_THREADS", "0")) or None
+CLASSIFY_MAX_TILES = int(os.environ.get("CLASSIFY_MAX_TILES", "1024"))
+# nlarge and the label cache key labels by the tile's bucket URL
+TILE_LABEL_URL_BASE = f"https://storage.googleapis.com/{BUCKET_NAME}"
+
+# --- Label cache configuration ---
+LABEL_CACHE_MAX_ENTRIES = int(os.environ.get("LABEL_CACHE_MAX_ENTRIES", "200000"))
+LABEL_CACHE_MAX_BYTES = int(os.environ.get("LABEL_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+LABEL_CACHE_TTL = float(os.environ.get("LABEL_CACHE_TTL", "300"))  # 5 minutes
+LABEL_CACHE_NEGATIVE_TTL = float(os.environ.get("LABEL_CACHE_NEGATIVE_TTL", "60"))
+
+# Largest tile rectangle /labels/{image_set}/{z} answers in one request
+LABEL_BBOX_MAX_TILES = int(os.environ.get("LABEL_BBOX_MAX_TILES", "65536"))
+
+# Per-image label bundles ({image_set}.labels, see label_bundle.py). Clients keep
+# them and revalidate with the ETag, which changes whenever a bundle is rebuilt.
+LABEL_BUNDLES_DIR = os.environ.get("LABEL_BUNDLES_DIR", TILESETS_DIR)
+LABEL_BUNDLE_CACHE_CONTROL = os.environ.get("LABEL_BUNDLE_CACHE_CONTROL", "public, no-cache")
+# Seconds between an on-demand classification and the rebuild of its image's bundle;
+# labels written in the meantime are picked up by the same rebuild
+LABEL_BUNDLE_REBUILD_DELAY = float(os.environ.get("LABEL_BUNDLE_REBUILD_DELAY", "5"))
+
+label_cache = LabelCache(LABEL_CACHE_MAX_ENTRIES, LABEL_CACHE_MAX_BYTES, LABEL_CACHE_TTL, LABEL_CACHE_NEGATIVE_TTL)
 
 # --- Neon DB Configuration ---
 DATABASE_URL = os.environ.get("DATABASE_URL")
@@ -37,28 +164,53 @@ logger.info(f"🔍 DATABASE_URL found: {'Yes' if DATABASE_URL else 'No'}")
 if DATABASE_URL:
     logger.info(f"🔗 DATABASE_URL starts with: {DATABASE_URL[:20]}...")
 
+# Label queries go through an asyncpg pool so they never block the event loop
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "20"))
+DB_ACQUIRE_TIMEOUT = float(os.environ.get("DB_ACQUIRE_TIMEOUT", "2"))
+DB_QUERY_TIMEOUT = float(os.environ.get("DB_QUERY_TIMEOUT", "5"))
+# 0 disables prepared statements (needed behind PgBouncer in transaction mode)
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", "100"))
+# The pool is opened in the background; failed attempts are retried this often (seconds)
+DB_CONNECT_RETRY = float(os.environ.get("DB_CONNECT_RETRY", "30"))
+
 db_pool = None
 if DATABASE_URL:
-    try:
-        db_pool = SimpleConnectionPool(5, 50, dsn=DATABASE_URL)  # Increased pool size
-        logger.info("✅ Connected to Neon PostgreSQL pool (5-50 connections)")
-    except Exception as e:
-        logger.error(f"⚠️ Failed to connect to Neon PostgreSQL: {str(e)}")
+    db_pool = LabelStore(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        acquire_timeout=DB_ACQUIRE_TIMEOUT,
+        query_timeout=DB_QUERY_TIMEOUT,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+    )
 else:
     logger.warning("⚠️ DATABASE_URL not found in environment variables. The /tile-label endpoint will not work.")
-# -----------------------------
 
-# GCS Client Initialization
-try:
-    from google.cloud import storage
-    BUCKET_NAME = 'n-large'
-    YOUR_PROJECT_ID = 'gen-lang-client-0849924728'
-    storage_client = storage.Client(project=YOUR_PROJECT_ID)
-    bucket = storage_client.bucket(BUCKET_NAME)
-    list(bucket.list_blobs(max_results=1))
-    logger.info(f"✅ Connected to GCS bucket: gs://{bucket.name}")
-except Exception as e:
-    logger.error(f"⚠️ GCS not available ({str(e)[:100]}...). API might not function correctly.")
+
+# "disabled", "connecting", "ok" or "error"; reported by /health/ready
+db_state = "connecting" if db_pool else "disabled"
+db_error = None
+
+
+async def open_db_pool():
+    """
+    Open the pool without holding up startup. Until it is open, label endpoints
+    answer 503; if the database is unreachable, keep retrying in the background.
+    """
+    global db_state, db_error
+    while True:
+        try:
+            await db_pool.open()
+            db_state, db_error = "ok", None
+            logger.info(f"✅ Connected to Neon PostgreSQL pool ({DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE} connections)")
+            return
+        except Exception as e:
+            db_state, db_error = "error", str(e)
+            logger.error(f"⚠️ Failed to connect to Neon PostgreSQL, retrying in {DB_CONNECT_RETRY:.0f} s: {e}")
+        await asyncio.sleep(DB_CONNECT_RETRY)
+
+# -----------------------------
 
 app.add_middleware(
     CORSMiddleware,
@@ -67,120 +219,432 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so latency and Server-Timing cover the whole request
+app.add_middleware(metrics.MetricsMiddleware)
+
+# --- Tile storage backend ---
+def create_tile_storage():
+    if TILE_STORAGE == "local":
+        logger.info(f"Serving tiles from local directory {TILESETS_DIR}")
+        return LocalDirectoryStorage(TILESETS_DIR)
+    if TILE_STORAGE == "archive":
+        logger.info(f"Serving tiles from archives in {TILESETS_DIR}")
+        return ArchiveStorage(TILESETS_DIR)
+    if TILE_STORAGE == "gcs":
+        logger.info(f"Serving tiles from {GCS_BASE_URL}/{BUCKET_NAME}")
+        return GCSHTTPStorage(
+            GCS_BASE_URL,
+            BUCKET_NAME,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=HTTP_CONNECT_TIMEOUT,
+                read=HTTP_READ_TIMEOUT,
+                write=HTTP_READ_TIMEOUT,
+                pool=HTTP_POOL_TIMEOUT,
+            ),
+            chunk_size=TILE_STREAM_CHUNK_SIZE,
+        )
+    raise ValueError(f"Unknown TILE_STORAGE backend: {TILE_STORAGE}")
+
+
+tile_storage = create_tile_storage()
+image_registry = ImageSetRegistry(tile_storage, IMAGE_REGISTRY_REFRESH, IMAGE_SETS)
+
+
+def tile_headers(etag: str) -> dict:
+    headers = {"ETag": etag, "Cache-Control": TILE_CACHE_CONTROL}
+    if TILE_FORMATS:
+        # The body depends on the Accept header, so shared caches must key on it
+        headers["Vary"] = "Accept"
+    return headers
+
+
+def tile_response(entry, if_none_match=None, media_type="image/png") -> Response:
+    headers = tile_headers(entry.etag)
+    if etag_matches(if_none_match, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type=media_type, headers=headers)
+
+
+def file_tile_response(tile: TileFile, if_none_match=None) -> Response:
+    headers = tile_headers(tile.etag)
+    if etag_matches(if_none_match, tile.etag):
+        return Response(status_code=304, headers=headers)
+    # FileResponse hands the file to the server's sendfile/pathsend path when available
+    return FileResponse(tile.path, media_type="image/png", headers=headers)
+
+
+async def stream_tile_response(tile: TileStream, cache_key: str, if_none_match=None) -> Response:
+    """
+    Relay a remote tile to the client chunk by chunk, keeping a copy of the chunks
+    so the finished tile can be put in the cache. The upstream response is closed
+    once the body has been sent (or the client went away).
+    """
+    if tile.etag is None:
+        # Without a strong upstream validator the ETag has to come from the body itself
+        try:
+            body = b"".join([chunk async for chunk in tile.chunks])
+        except httpx.HTTPError:
+            raise HTTPException(status_code=404, detail="Tile not found")
+        finally:
+            await tile.aclose()
+        return tile_response(await tile_cache.put(cache_key, body), if_none_match)
+
+    headers = tile_headers(tile.etag)
+    if etag_matches(if_none_match, tile.etag):
+        await tile.aclose()
+        return Response(status_code=304, headers=headers)
+    if tile.content_length is not None:
+        headers["Content-Length"] = tile.content_length
+
+    async def relay():
+        chunks = []
+        async for chunk in tile.chunks:
+            chunks.append(chunk)
+            yield chunk
+        await tile_cache.put(cache_key, b"".join(chunks), tile.etag)
+
+    return StreamingResponse(
+        relay(),
+        media_type="image/png",
+        headers=headers,
+        background=BackgroundTask(tile.aclose),
+    )
+
+
+async def read_tile(image_set: str, z: int, x: int, y: int) -> CachedTile:
+    """
+    Whole tile bytes, through the tile cache when the backend is remote.
+    """
+    cache_key = f"{image_set}/{z}/{x}/{y}.png"
+    if tile_storage.cacheable:
+        entry = await tile_cache.get(cache_key)
+        if entry is not None:
+            return entry
+    try:
+        entry = await tile_storage.read_tile(image_set, z, x, y)
+    except TileNotFound:
+        raise HTTPException(status_code=404, detail="Tile not found")
+    if tile_storage.cacheable:
+        await tile_cache.put(cache_key, entry.body, entry.etag)
+    return entry
+
+
+def transcoded_etag(source_etag: str, fmt: str, quality: int) -> str:
+    # Weak-comparison safe: strip W/ and quotes, then tag the variant
+    inner = source_etag.removeprefix("W/").strip('"')
+    return f'"{inner}-{fmt}{quality}"'
+
+
+def tile_cache_key(image_set: str, z: int, x: int, y: int, fmt: str = "png") -> str:
+    if fmt == "png":
+        return f"{image_set}/{z}/{x}/{y}.png"
+    return f"{image_set}/{z}/{x}/{y}.{fmt}?q={TILE_QUALITY[fmt]}"
+
+
+async def read_transcoded_tile(image_set: str, z: int, x: int, y: int, fmt: str) -> CachedTile:
+    """
+    The tile in another format, transcoded in the worker pool on first request and
+    cached under (tile, format, quality) after that.
+    """
+    quality = TILE_QUALITY[fmt]
+    cache_key = tile_cache_key(image_set, z, x, y, fmt)
+    entry = await tile_cache.get(cache_key)
+    if entry is None:
+        source = await read_tile(image_set, z, x, y)
+        body = await run_render(tile_transcode.transcode, bytes(source.body), fmt, quality)
+        entry = await tile_cache.put(cache_key, body, transcoded_etag(source.etag, fmt, quality))
+    return entry
+
+
+async def transcoded_tile_response(image_set: str, z: int, x: int, y: int, fmt: str, if_none_match=None) -> Response:
+    entry = await read_transcoded_tile(image_set, z, x, y, fmt)
+    return tile_response(entry, if_none_match, tile_transcode.FORMATS[fmt][0])
+
+
+async def read_tile_as(image_set: str, z: int, x: int, y: int, fmt: str) -> CachedTile:
+    if fmt == "png":
+        return await read_tile(image_set, z, x, y)
+    return await read_transcoded_tile(image_set, z, x, y, fmt)
+
+
+tile_prefetcher = None
+if TILE_PREFETCH and tile_storage.cacheable:
+    tile_prefetcher = TilePrefetcher(
+        tile_cache, read_tile_as, image_registry.get, tile_cache_key,
+        budget=TILE_PREFETCH_BUDGET, concurrency=TILE_PREFETCH_CONCURRENCY,
+    )
+    logger.info(f"Prefetching up to {TILE_PREFETCH_BUDGET} neighbour/child tiles per request")
+
 
 # --- Endpoints ---
 @app.get("/info/{image_set}")
-async def get_image_info(image_set: str):
+async def get_image_info(request: Request, image_set: str):
     """
-    Fetch config.json directly via HTTP since bucket is public
+    config.json of an image set, from the image set registry
     """
-    import requests
-    
-    config_url = f"https://storage.googleapis.com/{BUCKET_NAME}/{image_set}/config.json"
-    
     try:
-        response = requests.get(config_url)
-        if response.status_code == 404:
-            raise HTTPException(status_code=404, detail="Image configuration not found.")
-        
-        response.raise_for_status()  # Raise exception for other HTTP errors
-        config_data = response.json()
-        
-        # Add direct GCS URL for tiles
-        config_data['tileSourceUrl'] = f"https://storage.googleapis.com/{BUCKET_NAME}/{image_set}"
-        
-        return config_data
-        
-    except requests.RequestException as e:
+        config_data = await image_registry.get(image_set)
+    except TileNotFound:
+        raise HTTPException(status_code=404, detail="Image configuration not found.")
+    except StorageError as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch config: {str(e)}")
+    return {**config_data, "tileSourceUrl": tile_source_url(request, image_set)}
+
+
+def tile_source_url(request: Request, image_set: str) -> str:
+    # Direct bucket URL when the backend has one, otherwise this server's /tiles route
+    return tile_storage.tile_source_url(image_set) or f"{str(request.base_url).rstrip('/')}/tiles/{image_set}"
+
+
+@app.get("/images")
+async def list_images(request: Request):
+    """
+    Every image set the registry knows, with its pyramid geometry
+    """
+    await image_registry.loaded.wait()
+    return {
+        "images": [
+            {"name": name, **config, "tileSourceUrl": tile_source_url(request, name)}
+            for name, config in image_registry.list()
+        ],
+    }
 
 
 @app.get("/tiles/{image_set}/{z}/{x}/{y}.png")
-async def get_tile(image_set: str, z: int, x: int, y: int):
+async def get_tile(request: Request, image_set: str, z: int, x: int, y: int):
     """
-    Proxy tiles from public GCS bucket via HTTP
+    Serve tiles from the storage backend. Remote tiles go through the memory/disk
+    cache and are streamed through on a miss; local tiles are sent straight from disk.
     """
-    import requests
-    
-    tile_url = f"https://storage.googleapis.com/{BUCKET_NAME}/{image_set}/{z}/{x}/{y}.png"
-    
+    cache_key = tile_cache_key(image_set, z, x, y)
+    if_none_match = request.headers.get("if-none-match")
+    fmt = tile_transcode.negotiate(request.headers.get("accept"), TILE_FORMATS)
+
+    if tile_prefetcher is not None:
+        # Warm the format this client will ask for next, if this tile was a miss
+        tile_prefetcher.on_request(image_set, z, x, y, fmt)
+
+    if fmt != "png":
+        return await transcoded_tile_response(image_set, z, x, y, fmt, if_none_match)
+
+    if tile_storage.cacheable:
+        entry = await tile_cache.get(cache_key)
+        if entry is not None:
+            return tile_response(entry, if_none_match)
+
     try:
-        response = requests.get(tile_url)
-        if response.status_code == 404:
-            raise HTTPException(status_code=404, detail="Tile not found")
-        
-        response.raise_for_status()
-        return Response(content=response.content, media_type="image/png")
-        
-    except requests.RequestException:
+        tile = await tile_storage.open_tile(image_set, z, x, y)
+    except TileNotFound:
         raise HTTPException(status_code=404, detail="Tile not found")
 
+    if isinstance(tile, TileFile):
+        return file_tile_response(tile, if_none_match)
+    if isinstance(tile, TileStream):
+        return await stream_tile_response(tile, cache_key, if_none_match)
+    return tile_response(tile, if_none_match)
+
+
+@app.get("/tiles-cache/stats")
+def get_tile_cache_stats():
+    """
+    Per-tier hit and miss counters for the tile cache
+    """
+    return tile_cache.stats()
+
+
+# One record per requested tile in a /tiles-batch response: z, x, y, found (0/1),
+# body length, all little-endian, followed by the body itself
+TILE_BATCH_RECORD = struct.Struct("<BIIBI")
+TILE_BATCH_MEDIA_TYPE = "application/x-nlarge-tiles"
+
+
+@app.post("/tiles-batch/{image_set}")
+async def get_tiles_batch(request: Request, image_set: str, body: dict = Body(...)):
+    """
+    Many tiles of one image in a single response, e.g. everything in the viewport.
+    Body: {"tiles": [[z, x, y], ...]}. Tiles are read concurrently and each is written
+    out as soon as it is ready, so records arrive in completion order, not request
+    order. Missing tiles get a record with found = 0 and no body. The format is
+    negotiated from the Accept header's image types, like /tiles, and reported in
+    X-Tile-Format.
+    """
+    try:
+        check_segment(image_set)
+        tiles = list(dict.fromkeys((int(z), int(x), int(y)) for z, x, y in body.get("tiles", [])))
+    except TileNotFound:
+        raise HTTPException(status_code=404, detail="Image set not found")
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail='Expected {"tiles": [[z, x, y], ...]}')
+    if len(tiles) > TILE_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {TILE_BATCH_MAX} tiles per request")
+    if any(not 0 <= z < 256 or x < 0 or y < 0 for z, x, y in tiles):
+        raise HTTPException(status_code=400, detail="Tile coordinates out of range")
+
+    fmt = tile_transcode.negotiate(request.headers.get("accept"), TILE_FORMATS)
+    limit = asyncio.Semaphore(TILE_BATCH_CONCURRENCY)
+
+    async def fetch(z, x, y):
+        async with limit:
+            if tile_prefetcher is not None:
+                tile_prefetcher.record_request(tile_cache_key(image_set, z, x, y, fmt))
+            try:
+                entry = await read_tile_as(image_set, z, x, y, fmt)
+            except HTTPException:
+                return TILE_BATCH_RECORD.pack(z, x, y, 0, 0)
+            return TILE_BATCH_RECORD.pack(z, x, y, 1, len(entry.body)) + bytes(entry.body)
+
+    async def records():
+        pending = [asyncio.ensure_future(fetch(z, x, y)) for z, x, y in tiles]
+        try:
+            for record in asyncio.as_completed(pending):
+                yield await record
+        finally:
+            for task in pending:
+                task.cancel()
+
+    return StreamingResponse(
+        records(),
+        media_type=TILE_BATCH_MEDIA_TYPE,
+        headers={"X-Tile-Format": fmt, "X-Tile-Count": str(len(tiles)), "Vary": "Accept"},
+    )
+
+
+@app.get("/tiles-prefetch/stats")
+def get_tile_prefetch_stats():
+    """
+    How much prefetching was done and how many prefetched tiles were requested afterwards
+    """
+    if tile_prefetcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **tile_prefetcher.stats()}
+
 
 @app.get("/tiles-debug/{image_set}/{z}/{x}/{y}.png")
-async def get_tile_debug(image_set: str, z: int, x: int, y: int):
+async def get_tile_debug(request: Request, image_set: str, z: int, x: int, y: int):
     """
-    Fetch tile from public GCS bucket via HTTP and add debug overlay
+    Fetch tile from the storage backend and add debug overlay
     """
-    import requests
-    
-    tile_url = f"https://storage.googleapis.com/{BUCKET_NAME}/{image_set}/{z}/{x}/{y}.png"
-    
+    entry = await read_tile(image_set, z, x, y)
+    fmt = tile_transcode.negotiate(request.headers.get("accept"), TILE_FORMATS)
+
+    # Decoding, drawing and re-encoding is CPU work; it runs in the worker pool
+    content = await run_render(tile_transcode.render_debug_tile, bytes(entry.body), z, x, y, fmt, TILE_QUALITY.get(fmt))
+    return Response(content=content, media_type=tile_transcode.FORMATS[fmt][0], headers={"Vary": "Accept"})
+
+# --- Dynamic rendering ---
+render_pool = None
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """
+    Worker processes for CPU-bound tile rendering; each keeps its own open memmaps.
+    """
+    global render_pool
+    if render_pool is None:
+        render_pool = ProcessPoolExecutor(DYNAMIC_RENDER_WORKERS)
+    return render_pool
+
+
+def close_render_pool():
+    global render_pool
+    if render_pool is not None:
+        render_pool.shutdown(cancel_futures=True)
+        render_pool = None
+
+
+async def run_render(func, *args):
     try:
-        response = requests.get(tile_url)
-        if response.status_code == 404:
+        with metrics.timed("render", metrics.RENDER_SECONDS, func.__name__):
+            return await asyncio.get_running_loop().run_in_executor(get_render_pool(), func, *args)
+    except dynamic_tiles.SourceNotFound:
+        raise HTTPException(status_code=404, detail="Image source not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/dynamic/{image_set}/info")
+async def get_dynamic_info(request: Request, image_set: str):
+    """
+    Pyramid geometry of a dynamic source, in the same shape as /info
+    """
+    config_data = await run_render(dynamic_tiles.describe_source, DYNAMIC_SOURCES_DIR, image_set)
+    config_data['tileSourceUrl'] = f"{str(request.base_url).rstrip('/')}/dynamic/{image_set}"
+    return config_data
+
+
+@app.get("/dynamic/{image_set}/{z}/{x}/{y}.png")
+async def get_dynamic_tile(
+    request: Request,
+    image_set: str,
+    z: int,
+    x: int,
+    y: int,
+    stretch: str = Query("asinh", description="linear, log, asinh or zscale"),
+    vmin: float = Query(None, description="Lower display limit (default: from the image statistics)"),
+    vmax: float = Query(None, description="Upper display limit (default: from the image statistics)"),
+    cmap: str = Query("gray", description="gray or any matplotlib colormap name"),
+):
+    """
+    Render a tile from the memory-mapped source with the requested display settings.
+    Results are cached per (source version, tile, stretch, vmin, vmax, cmap), so a
+    regenerated source is never answered with tiles rendered from the old one.
+    """
+    try:
+        check_segment(image_set)
+        version = dynamic_tiles.source_version(DYNAMIC_SOURCES_DIR, image_set)
+    except (TileNotFound, dynamic_tiles.SourceNotFound):
+        raise HTTPException(status_code=404, detail="Image source not found")
+    cache_key = (f"dynamic/{image_set}/{z}/{x}/{y}.png?v={version}"
+                 f"&stretch={stretch}&vmin={vmin}&vmax={vmax}&cmap={cmap}")
+    if_none_match = request.headers.get("if-none-match")
+
+    entry = await tile_cache.get(cache_key)
+    if entry is None:
+        body = await run_render(
+            dynamic_tiles.render_tile, DYNAMIC_SOURCES_DIR, image_set, z, x, y, stretch, vmin, vmax, cmap
+        )
+        if body is None:
             raise HTTPException(status_code=404, detail="Tile not found")
-        
-        response.raise_for_status()
-        img = Image.open(io.BytesIO(response.content))
-        
-        # Add debug overlay
-        draw = ImageDraw.Draw(img)
-        debug_text = f"Level: {z}\nCol (x): {x}\nRow (y): {y}"
-        try:
-            font = ImageFont.truetype("arial.ttf", 20)
-        except IOError:
-            font = ImageFont.load_default()
-        draw.rectangle([0, 0, img.width - 1, img.height - 1], outline="lime", width=2)
-        draw.text((10, 10), debug_text, fill="white", font=font)
-        
-        final_image_buffer = io.BytesIO()
-        img.save(final_image_buffer, format="PNG")
-        final_image_buffer.seek(0)
-        return Response(content=final_image_buffer.getvalue(), media_type="image/png")
-        
-    except requests.RequestException:
-        raise HTTPException(status_code=404, detail="Tile not found")
+        entry = await tile_cache.put(cache_key, body)
+    return tile_response(entry, if_none_match)
 
 @app.get("/")
 def read_root():
     return {"message": "NASA Image Tile Server is running"}
 
+async def load_labels(file_paths: List[str]) -> dict:
+    """
+    Query labels for the given paths in one round trip. Used by the label cache for misses.
+    """
+    return await db_pool.load_labels(file_paths)
+
+
 @app.get("/tile-label")
 async def get_tile_label(file_path: str = Query(..., description="Full GCS file path of the tile")):
     """
-    Returns the label/value for the given tile file path by querying the Neon PostgreSQL DB.
+    Returns the label/value for the given tile file path, from the label cache or the Neon PostgreSQL DB.
     """
     if not db_pool:
         raise HTTPException(status_code=503, detail="Database service is not configured.")
 
-    conn = db_pool.getconn()
     try:
-        cur = conn.cursor()
-        cur.execute("SELECT value FROM nlarge WHERE file_path = %s", (file_path,))
-        result = cur.fetchone()
-        cur.close()
-
-        if result:
-            value = result[0]
-            return {"file_path": file_path, "value": value}
-        else:
-            raise HTTPException(status_code=404, detail="No label found for this tile")
+        labels = await label_cache.get_many([file_path], load_labels)
+    except LabelStoreTimeout as e:
+        logger.warning(f"⏳ {e}")
+        raise HTTPException(status_code=503, detail="Database is busy, try again shortly.")
     except Exception as e:
         logger.error(f"❌ Database query failed: {e}")
         raise HTTPException(status_code=500, detail="An error occurred while querying the database.")
-    finally:
-        if conn is not None:
-            db_pool.putconn(conn)
+
+    if file_path not in labels:
+        raise HTTPException(status_code=404, detail="No label found for this tile")
+    return {"file_path": file_path, "value": labels[file_path]}
+
 
 @app.post("/batch-tile-labels")
 async def get_batch_tile_labels(request: dict = Body(...)):
@@ -195,49 +659,468 @@ async def get_batch_tile_labels(request: dict = Body(...)):
     
     if not file_paths:
         return {}
-    
-    current_time = time.time()
-    response = {}
-    uncached_paths = []
-    
-    # Check cache first
-    for path in file_paths:
-        if path in label_cache:
-            cache_entry = label_cache[path]
-            if current_time - cache_entry['timestamp'] < CACHE_EXPIRY:
-                if cache_entry['value'] is not None:
-                    response[path] = cache_entry['value']
-                continue
-        uncached_paths.append(path)
-    
-    # Query database only for uncached paths
-    if uncached_paths:
-        conn = db_pool.getconn()
+
+    # Cached paths (including known misses) are answered directly; the rest are
+    # queried once, shared with any concurrent request asking for the same paths
+    misses_before = label_cache.misses
+    try:
+        response = await label_cache.get_many(file_paths, load_labels)
+    except LabelStoreTimeout as e:
+        logger.warning(f"⏳ {e}")
+        raise HTTPException(status_code=503, detail="Database is busy")
+    except Exception as e:
+        logger.error(f"❌ Batch database query failed: {e}")
+        raise HTTPException(status_code=500, detail="Database error")
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("batch labels", extra={
+            "requested": len(file_paths), "found": len(response), "not_cached": label_cache.misses - misses_before,
+        })
+    return response
+
+
+def parse_bbox(bbox: str):
+    try:
+        x0, y0, x1, y1 = (int(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be x0,y0,x1,y1 tile coordinates")
+    if x0 < 0 or y0 < 0 or x1 < x0 or y1 < y0:
+        raise HTTPException(status_code=400, detail="bbox must satisfy 0 <= x0 <= x1 and 0 <= y0 <= y1")
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > LABEL_BBOX_MAX_TILES:
+        raise HTTPException(status_code=400, detail=f"bbox covers more than {LABEL_BBOX_MAX_TILES} tiles")
+    return x0, y0, x1, y1
+
+
+@app.get("/labels/{image_set}/{z}")
+async def get_labels_in_bbox(
+    image_set: str,
+    z: int,
+    bbox: str = Query(..., description="Inclusive tile range x0,y0,x1,y1 at zoom level z"),
+):
+    """
+    Every label in a rectangle of tiles at one zoom level, as parallel columns:
+    tile i is (x[i], y[i]) with label classes[label[i]]. Tiles without a label are omitted.
+    """
+    if not db_pool:
+        raise HTTPException(status_code=503, detail="Database service is not configured.")
+    x0, y0, x1, y1 = parse_bbox(bbox)
+    try:
+        labels = await db_pool.labels_in_rect(image_set, z, x0, y0, x1, y1)
+    except LabelStoreTimeout as e:
+        logger.warning(f"⏳ {e}")
+        raise HTTPException(status_code=503, detail="Database is busy")
+    except Exception as e:
+        logger.error(f"❌ Label range query failed: {e}")
+        raise HTTPException(status_code=500, detail="Database error")
+    return {"image_set": image_set, "z": z, "bbox": [x0, y0, x1, y1], **labels}
+
+
+# --- Label bundles ---
+# image_set -> (mtime_ns, size, CachedTile); bundles are small, so they are served from memory
+label_bundles = {}
+label_bundle_lock = asyncio.Lock()
+
+
+async def build_label_bundle(image_set: str) -> dict:
+    async with label_bundle_lock:
+        header = await export_bundle(db_pool, image_set, LABEL_BUNDLES_DIR)
+    label_bundles.pop(image_set, None)
+    logger.info(f"🏷️ Built label bundle for {image_set}: {header['labelCount']} labels, {header['bytes']} bytes")
+    return header
+
+
+label_bundle_rebuilds = set()
+
+
+def schedule_label_bundle_rebuild(image_set: str) -> None:
+    """
+    Rebuild an image's exported bundle shortly after its labels changed, once per delay
+    """
+    if image_set in label_bundle_rebuilds:
+        return
+    label_bundle_rebuilds.add(image_set)
+    task = asyncio.create_task(rebuild_label_bundle_later(image_set))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def rebuild_label_bundle_later(image_set: str) -> None:
+    await asyncio.sleep(LABEL_BUNDLE_REBUILD_DELAY)
+    # Labels written from here on schedule the next rebuild
+    label_bundle_rebuilds.discard(image_set)
+    # An image without a bundle gets one built on its first request
+    if not await asyncio.to_thread(os.path.exists, bundle_path(LABEL_BUNDLES_DIR, image_set)):
+        return
+    try:
+        await build_label_bundle(image_set)
+    except Exception as e:
+        logger.warning(f"⚠️ Label bundle rebuild for {image_set} failed: {e}")
+
+
+def load_label_bundle(image_set: str):
+    path = bundle_path(LABEL_BUNDLES_DIR, image_set)
+    st = os.stat(path)
+    cached = label_bundles.get(image_set)
+    if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[2]
+    with open(path, "rb") as f:
+        body = f.read()
+    entry = CachedTile(body, make_etag(body))
+    label_bundles[image_set] = (st.st_mtime_ns, st.st_size, entry)
+    return entry
+
+
+@app.get("/label-bundles/{image_set}")
+async def get_label_bundle(image_set: str, request: Request):
+    """
+    Every label of an image set as one binary bundle. Built from the database
+    on first request if it hasn't been exported yet.
+    """
+    try:
+        check_segment(image_set)
+    except TileNotFound:
+        raise HTTPException(status_code=404, detail="Unknown image set")
+    try:
+        entry = await asyncio.to_thread(load_label_bundle, image_set)
+    except FileNotFoundError:
+        if not db_pool:
+            raise HTTPException(status_code=404, detail="No label bundle for this image set")
         try:
-            cur = conn.cursor()
-            # Use ANY() for better performance with large lists
-            cur.execute("SELECT file_path, value FROM nlarge WHERE file_path = ANY(%s)", (uncached_paths,))
-            results = cur.fetchall()
-            cur.close()
-            
-            # Update cache and response
-            for row in results:
-                file_path, value = row
-                label_cache[file_path] = {'value': value, 'timestamp': current_time}
-                response[file_path] = value
-            
-            # Cache misses (paths not found in DB)
-            found_paths = {row[0] for row in results}
-            for path in uncached_paths:
-                if path not in found_paths:
-                    label_cache[path] = {'value': None, 'timestamp': current_time}
-                    
-        except Exception as e:
-            logger.error(f"❌ Batch database query failed: {e}")
-            raise HTTPException(status_code=500, detail="Database error")
-        finally:
-            if conn is not None:
-                db_pool.putconn(conn)
-    
-    logger.info(f"📊 Batch request: {len(file_paths)} requested, {len(response)} found, {len(uncached_paths)} from DB")
-    return response
\ No newline at end of file
+            await build_label_bundle(image_set)
+        except LabelStoreTimeout as e:
+            logger.warning(f"⏳ {e}")
+            raise HTTPException(status_code=503, detail="Database is busy")
+        entry = await asyncio.to_thread(load_label_bundle, image_set)
+
+    headers = {"ETag": entry.etag, "Cache-Control": LABEL_BUNDLE_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/octet-stream", headers=headers)
+
+
+@app.post("/label-bundles/{image_set}/rebuild")
+async def rebuild_label_bundle(image_set: str):
+    """
+    Re-export an image set's label bundle after its labels changed
+    """
+    if not db_pool:
+        raise HTTPException(status_code=503, detail="Database service is not configured.")
+    try:
+        check_segment(image_set)
+    except TileNotFound:
+        raise HTTPException(status_code=404, detail="Unknown image set")
+    try:
+        header = await build_label_bundle(image_set)
+    except LabelStoreTimeout as e:
+        logger.warning(f"⏳ {e}")
+        raise HTTPException(status_code=503, detail="Database is busy")
+    return {"image_set": image_set, "labels": header["labelCount"], "classes": header["classes"], "bytes": header["bytes"]}
+
+
+# --- On-demand classification ---
+classify_pool = None
+classifier_info = None
+micro_batcher = None
+classifier_lock = asyncio.Lock()
+
+
+async def get_micro_batcher() -> classify_service.MicroBatcher:
+    """
+    Start the model worker process and the batcher on first use.
+    """
+    global classify_pool, classifier_info, micro_batcher
+    if not CLASSIFIER_MODEL:
+        raise HTTPException(status_code=503, detail="Classification is not configured (set CLASSIFIER_MODEL).")
+    async with classifier_lock:
+        if micro_batcher is None:
+            pool = start_classify_pool()
+            try:
+                info = await asyncio.get_running_loop().run_in_executor(pool, classify_service.model_info)
+            except Exception as e:
+                # A model that fails to load breaks the pool; don't leave its process behind
+                pool.shutdown(cancel_futures=True)
+                logger.error(f"❌ Failed to load classifier {CLASSIFIER_MODEL}: {e}")
+                raise HTTPException(status_code=503, detail="Classifier failed to load")
+            classify_pool, classifier_info = pool, info
+            micro_batcher = classify_service.MicroBatcher(
+                run_classify_batch, write_classified_labels, CLASSIFY_MAX_BATCH, CLASSIFY_MAX_WAIT_MS / 1000,
+                CLASSIFY_MAX_WRITES,
+            )
+            logger.info(f"🧠 Loaded classifier {classifier_info['model_version']} "
+                        f"({len(classifier_info['classes'])} classes) from {CLASSIFIER_MODEL}")
+    return micro_batcher
+
+
+def start_classify_pool() -> ProcessPoolExecutor:
+    # One worker: torch parallelises each batch across its own threads
+    return ProcessPoolExecutor(
+        1,
+        initializer=classify_service.init_worker,
+        initargs=(CLASSIFIER_MODEL, CLASSIFY_TORCH_THREADS),
+    )
+
+
+async def run_classify_batch(pngs: List[bytes]) -> List[str]:
+    global classify_pool
+    pool = classify_pool
+    try:
+        indices = await asyncio.get_running_loop().run_in_executor(pool, classify_service.classify_pngs, pngs)
+    except BrokenProcessPool:
+        # The worker died (e.g. killed for memory); this batch fails, the next one gets a fresh worker
+        logger.error("❌ Classifier worker died; restarting it")
+        if classify_pool is pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+            classify_pool = start_classify_pool()
+        raise
+    return [classifier_info["classes"][i] for i in indices]
+
+
+async def write_classified_labels(results) -> None:
+    """
+    Write-through for a finished micro-batch: one DB transaction, then the label cache
+    and a rebuild of the affected label bundles.
+    """
+    rows = [(*key, label) for key, label in results]
+    if db_pool:
+        await db_pool.upsert_labels(rows, classifier_info["model_version"], TILE_LABEL_URL_BASE)
+    for image_set, z, x, y, label in rows:
+        label_cache.put(f"{TILE_LABEL_URL_BASE}/{image_set}/{z}/{x}/{y}.png", label)
+    if db_pool:
+        for image_set in {row[0] for row in rows}:
+            schedule_label_bundle_rebuild(image_set)
+
+
+async def close_classifier():
+    global classify_pool, micro_batcher
+    if micro_batcher is not None:
+        await micro_batcher.close()
+        micro_batcher = None
+    if classify_pool is not None:
+        classify_pool.shutdown(cancel_futures=True)
+        classify_pool = None
+
+
+async def classify_tile(batcher, image_set: str, z: int, x: int, y: int) -> str:
+    entry = await read_tile(image_set, z, x, y)
+    try:
+        return await batcher.classify((image_set, z, x, y), bytes(entry.body))
+    except LabelStoreTimeout as e:
+        logger.warning(f"⏳ {e}")
+        raise HTTPException(status_code=503, detail="Database is busy")
+    except Exception as e:
+        logger.error(f"❌ Classification failed for {image_set}/{z}/{x}/{y}: {e}")
+        raise HTTPException(status_code=500, detail="Classification failed")
+
+
+@app.post("/classify/{image_set}/{z}/{x}/{y}")
+async def classify_one_tile(image_set: str, z: int, x: int, y: int):
+    """
+    Classify one tile now; the label is stored and cached before it is returned.
+    """
+    batcher = await get_micro_batcher()
+    label = await classify_tile(batcher, image_set, z, x, y)
+    return {"image_set": image_set, "z": z, "x": x, "y": y, "value": label,
+            "model_version": classifier_info["model_version"]}
+
+
+@app.post("/classify/{image_set}")
+async def classify_tiles(image_set: str, request: dict = Body(...)):
+    """
+    Classify a list of tiles, {"tiles": [[z, x, y], ...]}. Returns "z/x/y" -> label,
+    with null for tiles that don't exist.
+    """
+    tiles = request.get("tiles", [])
+    if len(tiles) > CLASSIFY_MAX_TILES:
+        raise HTTPException(status_code=400, detail=f"At most {CLASSIFY_MAX_TILES} tiles per request")
+    try:
+        tiles = list(dict.fromkeys((int(z), int(x), int(y)) for z, x, y in tiles))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="tiles must be [z, x, y] triples")
+    batcher = await get_micro_batcher()
+
+    async def one(z, x, y):
+        try:
+            return await classify_tile(batcher, image_set, z, x, y)
+        except HTTPException as e:
+            if e.status_code == 404:
+                return None
+            raise
+
+    labels = await asyncio.gather(*[one(*tile) for tile in tiles])
+    return {"image_set": image_set, "model_version": classifier_info["model_version"],
+            "labels": {f"{z}/{x}/{y}": label for (z, x, y), label in zip(tiles, labels)}}
+
+
+@app.get("/classify/stats")
+def get_classify_stats():
+    """
+    Micro-batch sizes and timings of the classification worker
+    """
+    if micro_batcher is None:
+        return {"loaded": False}
+    return {"loaded": True, "model_version": classifier_info["model_version"], **micro_batcher.stats()}
+
+
+@app.get("/label-cache/stats")
+def get_label_cache_stats():
+    """
+    Size, hit/miss and coalescing counters for the label cache
+    """
+    return label_cache.stats()
+
+
+@app.get("/db/stats")
+def get_db_stats():
+    """
+    Connection pool size, pool-wait and query timing counters
+    """
+    if not db_pool:
+        raise HTTPException(status_code=503, detail="Database service is not configured.")
+    return db_pool.stats()
+
+
+# --- Metrics and profiling ---
+def collect_component_metrics():
+    """
+    Counters kept by the caches, the DB pool and the background workers,
+    read at scrape time.
+    """
+    tiers = tile_cache.stats()
+    yield ("nlarge_tile_cache_hits_total", "counter", "Tile cache hits per tier.",
+           [({"tier": tier}, stats["hits"]) for tier, stats in tiers.items()])
+    yield ("nlarge_tile_cache_misses_total", "counter", "Tile cache misses per tier.",
+           [({"tier": tier}, stats["misses"]) for tier, stats in tiers.items()])
+    yield ("nlarge_tile_cache_hit_ratio", "gauge", "Tile cache hit ratio per tier since start.",
+           [({"tier": tier}, stats["hit_ratio"]) for tier, stats in tiers.items()])
+    yield ("nlarge_tile_cache_bytes", "gauge", "Bytes held per tile cache tier.",
+           [({"tier": tier}, stats["bytes"]) for tier, stats in tiers.items()])
+
+    labels = label_cache.stats()
+    for key in ("hits", "negative_hits", "misses", "coalesced", "evictions"):
+        yield (f"nlarge_label_cache_{key}_total", "counter", f"Label cache {key.replace('_', ' ')}.",
+               [({}, labels[key])])
+    yield ("nlarge_label_cache_hit_ratio", "gauge", "Label cache hit ratio since start.", [({}, labels["hit_ratio"])])
+    yield ("nlarge_label_cache_entries", "gauge", "Labels held in the cache.", [({}, labels["entries"])])
+
+    if db_pool:
+        pool = db_pool.stats()
+        yield ("nlarge_db_pool_connections", "gauge", "DB pool connections by state.",
+               [({"state": "open"}, pool["size"]), ({"state": "idle"}, pool["idle"])])
+        yield ("nlarge_db_pool_waiting", "gauge", "Requests waiting for a DB connection.", [({}, pool["waiting"])])
+        yield ("nlarge_db_timeouts_total", "counter", "Pool acquire and query timeouts.",
+               [({"kind": "acquire"}, pool["acquire_timeouts"]), ({"kind": "query"}, pool["query_timeouts"])])
+
+    if tile_prefetcher is not None:
+        prefetch = tile_prefetcher.stats()
+        yield ("nlarge_prefetch_tiles_total", "counter", "Prefetched tiles by outcome.",
+               [({"outcome": key}, prefetch[key]) for key in ("fetched", "already_cached", "dropped", "failed", "used")])
+
+    if micro_batcher is not None:
+        classify = micro_batcher.stats()
+        yield ("nlarge_classify_batches_total", "counter", "Classification micro-batches run.", [({}, classify["batches"])])
+        yield ("nlarge_classify_tiles_total", "counter", "Tiles classified.", [({}, classify["tiles"])])
+        yield ("nlarge_classify_queued", "gauge", "Tiles waiting for a micro-batch.", [({}, classify["queued"])])
+
+
+metrics.register_collector(collect_component_metrics)
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Request latency, upstream, DB and cache metrics in the Prometheus text format
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+profiler = SamplingProfiler()
+
+
+def check_profiler_enabled():
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler is disabled (set PROFILER_ENABLED=1).")
+
+
+@app.post("/debug/profiler/start")
+def start_profiler(
+    interval_ms: float = Query(5, gt=0, description="Sampling interval"),
+    seconds: float = Query(None, gt=0, description="Stop automatically after this long"),
+):
+    """
+    Start sampling the server's stacks; earlier samples are discarded
+    """
+    check_profiler_enabled()
+    try:
+        profiler.start(interval_ms / 1000, seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info(f"Sampling profiler started ({interval_ms} ms interval)")
+    return profiler.stats()
+
+
+@app.post("/debug/profiler/stop")
+def stop_profiler():
+    check_profiler_enabled()
+    profiler.stop()
+    return profiler.stats()
+
+
+@app.get("/debug/profiler")
+def get_profile(request: Request):
+    """
+    Samples so far as collapsed stacks (flamegraph.pl / speedscope input); JSON status with Accept: application/json
+    """
+    check_profiler_enabled()
+    if "application/json" in request.headers.get("accept", ""):
+        return profiler.stats()
+    return PlainTextResponse(profiler.collapsed())
+
+
+# --- Lifespan and health ---
+background_tasks = set()
+
+
+def start_background_resources():
+    tile_cache.start()
+    image_registry.start()
+    if db_pool is not None:
+        task = asyncio.create_task(open_db_pool())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+
+async def close_resources():
+    for task in list(background_tasks):
+        task.cancel()
+    await image_registry.close()
+    if tile_prefetcher is not None:
+        await tile_prefetcher.close()
+    await close_classifier()
+    close_render_pool()
+    profiler.stop()
+    if db_pool is not None:
+        await db_pool.close()
+    await tile_storage.close()
+
+
+@app.get("/health/live")
+def liveness():
+    """
+    The process is up and the event loop answers
+    """
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+def readiness():
+    """
+    Ready once the image set registry has loaded and the first DB connection attempt
+    is over. A database that is down doesn't block readiness (tiles still work); it
+    is reported here and retried in the background.
+    """
+    checks = {
+        "image_registry": image_registry.stats(),
+        "database": {"state": db_state, "error": db_error},
+    }
+    ready = image_registry.loaded.is_set() and db_state != "connecting"
+    return JSONResponse({"ready": ready, **checks}, status_code=200 if ready else 503)
@@ -0,0 +1,228 @@
+"""
+Prometheus metrics and Server-Timing headers for the tile server.
+
+The few metric types the server needs are kept here instead of pulling in a
+client library; /metrics renders them in the Prometheus text format. Metrics
+are updated from the event loop thread, so they take no locks.
+
+Hot paths record what they spend time on with record_timing (upstream fetch,
+pool wait, query, render). MetricsMiddleware collects those per request into a
+Server-Timing response header, next to the total, and observes the request in
+a per-route latency histogram. For streamed responses the header is sent with
+the first byte, so it covers the work done before the body started.
+
+Values that already live in component stats (cache counters, pool sizes) are
+read when /metrics is scraped, through collectors registered with
+register_collector, so those hot paths pay nothing extra.
+"""
+import time
+import bisect
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Seconds; covers memory cache hits (~0.1 ms) up to slow bucket fetches
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+COLLECTORS = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def samples(self):
+        """(suffix, label values, extra labels, value) tuples."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_labels(self.labelnames, values, extra)} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.values = {}
+
+    def inc(self, *labelvalues, amount=1):
+        self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        for values, value in self.values.items():
+            yield "", values, (), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, value, *labelvalues):
+        self.values[labelvalues] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *labelvalues):
+        series = self.series.get(labelvalues)
+        if series is None:
+            series = self.series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for values, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), series):
+                cumulative += count
+                yield "_bucket", values, (("le", _number(bound)),), cumulative
+            yield "_sum", values, (), series[-1]
+            yield "_count", values, (), cumulative
+
+
+def register_collector(collect):
+    """
+    collect() -> iterable of (name, kind, help, [(labels dict, value), ...]),
+    called on every scrape.
+    """
+    COLLECTORS.append(collect)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for collect in COLLECTORS:
+        for name, kind, help, samples in collect():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Metrics recorded on the hot paths ---
+REQUEST_SECONDS = Histogram(
+    "nlarge_http_request_duration_seconds", "Time to the response start, by route template.",
+    ("method", "route", "status"),
+)
+REQUESTS_IN_FLIGHT = Gauge("nlarge_http_requests_in_flight", "Requests being handled right now.")
+UPSTREAM_SECONDS = Histogram(
+    "nlarge_upstream_fetch_duration_seconds", "Bucket fetch time (to the response headers for streamed tiles).",
+    ("operation",),
+)
+UPSTREAM_BYTES = Counter("nlarge_upstream_bytes_total", "Bytes read from the bucket.", ("operation",))
+UPSTREAM_FAILURES = Counter("nlarge_upstream_failures_total", "Bucket fetches that failed or were not found.",
+                            ("operation",))
+DB_ACQUIRE_SECONDS = Histogram("nlarge_db_pool_wait_seconds", "Time spent waiting for a pooled DB connection.")
+DB_QUERY_SECONDS = Histogram("nlarge_db_query_duration_seconds", "DB query time, connection wait excluded.")
+RENDER_SECONDS = Histogram(
+    "nlarge_render_duration_seconds", "Worker-pool render/transcode time, queueing included.", ("function",),
+)
+
+
+# --- Server-Timing ---
+_timings = ContextVar("server_timing", default=None)
+
+
+def record_timing(name, seconds):
+    """Add to the current request's Server-Timing entry `name`; no-op outside a request."""
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def timed(name, histogram=None, *labelvalues):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        record_timing(name, elapsed)
+        if histogram is not None:
+            histogram.observe(elapsed, *labelvalues)
+
+
+def server_timing_header(timings, total):
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware (no BaseHTTPMiddleware task hop) that times every HTTP
+    request, keeps the in-flight gauge and adds the Server-Timing header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        timings = {}
+        token = _timings.set(timings)
+        status = 500
+        responded = None
+
+        async def send_with_timing(message):
+            nonlocal status, responded
+            if message["type"] == "http.response.start":
+                responded = time.perf_counter()
+                status = message["status"]
+                header = server_timing_header(timings, responded - started)
+                message["headers"] = [*message.get("headers", ()), (b"server-timing", header.encode())]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            _timings.reset(token)
+            # The router stores the matched route in the scope; templates keep the label set small
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(
+                (responded or time.perf_counter()) - started,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status),
+            )
@@ -0,0 +1,95 @@
+"""
+Create the structured tile_labels table and backfill it from nlarge.
+
+nlarge keys every label by the tile's full bucket URL
+(https://storage.googleapis.com/n-large/{image_set}/{z}/{x}/{y}.png).
+tile_labels stores the same labels by (image_set, z, x, y) under a composite
+primary key, so a viewport is a single index range scan on one zoom level.
+
+Safe to run repeatedly: the table and index are created if missing and the
+backfill upserts. Rows whose URL doesn't end in {image_set}/{z}/{x}/{y}.png are
+counted and left alone. nlarge is deduplicated (keeping the newest row) and
+given a unique index on file_path, so inference runs upsert instead of
+appending duplicates.
+
+    DATABASE_URL=... python migrate_labels.py
+"""
+import os
+import time
+import asyncio
+import argparse
+import asyncpg
+from dotenv import load_dotenv
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS tile_labels (
+    image_set TEXT NOT NULL,
+    z SMALLINT NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (image_set, z, x, y)
+)
+"""
+
+# Which model produced a label, so a new model can relabel only stale tiles
+ADD_MODEL_VERSION = "ALTER TABLE tile_labels ADD COLUMN IF NOT EXISTS model_version TEXT"
+
+DEDUPE_NLARGE = """
+DELETE FROM nlarge a USING nlarge b
+WHERE a.file_path = b.file_path AND a.ctid < b.ctid
+"""
+
+UNIQUE_NLARGE = "CREATE UNIQUE INDEX IF NOT EXISTS nlarge_file_path_key ON nlarge (file_path)"
+
+URL_PATTERN = r"([^/]+)/(\d+)/(\d+)/(\d+)\.png$"
+
+# nlarge has no uniqueness constraint, so a tile can have several rows; the
+# physically last one (most recent insert, barring updates) wins
+BACKFILL = f"""
+INSERT INTO tile_labels (image_set, z, x, y, value)
+SELECT DISTINCT ON (m[1], m[2]::smallint, m[3]::integer, m[4]::integer)
+       m[1], m[2]::smallint, m[3]::integer, m[4]::integer, value
+FROM (
+    SELECT regexp_match(file_path, '{URL_PATTERN}') AS m, value, ctid
+    FROM nlarge
+    WHERE value IS NOT NULL
+) parsed
+WHERE m IS NOT NULL
+ORDER BY m[1], m[2]::smallint, m[3]::integer, m[4]::integer, ctid DESC
+ON CONFLICT (image_set, z, x, y) DO UPDATE SET value = EXCLUDED.value, updated_at = now()
+"""
+
+COUNT_UNPARSED = f"SELECT count(*) FROM nlarge WHERE file_path !~ '{URL_PATTERN}'"
+
+
+async def migrate(dsn, backfill=True):
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute(CREATE_TABLE)
+        await conn.execute(ADD_MODEL_VERSION)
+        print("✅ tile_labels table ready")
+        async with conn.transaction():
+            status = await conn.execute(DEDUPE_NLARGE)
+            await conn.execute(UNIQUE_NLARGE)
+        print(f"✅ nlarge file_path is unique ({status.split()[-1]} duplicate rows removed)")
+        if not backfill:
+            return
+        started = time.perf_counter()
+        async with conn.transaction():
+            status = await conn.execute(BACKFILL)
+        print(f"✅ Backfilled from nlarge: {status.split()[-1]} rows in {time.perf_counter() - started:.1f} s")
+        unparsed = await conn.fetchval(COUNT_UNPARSED)
+        if unparsed:
+            print(f"⚠️ {unparsed} nlarge rows don't look like tile URLs and were skipped")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Create tile_labels and backfill it from nlarge.")
+    parser.add_argument("--no-backfill", action="store_true", help="Only create the table")
+    args = parser.parse_args()
+    asyncio.run(migrate(os.environ["DATABASE_URL"], backfill=not args.no_backfill))
@@ -0,0 +1,55 @@
+"""
+Loading the tile classifier, shared by the tiler, the API and the ai/ scripts.
+
+An exported artifact (ai/src/export.py) is a TorchScript module with its class
+names, model version and expected input stored as an extra file. A raw train.py
+state dict is the ResNet18 weights only; its version is a hash of the file.
+
+Artifacts run on the CPU: the fp32 variant is passed through
+optimize_for_inference when it is loaded, which bakes in CPU-only (MKLDNN)
+ops, and the int8 variants use CPU quantized kernels. torch is imported lazily so that the API
+process can import this module without it.
+"""
+import json
+import hashlib
+
+META_FILE = "meta.json"
+
+
+def model_version_of(model_path):
+    """Default model version: a short hash of the weights file, so new weights never match old labels."""
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def is_artifact(model_path):
+    return model_path.endswith(".ts")
+
+
+def load_artifact(model_path):
+    """(TorchScript module, metadata) of an exported artifact; metadata["classes"] names the outputs."""
+    import torch
+    extra_files = {META_FILE: ""}
+    module = torch.jit.load(model_path, map_location="cpu", _extra_files=extra_files)
+    module.eval()
+    meta = json.loads(extra_files[META_FILE])
+    if meta.get("variant") == "fp32":
+        # Done here rather than at export, since the result can't be saved
+        module = torch.jit.optimize_for_inference(module)
+    return module, meta
+
+
+def load_weights(model_path, num_classes, device="cpu"):
+    """ResNet18 with a num_classes head and the train.py state dict loaded, in eval mode."""
+    import torch
+    from torchvision.models import resnet18
+    # No pretrained weights: the state dict replaces every parameter anyway
+    model = resnet18()
+    model.fc = torch.nn.Linear(model.fc.in_features, num_classes)
+    model.load_state_dict(torch.load(model_path, map_location=device))
+    model.to(device)
+    model.eval()
+    return model
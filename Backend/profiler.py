@@ -0,0 +1,94 @@
+"""
+Opt-in sampling profiler that can be switched on and off in a running server.
+
+A background thread snapshots every other thread's Python stack at a fixed
+interval and counts identical stacks. The result is in the collapsed-stack
+format ("thread;module:function;... count" per line) that flamegraph.pl,
+speedscope and similar tools read. Sampling only walks frames, so the
+overhead is roughly proportional to the sampling rate and zero when stopped.
+"""
+import sys
+import time
+import threading
+from collections import Counter
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{code.co_name}:{frame.f_lineno}"
+
+
+class SamplingProfiler:
+    def __init__(self, max_stacks=50_000):
+        self.max_stacks = max_stacks
+        self.stacks = Counter()
+        self.samples = 0
+        self.interval = None
+        self.started_at = None
+        self.stopped_at = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval=0.005, duration=None):
+        """Start sampling (clears earlier samples). Stops by itself after `duration` seconds if given."""
+        if self.running:
+            raise RuntimeError("Profiler is already running")
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+        self.interval = interval
+        self.started_at = time.time()
+        self.stopped_at = None
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, args=(interval, duration), name="sampling-profiler",
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+    def _run(self, interval, duration):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + duration if duration else None
+        while not self.stop_event.wait(interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own_id:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_name(frame))
+                        frame = frame.f_back
+                    stack.append(names.get(thread_id, str(thread_id)))
+                    key = ";".join(reversed(stack))
+                    if key in self.stacks or len(self.stacks) < self.max_stacks:
+                        self.stacks[key] += 1
+                self.samples += 1
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        self.stopped_at = time.time()
+
+    def collapsed(self):
+        with self.lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "interval_ms": self.interval * 1000 if self.interval else None,
+            "samples": self.samples,
+            "distinct_stacks": len(self.stacks),
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+        }
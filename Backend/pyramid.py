@@ -0,0 +1,380 @@
+"""
+Bottom-up tile pyramid construction.
+
+Level z of an image with MAX_ZOOM levels is (width // 2**(MAX_ZOOM - z)) x
+(height // 2**(MAX_ZOOM - z)), cut into TILE_SIZE tiles with range(cols + 1) x
+range(rows + 1) so edge tiles are padded. Because floor(floor(n / 2) / 2) ==
+floor(n / 4), every level can be made by halving the level below it instead of
+resampling the full-resolution source each time.
+
+Two builders share that layout:
+
+- build_levels: keeps one whole level in memory at a time (LANCZOS 2x).
+- build_strips: streams the source in bands of TILE_SIZE rows and cascades 2x2
+  box-averaged rows up the levels, so peak memory is about 2 * TILE_SIZE rows of
+  the source width no matter how tall the image is.
+
+Both call emit(z, x, y, tile) with a TILE_SIZE x TILE_SIZE PIL image, except for
+tiles where skip(z, x, y) is true (already produced by an earlier run); those are
+not even cropped.
+"""
+import os
+import time
+import math
+import numpy as np
+from PIL import Image
+from stretch import DEFAULT_CLIP, compute_limits, subsample, to_uint8
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def calculate_max_zoom(width, min_level_size):
+    if width <= 0:
+        raise ValueError("Source image width must be positive.")
+    return int(math.ceil(math.log2(width / min_level_size)))
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class LevelStats:
+    def __init__(self):
+        self.levels = {}
+
+    def add(self, z, seconds=0.0, tiles=0, size=None):
+        entry = self.levels.setdefault(z, {"seconds": 0.0, "tiles": 0, "size": None, "peak_rss_mb": None})
+        entry["seconds"] += seconds
+        entry["tiles"] += tiles
+        if size is not None:
+            entry["size"] = size
+
+    def mark_done(self, z):
+        self.levels.setdefault(z, {"seconds": 0.0, "tiles": 0, "size": None, "peak_rss_mb": None})
+        self.levels[z]["peak_rss_mb"] = peak_rss_mb()
+
+    def report(self):
+        print("--- Per-level timings ---")
+        for z in sorted(self.levels):
+            entry = self.levels[z]
+            size = "x".join(str(v) for v in entry["size"]) if entry["size"] else "?"
+            rss = f"{entry['peak_rss_mb']:.0f} MB" if entry["peak_rss_mb"] is not None else "n/a"
+            print(f"z={z:2d}  {size:>13}  {entry['tiles']:6d} tiles  {entry['seconds']:8.2f} s  peak RSS {rss}")
+
+
+# --- Sources that can be read a band of rows at a time ---
+class PILSource:
+    """
+    Pillow decodes most formats in one go, so bands are cropped from the loaded
+    image; strip mode still bounds the memory used by the pyramid levels.
+    """
+
+    def __init__(self, path):
+        Image.MAX_IMAGE_PIXELS = None # Allow Pillow to open very large images
+        self.image = Image.open(path)
+        if self.image.mode not in ("L", "RGB", "RGBA"):
+            self.image = self.image.convert("RGB")
+        self.width, self.height = self.image.size
+
+    def read_rows(self, top, bottom):
+        return np.asarray(self.image.crop((0, top, self.width, bottom)))
+
+
+class NpySource:
+    """uint8 (H, W) or (H, W, C) .npy arrays, memory-mapped so only the requested band is read."""
+
+    def __init__(self, path):
+        self.array = np.load(path, mmap_mode="r")
+        if self.array.dtype != np.uint8 or self.array.ndim not in (2, 3):
+            raise ValueError(f"{path}: expected a uint8 (H, W) or (H, W, C) array")
+        self.height, self.width = self.array.shape[:2]
+
+    @property
+    def image(self):
+        return Image.fromarray(np.asarray(self.array))
+
+    def read_rows(self, top, bottom):
+        return np.ascontiguousarray(self.array[top:bottom])
+
+
+class FITSSource:
+    """
+    A 2-D image HDU read through astropy's memmap. BSCALE/BZERO are applied per
+    band rather than by astropy, which would otherwise scale the whole array in
+    memory. Display limits come from one subsample of the image, and each band is
+    stretched to 8 bits only when the pyramid asks for it. FITS rows run bottom
+    to top, so bands are flipped to put north up like the usual viewers do.
+    """
+
+    # Whole-level mode would need the entire stretched image in RAM
+    requires_strip = True
+
+    def __init__(self, path, stretch="asinh", clip=DEFAULT_CLIP, hdu=None):
+        from astropy.io import fits
+        self.hdul = fits.open(path, memmap=True, do_not_scale_image_data=True)
+        if hdu is None:
+            hdu = next((i for i, h in enumerate(self.hdul) if h.data is not None and h.data.ndim >= 2), None)
+            if hdu is None:
+                self.hdul.close()
+                raise ValueError(f"{path} has no HDU with 2-D image data")
+        header = self.hdul[hdu].header
+        data = self.hdul[hdu].data
+        while data.ndim > 2:
+            data = data[0]  # first plane of a cube
+        self.data = data
+        self.height, self.width = data.shape
+        self.bscale = float(header.get("BSCALE", 1.0))
+        self.bzero = float(header.get("BZERO", 0.0))
+        self.blank = header.get("BLANK") if data.dtype.kind in "iu" else None
+        self.stretch = stretch
+        self.vmin, self.vmax = compute_limits(self._physical(subsample(data)), stretch, clip)
+        print(f"FITS HDU {hdu}: {self.width}x{self.height} {data.dtype}, "
+              f"{stretch} stretch over [{self.vmin:.6g}, {self.vmax:.6g}]")
+
+    def _physical(self, raw):
+        values = raw.astype(np.float32)
+        if self.blank is not None:
+            values[raw == self.blank] = np.nan
+        if self.bscale != 1.0:
+            values *= np.float32(self.bscale)
+        if self.bzero != 0.0:
+            values += np.float32(self.bzero)
+        return values
+
+    def read_physical_rows(self, top, bottom):
+        """Rows top..bottom (display order) as float32 physical values."""
+        return self._physical(self.data[self.height - bottom:self.height - top][::-1])
+
+    def read_rows(self, top, bottom):
+        return to_uint8(self.read_physical_rows(top, bottom), self.stretch, self.vmin, self.vmax)
+
+
+def open_source(path, **fits_options):
+    if path.lower().endswith((".fits", ".fit", ".fts")):
+        return FITSSource(path, **fits_options)
+    if path.lower().endswith(".npy"):
+        return NpySource(path)
+    return PILSource(path)
+
+
+# --- Whole-level builder ---
+def emit_level_tiles(emit, z, level_image, tile_size, skip=None):
+    cols = level_image.width // tile_size
+    rows = level_image.height // tile_size
+    for y in range(rows + 1):
+        for x in range(cols + 1):
+            if skip is not None and skip(z, x, y):
+                continue
+            left = x * tile_size
+            upper = y * tile_size
+            emit(z, x, y, level_image.crop((left, upper, left + tile_size, upper + tile_size)))
+    return (rows + 1) * (cols + 1)
+
+
+def build_levels(source, max_zoom, tile_size, emit, stats, skip=None):
+    """
+    Start from the full-resolution image as the finest level and halve it for
+    each coarser level, holding at most two levels in memory at once.
+    """
+    level = source.image
+    for z in range(max_zoom, -1, -1):
+        start = time.perf_counter()
+        if z < max_zoom:
+            width, height = level.size
+            if width // 2 == 0 or height // 2 == 0:
+                print(f"Skipping zoom levels 0-{z} due to zero size.")
+                break
+            # Sample exactly the even-sized region so each level is a true 2x reduction
+            level = level.resize((width // 2, height // 2), Image.Resampling.LANCZOS,
+                                 box=(0, 0, (width // 2) * 2, (height // 2) * 2))
+        print(f"--- Processing zoom level {z} ({level.width}x{level.height}) ---")
+        tiles = emit_level_tiles(emit, z, level, tile_size, skip)
+        stats.add(z, time.perf_counter() - start, tiles, level.size)
+        stats.mark_done(z)
+
+
+# --- Strip (banded) builder ---
+def downsample_rows(rows):
+    """2x2 box average of an even number of (H, W, C) uint8 rows."""
+    width = rows.shape[1] // 2 * 2
+    quad = rows[:, :width].astype(np.uint16)
+    summed = quad[0::2, 0::2] + quad[1::2, 0::2] + quad[0::2, 1::2] + quad[1::2, 1::2]
+    return ((summed + 2) // 4).astype(np.uint8)
+
+
+def array_to_tile(band, left, tile_size):
+    tile = np.zeros((tile_size, tile_size, band.shape[2]), dtype=np.uint8)
+    piece = band[:, left:left + tile_size]
+    tile[:piece.shape[0], :piece.shape[1]] = piece
+    if tile.shape[2] == 1:
+        return Image.fromarray(tile[:, :, 0])
+    return Image.fromarray(tile)
+
+
+class StripLevel:
+    """
+    One pyramid level in strip mode. Receives its rows top to bottom, cuts a tile
+    row whenever TILE_SIZE rows are buffered, and forwards pairs of rows, halved,
+    to the next coarser level.
+    """
+
+    def __init__(self, z, width, height, channels, tile_size, emit, stats, coarser=None, skip=None):
+        self.z = z
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.tile_size = tile_size
+        self.emit = emit
+        self.stats = stats
+        self.coarser = coarser
+        self.skip = skip
+        self.buffer = []
+        self.buffered = 0
+        self.tile_row = 0
+        self.carry = None
+
+    def _emit_tile_row(self, band):
+        cols = self.width // self.tile_size
+        for x in range(cols + 1):
+            if self.skip is not None and self.skip(self.z, x, self.tile_row):
+                continue
+            self.emit(self.z, x, self.tile_row, array_to_tile(band, x * self.tile_size, self.tile_size))
+        self.tile_row += 1
+        return cols + 1
+
+    def feed(self, rows):
+        start = time.perf_counter()
+        tiles = 0
+        self.buffer.append(rows)
+        self.buffered += len(rows)
+        while self.buffered >= self.tile_size:
+            pending = np.concatenate(self.buffer) if len(self.buffer) > 1 else self.buffer[0]
+            tiles += self._emit_tile_row(pending[:self.tile_size])
+            rest = pending[self.tile_size:]
+            self.buffer = [rest] if len(rest) else []
+            self.buffered = len(rest)
+
+        halved = None
+        if self.coarser is not None:
+            if self.carry is not None:
+                rows = np.concatenate([self.carry, rows])
+            even = len(rows) // 2 * 2
+            self.carry = rows[even:] if even < len(rows) else None
+            if even:
+                halved = downsample_rows(rows[:even])
+        self.stats.add(self.z, time.perf_counter() - start, tiles, (self.width, self.height))
+
+        if halved is not None:
+            self.coarser.feed(halved)
+
+    def finish(self):
+        # The last tile row is padded (and fully blank when height % TILE_SIZE == 0)
+        start = time.perf_counter()
+        if self.buffer:
+            band = np.concatenate(self.buffer)
+        else:
+            band = np.zeros((0, self.width, self.channels), dtype=np.uint8)
+        tiles = self._emit_tile_row(band)
+        self.buffer = []
+        self.stats.add(self.z, time.perf_counter() - start, tiles, (self.width, self.height))
+        self.stats.mark_done(self.z)
+        if self.coarser is not None:
+            self.coarser.finish()
+
+
+def build_strips(source, max_zoom, tile_size, emit, stats, skip=None):
+    """
+    Stream the source through a chain of StripLevels, finest first.
+    """
+    channels = 1
+    first = source.read_rows(0, 1)
+    if first.ndim == 3:
+        channels = first.shape[2]
+
+    coarser = None
+    for z in range(max_zoom + 1):
+        scale = 2**(max_zoom - z)
+        width, height = source.width // scale, source.height // scale
+        if width == 0 or height == 0:
+            print(f"Skipping zoom level {z} due to zero size.")
+            continue
+        coarser = StripLevel(z, width, height, channels, tile_size, emit, stats, coarser, skip)
+    finest = coarser
+    print(f"Streaming {source.width}x{source.height} source in bands of {tile_size} rows...")
+
+    for top in range(0, source.height, tile_size):
+        rows = source.read_rows(top, min(top + tile_size, source.height))
+        if rows.ndim == 2:
+            rows = rows[:, :, None]
+        finest.feed(rows)
+    finest.finish()
+
+
+def build_pyramid(source, max_zoom, tile_size, emit, strip=False, skip=None):
+    stats = LevelStats()
+    if strip:
+        build_strips(source, max_zoom, tile_size, emit, stats, skip)
+    else:
+        build_levels(source, max_zoom, tile_size, emit, stats, skip)
+    return stats
+
+
+# --- Float pyramid for on-the-fly rendering ---
+def write_float_pyramid(source, out_dir, max_zoom, tile_size):
+    """
+    Write every level of a FITSSource as a float32 {z}.npy array (display row
+    order) plus meta.json, so the tile server can render any tile with any stretch
+    by slicing one memory-mapped level. Levels are 2x2 means of the level below,
+    built in the same banded fashion as strip mode.
+    """
+    import json
+    os.makedirs(out_dir, exist_ok=True)
+    levels = []
+    for z in range(max_zoom + 1):
+        scale = 2**(max_zoom - z)
+        width, height = source.width // scale, source.height // scale
+        if width == 0 or height == 0:
+            continue
+        array = np.lib.format.open_memmap(os.path.join(out_dir, f"{z}.npy"), mode="w+",
+                                          dtype=np.float32, shape=(height, width))
+        levels.append({"z": z, "array": array, "cursor": 0, "carry": None})
+    levels.reverse()  # finest first
+
+    def feed(i, rows):
+        level = levels[i]
+        array = level["array"]
+        rows = rows[:, :array.shape[1]]
+        count = min(len(rows), array.shape[0] - level["cursor"])
+        array[level["cursor"]:level["cursor"] + count] = rows[:count]
+        level["cursor"] += count
+        if i + 1 == len(levels):
+            return
+        if level["carry"] is not None:
+            rows = np.concatenate([level["carry"], rows])
+        even = len(rows) // 2 * 2
+        level["carry"] = rows[even:] if even < len(rows) else None
+        if even:
+            width = rows.shape[1] // 2 * 2
+            quad = rows[:even, :width]
+            feed(i + 1, (quad[0::2, 0::2] + quad[1::2, 0::2] + quad[0::2, 1::2] + quad[1::2, 1::2]) * 0.25)
+
+    start = time.perf_counter()
+    for top in range(0, source.height, tile_size):
+        feed(0, source.read_physical_rows(top, min(top + tile_size, source.height)))
+    for level in levels:
+        level["array"].flush()
+
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump({
+            "width": source.width,
+            "height": source.height,
+            "tileSize": tile_size,
+            "maxLevel": max_zoom,
+        }, f, indent=2)
+    print(f"✅ Wrote float pyramid ({len(levels)} levels) to {out_dir} in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,65 @@
+"""
+Display stretches for scientific (float) image data.
+
+Limits are computed once from a strided subsample of the image; the stretch
+itself is a handful of vectorized NumPy operations applied to any band or
+tile with those fixed limits, so tiles stitch together without seams.
+"""
+import math
+import numpy as np
+
+STRETCHES = ("linear", "log", "asinh", "zscale")
+# Percentile clip used for the linear, log and asinh stretches
+DEFAULT_CLIP = (0.5, 99.5)
+LOG_A = 1000.0
+ASINH_A = 0.1
+
+
+def subsample(data, max_samples=1_000_000):
+    """Strided view of a 2-D array with at most about max_samples pixels."""
+    height, width = data.shape[-2:]
+    step = max(1, int(math.ceil(math.sqrt(height * width / max_samples))))
+    return data[..., ::step, ::step]
+
+
+def compute_limits(sample, stretch="linear", clip=DEFAULT_CLIP):
+    """(vmin, vmax) for a stretch, from finite values of a sample."""
+    values = np.asarray(sample, dtype=np.float32).ravel()
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return 0.0, 1.0
+    if stretch == "zscale":
+        from astropy.visualization import ZScaleInterval
+        vmin, vmax = ZScaleInterval().get_limits(values)
+    else:
+        vmin, vmax = np.percentile(values, clip)
+    vmin, vmax = float(vmin), float(vmax)
+    if vmax <= vmin:
+        vmax = vmin + 1.0
+    return vmin, vmax
+
+
+def apply_stretch(data, stretch, vmin, vmax):
+    """Map raw values to 0..1 float32 with the given stretch; NaNs become 0."""
+    if stretch not in STRETCHES:
+        raise ValueError(f"Unknown stretch: {stretch}")
+    scaled = np.asarray(data, dtype=np.float32) - np.float32(vmin)
+    scaled *= np.float32(1.0 / (vmax - vmin))
+    np.clip(scaled, 0.0, 1.0, out=scaled)
+    np.nan_to_num(scaled, copy=False, nan=0.0)
+    if stretch == "log":
+        scaled *= LOG_A
+        np.log1p(scaled, out=scaled)
+        scaled *= np.float32(1.0 / math.log1p(LOG_A))
+    elif stretch == "asinh":
+        scaled *= np.float32(1.0 / ASINH_A)
+        np.arcsinh(scaled, out=scaled)
+        scaled *= np.float32(1.0 / math.asinh(1.0 / ASINH_A))
+    return scaled
+
+
+def to_uint8(data, stretch, vmin, vmax):
+    scaled = apply_stretch(data, stretch, vmin, vmax)
+    scaled *= 255.0
+    scaled += 0.5
+    return scaled.astype(np.uint8)
@@ -0,0 +1,109 @@
+"""
+Shared fixtures: a small generated pyramid, served by the bucket stand-in from
+bench/standins.py, and a TestClient for main.app pointed at it.
+
+main reads its configuration from the environment at import time, so the
+environment is set up once per session before main is first imported.
+
+Tests of the label database run against a throwaway database created on the
+server DATABASE_URL points at, and are skipped when it is unset.
+"""
+import os
+import sys
+import json
+import asyncio
+import contextlib
+import uuid
+from urllib.parse import urlsplit
+
+import numpy as np
+import pytest
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "bench"))
+
+IMAGE_SET = "demo"
+# Read before main_module clears it for the API tests
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+
+@pytest.fixture(scope="session")
+def bucket_dir(tmp_path_factory):
+    """{root}/n-large/demo: a 1100x700 source tiled by generate_fits_tiles (maxLevel 2)."""
+    import generate_fits_tiles
+    root = tmp_path_factory.mktemp("bucket")
+    source = root / "source.png"
+    rng = np.random.default_rng(0)
+    Image.fromarray(rng.integers(0, 255, (700, 1100, 3), dtype=np.uint8)).save(source)
+    sink = generate_fits_tiles.LocalDirectorySink(str(root / "n-large"), IMAGE_SET)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        generate_fits_tiles.create_and_upload_tiles(sink, str(source), encode_workers=1, upload_workers=2)
+    return root
+
+
+@pytest.fixture(scope="session")
+def pyramid_config(bucket_dir):
+    with open(bucket_dir / "n-large" / IMAGE_SET / "config.json") as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="session")
+def bucket_server(bucket_dir):
+    from standins import BucketServer
+    with BucketServer(str(bucket_dir)) as server:
+        yield server
+
+
+@pytest.fixture(scope="session")
+def main_module(bucket_server, tmp_path_factory):
+    os.environ.update({
+        "TILE_STORAGE": "gcs",
+        "GCS_BASE_URL": bucket_server.url,
+        "IMAGE_SETS": IMAGE_SET,
+        "TILE_CACHE_DIR": str(tmp_path_factory.mktemp("tile_cache")),
+        "TILE_PREFETCH": "0",
+        "TILE_FORMATS": "",
+        "DATABASE_URL": "",
+    })
+    import main
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(main_module):
+    from fastapi.testclient import TestClient
+    with TestClient(main_module.app) as c:
+        yield c
+
+
+@pytest.fixture(scope="session")
+def tile_bytes(bucket_dir):
+    """tile_bytes(z, x, y): the PNG the bucket holds for a tile of the demo pyramid."""
+    def read(z, x, y):
+        with open(bucket_dir / "n-large" / IMAGE_SET / str(z) / str(x) / f"{y}.png", "rb") as f:
+            return f.read()
+    return read
+
+
+@pytest.fixture
+def label_db():
+    """DSN of an empty database that is dropped after the test."""
+    if not DATABASE_URL:
+        pytest.skip("DATABASE_URL is not set")
+    import asyncpg
+    name = f"nlarge_test_{uuid.uuid4().hex[:12]}"
+
+    async def admin(statement):
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            await conn.execute(statement)
+        finally:
+            await conn.close()
+
+    asyncio.run(admin(f'CREATE DATABASE "{name}"'))
+    try:
+        yield urlsplit(DATABASE_URL)._replace(path=f"/{name}").geturl()
+    finally:
+        asyncio.run(admin(f'DROP DATABASE "{name}" WITH (FORCE)'))
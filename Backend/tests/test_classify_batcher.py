@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from classify_service import MicroBatcher
+
+
+def test_duplicate_keys_in_a_batch_are_classified_once():
+    batches = []
+
+    async def run_batch(pngs):
+        batches.append(list(pngs))
+        return [f"label-{png.decode()}" for png in pngs]
+
+    async def write(results):
+        pass
+
+    async def run():
+        batcher = MicroBatcher(run_batch, write, max_batch=8, max_wait=0.05)
+        labels = await asyncio.gather(*[
+            batcher.classify(("demo", 2, x % 2, 0), str(x % 2).encode()) for x in range(6)
+        ])
+        await batcher.close()
+        return labels, batcher.stats()
+
+    labels, stats = asyncio.run(run())
+    assert labels == ["label-0", "label-1"] * 3
+    assert batches == [[b"0", b"1"]]
+    assert (stats["tiles"], stats["duplicates"]) == (2, 4)
+
+
+def test_inference_keeps_going_while_a_write_is_slow():
+    release = None
+    events = []
+
+    async def run_batch(pngs):
+        events.append(("infer", len(pngs)))
+        return ["star"] * len(pngs)
+
+    async def write(results):
+        events.append(("write", [key for key, _ in results]))
+        if len(events) == 2:
+            await release.wait()
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        batcher = MicroBatcher(run_batch, write, max_batch=1, max_wait=0, max_writes=2)
+        first = asyncio.create_task(batcher.classify("a", b"a"))
+        while len(events) < 2:
+            await asyncio.sleep(0)
+        # The first batch's write is stuck; a second batch is still classified and stored
+        assert await batcher.classify("b", b"b") == "star"
+        assert not first.done()
+        release.set()
+        assert await first == "star"
+        await batcher.close()
+
+    asyncio.run(run())
+    assert events == [("infer", 1), ("write", ["a"]), ("infer", 1), ("write", ["b"])]
+
+
+def test_a_failed_write_reaches_the_batch_and_spares_the_next():
+    async def run_batch(pngs):
+        return ["star"] * len(pngs)
+
+    async def write(results):
+        if results[0][0] == "a":
+            raise RuntimeError("db down")
+
+    async def run():
+        batcher = MicroBatcher(run_batch, write, max_batch=1, max_wait=0)
+        with pytest.raises(RuntimeError):
+            await batcher.classify("a", b"a")
+        assert await batcher.classify("b", b"b") == "star"
+        await batcher.close()
+        return batcher.stats()
+
+    stats = asyncio.run(run())
+    assert (stats["errors"], stats["write_errors"]) == (0, 1)
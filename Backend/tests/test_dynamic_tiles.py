@@ -0,0 +1,57 @@
+import os
+import json
+
+import numpy as np
+import pytest
+
+import dynamic_tiles
+
+
+def write_pyramid(root, image_set, value, mtime):
+    """A one-level 512x512 float pyramid filled with value, as write_float_pyramid lays it out."""
+    path = os.path.join(root, f"{image_set}.pyramid")
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "0.npy"), np.full((512, 512), value, dtype=np.float32))
+    meta = os.path.join(path, "meta.json")
+    with open(meta, "w") as f:
+        json.dump({"width": 512, "height": 512, "tileSize": 512, "maxLevel": 0}, f)
+    os.utime(meta, ns=(mtime, mtime))
+
+
+@pytest.mark.parametrize("vmin, vmax", [(float("nan"), 1.0), (0.0, float("inf")), (float("-inf"), None)])
+def test_non_finite_limits_are_rejected(tmp_path, vmin, vmax):
+    write_pyramid(str(tmp_path), "sky", 1.0, 10**18)
+    with pytest.raises(ValueError):
+        dynamic_tiles.render_tile(str(tmp_path), "sky", 0, 0, 0, "linear", vmin, vmax)
+
+
+def test_a_replaced_source_is_reopened(tmp_path):
+    root = str(tmp_path)
+    write_pyramid(root, "sky", 0.25, 10**18)
+    before = dynamic_tiles.source_version(root, "sky")
+    dim = dynamic_tiles.render_tile(root, "sky", 0, 0, 0, "linear", 0.0, 1.0)
+
+    write_pyramid(root, "sky", 0.75, 2 * 10**18)
+    assert dynamic_tiles.source_version(root, "sky") != before
+    assert dynamic_tiles.render_tile(root, "sky", 0, 0, 0, "linear", 0.0, 1.0) != dim
+
+    with pytest.raises(dynamic_tiles.SourceNotFound):
+        dynamic_tiles.source_version(root, "missing")
+
+
+def test_dynamic_api_rejects_non_finite_limits_and_keys_on_the_version(client, main_module, monkeypatch, tmp_path):
+    root = str(tmp_path)
+    monkeypatch.setattr(main_module, "DYNAMIC_SOURCES_DIR", root)
+    write_pyramid(root, "sky", 0.25, 10**18)
+
+    assert client.get("/dynamic/sky/0/0/0.png?stretch=linear&vmin=nan&vmax=1").status_code == 400
+    assert client.get("/dynamic/sky/0/0/0.png?stretch=linear&vmin=0&vmax=inf").status_code == 400
+    assert client.get("/dynamic/missing/0/0/0.png").status_code == 404
+
+    url = "/dynamic/sky/0/0/0.png?stretch=linear&vmin=0&vmax=1"
+    first = client.get(url)
+    assert first.status_code == 200
+    write_pyramid(root, "sky", 0.75, 2 * 10**18)
+    second = client.get(url)
+    assert second.status_code == 200
+    assert second.headers["etag"] != first.headers["etag"]
@@ -0,0 +1,59 @@
+import asyncio
+
+from image_registry import ImageSetRegistry
+from tile_storage import StorageError, TileStorage
+
+IMAGE_SET = "demo"
+
+
+def test_info_and_images_come_from_the_registry(client, pyramid_config):
+    info = client.get(f"/info/{IMAGE_SET}").json()
+    assert {key: info[key] for key in pyramid_config} == pyramid_config
+    assert info["tileSourceUrl"].endswith(f"/n-large/{IMAGE_SET}")
+    names = [image["name"] for image in client.get("/images").json()["images"]]
+    assert names == [IMAGE_SET]
+    assert client.get("/info/unknown").status_code == 404
+
+
+def test_health(client):
+    assert client.get("/health/live").json() == {"status": "ok"}
+    assert client.get("/health/ready").status_code == 200
+
+
+class ListedStorage(TileStorage):
+    def __init__(self, names):
+        self.names = names
+        self.fetched = []
+
+    async def list_image_sets(self):
+        if self.names is None:
+            raise StorageError("listing failed")
+        return list(self.names)
+
+    async def get_config(self, image_set):
+        self.fetched.append(image_set)
+        return {"name": image_set}
+
+
+def test_refresh_fetches_only_new_sets_and_drops_unlisted_ones():
+    storage = ListedStorage(["a", "b"])
+    registry = ImageSetRegistry(storage, extra=["pinned"])
+
+    async def run():
+        await registry.refresh()
+        assert sorted(storage.fetched) == ["a", "b", "pinned"]
+
+        storage.fetched.clear()
+        storage.names = ["b", "c"]
+        await registry.refresh()
+        assert storage.fetched == ["c"]
+        assert [name for name, _ in registry.list()] == ["b", "c", "pinned"]
+
+        # Without a listing, the sets already held are kept and nothing is refetched
+        storage.fetched.clear()
+        storage.names = None
+        await registry.refresh()
+        assert storage.fetched == []
+        assert [name for name, _ in registry.list()] == ["b", "c", "pinned"]
+
+    asyncio.run(run())
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from label_cache import LabelCache
+
+
+class Loader:
+    """Counts calls and holds each load until released, so requests can overlap."""
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.calls = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, keys):
+        self.calls.append(sorted(keys))
+        await self.release.wait()
+        return {key: self.labels[key] for key in keys if key in self.labels}
+
+
+def test_concurrent_misses_share_one_load():
+    async def scenario():
+        cache = LabelCache()
+        loader = Loader({"a": "star", "b": "galaxy"})
+        requests = [asyncio.create_task(cache.get_many(["a", "b", "c"], loader)) for _ in range(5)]
+        await asyncio.sleep(0)
+        loader.release.set()
+        results = await asyncio.gather(*requests)
+        return cache, loader, results
+
+    cache, loader, results = asyncio.run(scenario())
+    assert loader.calls == [["a", "b", "c"]]
+    assert results == [{"a": "star", "b": "galaxy"}] * 5
+    assert cache.coalesced == 12
+    assert not cache.inflight
+
+
+def test_only_uncached_keys_are_loaded():
+    async def scenario():
+        cache = LabelCache()
+        loader = Loader({"a": "star", "b": "galaxy"})
+        loader.release.set()
+        await cache.get_many(["a"], loader)
+        result = await cache.get_many(["a", "b"], loader)
+        return loader, result
+
+    loader, result = asyncio.run(scenario())
+    assert loader.calls == [["a"], ["b"]]
+    assert result == {"a": "star", "b": "galaxy"}
+
+
+def test_missing_labels_are_cached_negatively():
+    async def scenario():
+        cache = LabelCache(negative_ttl=60)
+        loader = Loader({})
+        loader.release.set()
+        await cache.get_many(["none"], loader)
+        await cache.get_many(["none"], loader)
+        return cache, loader
+
+    cache, loader = asyncio.run(scenario())
+    assert loader.calls == [["none"]]
+    assert cache.negative_hits == 1
+
+
+def test_load_failure_reaches_every_waiter_and_is_not_cached():
+    async def failing(keys):
+        await asyncio.sleep(0)
+        raise RuntimeError("database down")
+
+    async def scenario():
+        cache = LabelCache()
+        requests = [asyncio.create_task(cache.get_many(["a"], failing)) for _ in range(3)]
+        results = await asyncio.gather(*requests, return_exceptions=True)
+        return cache, results
+
+    cache, results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert not cache.inflight
+    assert "a" not in cache.entries
+
+
+def test_expired_entries_are_misses():
+    cache = LabelCache(ttl=10)
+    cache.put("a", "star", now=100.0)
+    assert cache.lookup("a", now=105.0) == (True, "star")
+    assert cache.lookup("a", now=111.0) == (False, None)
+    assert cache.expired == 1
+
+
+def test_lru_bound_on_entries():
+    cache = LabelCache(max_entries=2)
+    for key in "abc":
+        cache.put(key, "star")
+    assert list(cache.entries) == ["b", "c"]
+    assert cache.evictions == 1
+
+
+@pytest.mark.parametrize("value", ["star", None])
+def test_put_replaces_without_double_counting(value):
+    cache = LabelCache()
+    cache.put("a", "galaxy")
+    size = cache.current_bytes
+    cache.put("a", value)
+    assert cache.current_bytes == size
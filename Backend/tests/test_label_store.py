@@ -0,0 +1,82 @@
+import asyncio
+
+import asyncpg
+
+import metrics
+from label_store import LabelStore
+from migrate_labels import migrate
+
+URL_BASE = "https://storage.googleapis.com/n-large"
+
+
+async def create_schema(dsn):
+    """nlarge as it exists in production (no unique key), with one legacy row, then migrate_labels."""
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute("CREATE TABLE nlarge (file_path TEXT, value TEXT)")
+        await conn.execute("INSERT INTO nlarge VALUES ($1, 'galaxy')", f"{URL_BASE}/demo/5/0/0.png")
+    finally:
+        await conn.close()
+    await migrate(dsn)
+
+
+def test_upsert_load_and_bbox(label_db):
+    async def run():
+        await create_schema(label_db)
+        store = LabelStore(label_db, min_size=1, max_size=2)
+        await store.open()
+        try:
+            await store.upsert_labels(
+                [("demo", 3, x, y, "star" if x % 2 else "nebula") for x in range(4) for y in range(3)],
+                "v1", URL_BASE,
+            )
+            # A second upsert replaces labels in both tables
+            await store.upsert_labels([("demo", 3, 0, 0, "galaxy"), ("other", 3, 0, 0, "star")], "v2", URL_BASE)
+
+            paths = [f"{URL_BASE}/demo/3/{x}/0.png" for x in range(2)] + [f"{URL_BASE}/demo/3/9/9.png"]
+            labels = await store.load_labels(paths)
+            rect = await store.labels_in_rect("demo", 3, 0, 0, 1, 1)
+            versions = await store.fetch(
+                "SELECT model_version, count(*) AS n FROM tile_labels GROUP BY model_version ORDER BY 1"
+            )
+            return labels, rect, [(r["model_version"], r["n"]) for r in versions], store.stats()
+        finally:
+            await store.close()
+
+    labels, rect, versions, stats = asyncio.run(run())
+    assert labels == {f"{URL_BASE}/demo/3/0/0.png": "galaxy", f"{URL_BASE}/demo/3/1/0.png": "star"}
+    # Tiles come back ordered by (x, y) with labels as indices into classes
+    assert (rect["x"], rect["y"]) == ([0, 0, 1, 1], [0, 1, 0, 1])
+    assert [rect["classes"][i] for i in rect["label"]] == ["galaxy", "nebula", "star", "star"]
+    # The backfilled legacy row has no model version
+    assert versions == [("v1", 11), ("v2", 2), (None, 1)]
+    assert stats["queries"] == 5 and stats["errors"] == 0
+
+
+def test_queries_feed_the_db_metrics(label_db):
+    def count(histogram):
+        return sum(sum(series[:-1]) for series in histogram.series.values())
+
+    async def run():
+        await create_schema(label_db)
+        store = LabelStore(label_db, min_size=1, max_size=1)
+        await store.open()
+        # As inside a request handled by MetricsMiddleware
+        timings = {}
+        metrics._timings.set(timings)
+        try:
+            await store.upsert_labels([("demo", 3, 0, 0, "star")], "v1", URL_BASE)
+            await asyncio.gather(*[store.load_labels([f"{URL_BASE}/demo/3/0/0.png"]) for _ in range(4)])
+        finally:
+            await store.close()
+        return timings, store.stats()
+
+    queries, waits = count(metrics.DB_QUERY_SECONDS), count(metrics.DB_ACQUIRE_SECONDS)
+    timings, stats = asyncio.run(run())
+    assert count(metrics.DB_QUERY_SECONDS) - queries == 5
+    assert count(metrics.DB_ACQUIRE_SECONDS) - waits == 5
+    # Server-Timing splits query time from pool waits; the four lookups queued for one connection
+    assert timings["db"] > 0 and timings["db_wait"] > 0
+    assert stats["acquires"] == stats["queries"] == 5
+    assert stats["wait_max_ms"] > 0
+    assert "nlarge_db_query_duration_seconds_count" in metrics.render()
@@ -0,0 +1,30 @@
+import json
+import logging
+
+import pytest
+
+from log_format import configure_logging
+
+
+@pytest.fixture
+def restore_logging():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+@pytest.mark.parametrize("name, level", [("debug", logging.DEBUG), (" Warning ", logging.WARNING), (logging.ERROR, logging.ERROR)])
+def test_log_levels(restore_logging, name, level):
+    configure_logging(name)
+    assert logging.getLogger().level == level
+    assert logging.getLogger("httpx").level == (logging.DEBUG if level == logging.DEBUG else logging.WARNING)
+
+
+def test_unknown_log_level_falls_back_to_info(restore_logging, capsys):
+    configure_logging("VERBOSE", "json")
+    assert logging.getLogger().level == logging.INFO
+    record = json.loads(capsys.readouterr().err.strip().splitlines()[-1])
+    assert record["level"] == "WARNING"
+    assert "VERBOSE" in record["message"]
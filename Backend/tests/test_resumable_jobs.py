@@ -0,0 +1,210 @@
+import os
+import json
+import hashlib
+import contextlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import generate_fits_tiles
+from generate_fits_tiles import ArchiveSink
+from tile_archive import PREAMBLE, TileArchive, TileArchiveWriter
+from tile_manifest import JobManifest
+
+JOB = {"source": "/data/sky.fits", "width": 1100, "height": 700, "tileSize": 512, "maxLevel": 2}
+
+
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def test_resume_skips_recorded_tiles(tmp_path):
+    path = str(tmp_path / "job.jsonl")
+    manifest = JobManifest(path, JOB)
+    manifest.record(2, 0, 0, "aa")
+    manifest.record(2, 1, 0, "bb", {"offset": 16, "length": 4})
+    manifest.close()
+
+    with quiet():
+        resumed = JobManifest(path, JOB)
+    assert resumed.is_done(2, 0, 0) and resumed.is_done(2, 1, 0)
+    assert not resumed.is_done(1, 0, 0)
+    assert resumed.done[(2, 1, 0)]["offset"] == 16
+    resumed.close()
+
+
+def test_torn_last_line_is_redone_and_terminated(tmp_path):
+    path = str(tmp_path / "job.jsonl")
+    manifest = JobManifest(path, JOB)
+    manifest.record(2, 0, 0, "aa")
+    manifest.close()
+    with open(path, "a") as f:
+        f.write('{"z": 2, "x": 1, "y"')
+
+    with quiet():
+        resumed = JobManifest(path, JOB)
+    assert list(resumed.done) == [(2, 0, 0)]
+    resumed.record(2, 1, 0, "bb")
+    resumed.close()
+
+    with quiet():
+        again = JobManifest(path, JOB)
+    assert set(again.done) == {(2, 0, 0), (2, 1, 0)}
+    again.close()
+
+
+def test_manifest_of_another_job_is_rejected(tmp_path):
+    path = str(tmp_path / "job.jsonl")
+    JobManifest(path, JOB).close()
+    with pytest.raises(ValueError):
+        JobManifest(path, {**JOB, "tileSize": 256})
+
+
+def test_reset_forgets_recorded_tiles(tmp_path):
+    path = str(tmp_path / "job.jsonl")
+    manifest = JobManifest(path, JOB)
+    manifest.record(2, 0, 0, "aa")
+    manifest.reset()
+    manifest.close()
+    with open(path) as f:
+        assert [json.loads(line) for line in f] == [{"job": JOB}]
+
+
+class CountingSink(generate_fits_tiles.LocalDirectorySink):
+    def __init__(self, root, prefix):
+        super().__init__(root, prefix)
+        self.written = []
+
+    def put_tile(self, z, x, y, data, sha256=None):
+        self.written.append((z, x, y))
+        super().put_tile(z, x, y, data, sha256)
+
+
+def tile_run(tmp_path, source, manifest_path):
+    sink = CountingSink(str(tmp_path / "out"), "demo")
+    with quiet():
+        generate_fits_tiles.create_and_upload_tiles(
+            sink, source, encode_workers=1, upload_workers=2, manifest_path=manifest_path,
+        )
+    return sink.written
+
+
+def test_rerun_of_a_job_only_redoes_unrecorded_tiles(tmp_path):
+    source = str(tmp_path / "source.png")
+    Image.fromarray(np.random.default_rng(0).integers(0, 255, (700, 1100, 3), dtype=np.uint8)).save(source)
+    manifest_path = str(tmp_path / "job.jsonl")
+
+    first = tile_run(tmp_path, source, manifest_path)
+    assert len(first) == len(set(first)) > 1
+    assert tile_run(tmp_path, source, manifest_path) == []
+
+    # Lose the last two records, as if the run had been killed before writing them
+    with open(manifest_path) as f:
+        lines = f.readlines()
+    with open(manifest_path, "w") as f:
+        f.writelines(lines[:-2])
+    lost = {tuple(json.loads(line)[k] for k in "zxy") for line in lines[-2:]}
+    assert set(tile_run(tmp_path, source, manifest_path)) == lost
+
+
+
+def test_rerun_redoes_recorded_tiles_whose_files_are_gone(tmp_path):
+    source = str(tmp_path / "source.png")
+    Image.fromarray(np.random.default_rng(0).integers(0, 255, (700, 1100, 3), dtype=np.uint8)).save(source)
+    manifest_path = str(tmp_path / "job.jsonl")
+    tile_run(tmp_path, source, manifest_path)
+
+    os.remove(tmp_path / "out" / "demo" / "2" / "1" / "0.png")
+    assert tile_run(tmp_path, source, manifest_path) == [(2, 1, 0)]
+    assert (tmp_path / "out" / "demo" / "2" / "1" / "0.png").is_file()
+
+
+def test_directory_sink_hardlinks_repeated_tiles(tmp_path):
+    sink = CountingSink(str(tmp_path / "out"), "demo")
+    with quiet():
+        for key, data in [((1, 0, 0), b"blank"), ((1, 1, 0), b"blank"), ((1, 0, 1), b"stars")]:
+            sink.put_tile(*key, data, hashlib.sha256(data).hexdigest())
+        sink.close()
+
+    root = tmp_path / "out" / "demo" / "1"
+    assert (root / "1" / "0.png").read_bytes() == b"blank"
+    assert os.path.samefile(root / "0" / "0.png", root / "1" / "0.png")
+    assert not os.path.samefile(root / "0" / "0.png", root / "0" / "1.png")
+    assert sorted(p.name for p in (root / "1").iterdir()) == ["0.png"]
+
+    # Rewriting one linked copy leaves the other alone
+    sink.put_tile(1, 1, 0, b"other")
+    assert (root / "0" / "0.png").read_bytes() == b"blank"
+
+# --- Archive output ---
+def interrupted_archive(path, tiles):
+    """A .tmp archive as a crashed run leaves it: blobs synced, no header or index."""
+    writer = TileArchiveWriter(path)
+    locations = {key: writer.add_tile(*key, data) for key, data in tiles.items()}
+    writer.sync()
+    writer.file.close()
+    return locations
+
+
+def test_resume_adopts_complete_tiles(tmp_path):
+    path = str(tmp_path / "demo.tiles")
+    locations = interrupted_archive(path, {(0, 0, 0): b"aaaa", (1, 0, 0): b"bbbb"})
+
+    writer = TileArchiveWriter(path, resume=True)
+    assert writer.resumed
+    assert writer.restore(locations) == locations
+    writer.add_tile(1, 1, 0, b"cccc")
+    writer.close()
+
+    archive = TileArchive(path)
+    try:
+        assert [bytes(archive.get(*key)) for key in [(0, 0, 0), (1, 0, 0), (1, 1, 0)]] == [b"aaaa", b"bbbb", b"cccc"]
+    finally:
+        archive.close()
+
+
+def test_resume_drops_tiles_past_the_end_of_the_file(tmp_path):
+    path = str(tmp_path / "demo.tiles")
+    locations = interrupted_archive(path, {(0, 0, 0): b"aaaa", (1, 0, 0): b"bbbb"})
+    # The second blob never reached the disk
+    os.truncate(f"{path}.tmp", PREAMBLE.size + 6)
+
+    writer = TileArchiveWriter(path, resume=True)
+    kept = writer.restore(locations)
+    assert kept == {(0, 0, 0): locations[(0, 0, 0)]}
+    # The torn tail is cut off, so the next blob starts right after the kept one
+    assert writer.add_tile(1, 0, 0, b"BBBB") == (PREAMBLE.size + 4, 4)
+    writer.close()
+
+    archive = TileArchive(path)
+    try:
+        assert bytes(archive.get(1, 0, 0)) == b"BBBB"
+    finally:
+        archive.close()
+
+
+def test_archive_sink_resume_forgets_lost_manifest_entries(tmp_path):
+    path = str(tmp_path / "demo.tiles")
+    locations = interrupted_archive(path, {(0, 0, 0): b"aaaa", (1, 0, 0): b"bbbb"})
+    os.truncate(f"{path}.tmp", PREAMBLE.size + 6)
+    entries = {
+        key: {"z": key[0], "x": key[1], "y": key[2], "sha256": f"sha-{key}", "offset": offset, "length": length}
+        for key, (offset, length) in locations.items()
+    }
+
+    with quiet():
+        sink = ArchiveSink(path, resume=True)
+        assert sink.resume(entries)
+    assert list(entries) == [(0, 0, 0)]
+    assert list(sink.blobs) == ["sha-(0, 0, 0)"]
+    sink.writer.file.close()
+
+
+def test_archive_sink_without_partial_file_starts_over(tmp_path):
+    with quiet():
+        sink = ArchiveSink(str(tmp_path / "demo.tiles"), resume=True)
+    assert not sink.resume({(0, 0, 0): {"sha256": "x", "offset": 16, "length": 4}})
+    sink.writer.file.close()
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from tile_archive import TileArchive, TileArchiveWriter
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "demo.tiles")
+    with TileArchiveWriter(path, {"width": 10, "height": 20}) as writer:
+        first = writer.add_tile(0, 0, 0, b"tile-0")
+        writer.add_tile(1, 1, 0, b"tile-1")
+        writer.add_alias(1, 0, 0, first)
+        writer.set_config({"tileSize": 512, "maxLevel": 1})
+    assert not os.path.exists(f"{path}.tmp")
+
+    archive = TileArchive(path)
+    try:
+        assert archive.config == {"width": 10, "height": 20, "tileSize": 512, "maxLevel": 1}
+        assert archive.archive_id
+        assert len(archive) == 3
+        assert bytes(archive.get(0, 0, 0)) == b"tile-0"
+        assert bytes(archive.get(1, 1, 0)) == b"tile-1"
+        assert archive.location(1, 0, 0) == archive.location(0, 0, 0)
+        assert archive.get(2, 0, 0) is None
+    finally:
+        archive.close()
+
+
+def test_failed_write_leaves_no_archive(tmp_path):
+    path = str(tmp_path / "demo.tiles")
+    with pytest.raises(RuntimeError):
+        with TileArchiveWriter(path) as writer:
+            writer.add_tile(0, 0, 0, b"tile")
+            raise RuntimeError("interrupted")
+    assert not os.path.exists(path)
+    assert not os.path.exists(f"{path}.tmp")
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "junk.tiles"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        TileArchive(str(path))
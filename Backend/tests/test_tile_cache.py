@@ -0,0 +1,127 @@
+import os
+import asyncio
+
+import httpx
+
+from tile_cache import CachedTile, DiskTileCache, MemoryTileCache, TieredTileCache, etag_matches, make_etag
+
+
+def tile(size, etag='"e"'):
+    return CachedTile(b"x" * size, etag)
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryTileCache(300)
+    cache.put("a", tile(100))
+    cache.put("b", tile(100))
+    cache.put("c", tile(100))
+    assert cache.get("a") is not None  # a is now the most recent
+    cache.put("d", tile(100))
+    assert "b" not in cache
+    assert all(key in cache for key in "acd")
+    assert cache.current_bytes == 300
+
+
+def test_memory_cache_skips_tiles_larger_than_the_budget():
+    cache = MemoryTileCache(100)
+    cache.put("a", tile(50))
+    cache.put("big", tile(101))
+    assert "big" not in cache
+    assert "a" in cache
+
+
+def test_memory_cache_replacing_a_key_keeps_the_byte_count():
+    cache = MemoryTileCache(1000)
+    cache.put("a", tile(100))
+    cache.put("a", tile(40))
+    assert cache.current_bytes == 40
+    assert len(cache.entries) == 1
+
+
+def test_disk_cache_evicts_oldest_files(tmp_path):
+    cache = DiskTileCache(str(tmp_path), 1000)
+    for key in ("a", "b", "c"):
+        cache.put(key, tile(400))
+    assert "a" not in cache
+    assert not os.path.exists(cache._path("a"))
+    assert cache.get("c") == tile(400)
+    assert cache.current_bytes <= 1000
+
+
+def test_disk_cache_scan_restores_tiles_oldest_first(tmp_path):
+    first = DiskTileCache(str(tmp_path), 10_000)
+    for i, key in enumerate(("old", "mid", "new")):
+        first.put(key, tile(300))
+        os.utime(first._path(key), (1000 + i, 1000 + i))
+
+    cache = DiskTileCache(str(tmp_path), 700)
+    assert cache.get("new") is None  # nothing is indexed before the scan
+    cache.start_scan()
+    assert cache.scanned.wait(5)
+    assert "old" not in cache
+    assert cache.get("new") == tile(300)
+
+
+def test_tiered_cache_promotes_disk_hits(tmp_path):
+    cache = TieredTileCache(1000, str(tmp_path), 10_000)
+    cache.disk.put("a", tile(10))
+    assert not cache.memory.entries
+    assert asyncio.run(cache.get("a")) == tile(10)
+    assert "a" in cache.memory
+
+
+def test_etag_matching_is_weak():
+    etag = make_etag(b"body")
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'W/{etag}', etag)
+    assert etag_matches(f'"other", {etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
+
+
+# --- Through /tiles (bucket stand-in, see conftest.py) ---
+IMAGE_SET = "demo"
+
+
+def cache_stats(client):
+    return client.get("/tiles-cache/stats").json()["memory"]
+
+
+def test_remote_tile_is_streamed_then_served_from_cache(client, tile_bytes):
+    before = cache_stats(client)
+    response = client.get(f"/tiles/{IMAGE_SET}/2/0/0.png")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert response.content == tile_bytes(2, 0, 0)
+    etag = response.headers["etag"]
+    assert "immutable" in response.headers["cache-control"]
+    assert "Accept" not in response.headers.get("vary", "")  # no transcoding configured
+
+    again = client.get(f"/tiles/{IMAGE_SET}/2/0/0.png")
+    assert again.content == response.content
+    assert again.headers["etag"] == etag
+    after = cache_stats(client)
+    assert after["hits"] == before["hits"] + 1
+    assert after["entries"] == before["entries"] + 1
+
+
+def test_matching_etag_gets_304(client):
+    etag = client.get(f"/tiles/{IMAGE_SET}/2/1/0.png").headers["etag"]
+    response = client.get(f"/tiles/{IMAGE_SET}/2/1/0.png", headers={"If-None-Match": f"W/{etag}"})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+
+def test_matching_etag_gets_304_on_a_cache_miss(client, bucket_server):
+    # The upstream ETag is known before the body is read, so no body is relayed
+    etag = httpx.get(f"{bucket_server.url}/n-large/{IMAGE_SET}/2/2/0.png").headers["etag"]
+    response = client.get(f"/tiles/{IMAGE_SET}/2/2/0.png", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_stale_etag_gets_the_tile(client, tile_bytes):
+    response = client.get(f"/tiles/{IMAGE_SET}/2/0/1.png", headers={"If-None-Match": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == tile_bytes(2, 0, 1)
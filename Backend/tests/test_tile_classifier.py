@@ -0,0 +1,116 @@
+"""
+Tiling with the in-process classifier, against a throwaway Postgres database
+and a tiny TorchScript model that calls a tile red or blue by its mean colour.
+"""
+import os
+import json
+import asyncio
+import contextlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+torch = pytest.importorskip("torch")
+
+import generate_fits_tiles
+from migrate_labels import migrate
+from model_artifact import META_FILE
+
+CLASSES = ["red", "blue"]
+
+
+class MeanColour(torch.nn.Module):
+    def forward(self, x):
+        mean = x.mean(dim=(2, 3))
+        return torch.stack([mean[:, 0], mean[:, 2]], dim=1)
+
+
+@pytest.fixture(scope="module")
+def model_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("model") / "colour.ts")
+    meta = {"classes": CLASSES, "model_version": "colour-1", "variant": "fp32", "input_size": 224}
+    torch.jit.save(torch.jit.script(MeanColour()), path, _extra_files={META_FILE: json.dumps(meta)})
+    return path
+
+
+@pytest.fixture
+def labels_db(label_db):
+    async def create():
+        import asyncpg
+        conn = await asyncpg.connect(label_db)
+        try:
+            await conn.execute("CREATE TABLE nlarge (file_path TEXT, value TEXT)")
+        finally:
+            await conn.close()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            await migrate(label_db)
+    asyncio.run(create())
+    return label_db
+
+
+def query(dsn, sql, *args):
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql, args)
+            rows = cursor.fetchall() if cursor.description else None
+        conn.commit()
+        return rows
+    finally:
+        conn.close()
+
+
+class RecordingSink(generate_fits_tiles.LocalDirectorySink):
+    def __init__(self, root, prefix):
+        super().__init__(root, prefix)
+        self.written = []
+
+    def put_tile(self, z, x, y, data, sha256=None):
+        self.written.append((z, x, y))
+        super().put_tile(z, x, y, data, sha256)
+
+
+def run_tiler(tmp_path, source, model_path, dsn, batch_size):
+    from tile_classifier import TileClassifier
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        sink = RecordingSink(str(tmp_path / "out"), "demo")
+        classifier = TileClassifier(model_path, None, "demo", dsn, batch_size=batch_size, commit_every=5)
+        submitted = []
+        submit = classifier.submit
+        classifier.submit = lambda z, x, y, tile: (submitted.append((z, x, y)), submit(z, x, y, tile))
+        generate_fits_tiles.create_and_upload_tiles(
+            sink, source, encode_workers=1, upload_workers=2,
+            manifest_path=str(tmp_path / "job.jsonl"), classifier=classifier,
+        )
+    return sink.written, submitted, classifier
+
+
+def test_tiling_labels_every_tile_and_resumes_missing_labels(tmp_path, model_path, labels_db):
+    # Red left of x = 550, blue to the right
+    pixels = np.zeros((700, 1100, 3), dtype=np.uint8)
+    pixels[:, :550, 0] = 255
+    pixels[:, 550:, 2] = 255
+    source = str(tmp_path / "source.png")
+    Image.fromarray(pixels).save(source)
+
+    written, submitted, classifier = run_tiler(tmp_path, source, model_path, labels_db, batch_size=4)
+    assert sorted(submitted) == sorted(written)
+    assert classifier.tiles_classified == classifier.labels_written == len(written)
+    labels = {(z, x, y): value for z, x, y, value in query(
+        labels_db, "SELECT z, x, y, value FROM tile_labels WHERE image_set = 'demo' AND model_version = 'colour-1'")}
+    assert set(labels) == set(written)
+    assert labels[(2, 0, 0)] == "red" and labels[(2, 2, 1)] == "blue"
+    urls = query(labels_db, "SELECT count(*) FROM nlarge WHERE file_path LIKE %s",
+                 "https://storage.googleapis.com/n-large/demo/%")
+    assert urls == [(len(written),)]
+
+    # Labels lost after the manifest recorded the tiles: only those tiles are classified
+    # again (skip), and none of them is written to the sink a second time (emit)
+    query(labels_db, "DELETE FROM tile_labels WHERE z = 2 AND x = 1")
+    lost = {key for key in labels if key[0] == 2 and key[1] == 1}
+    written, submitted, _ = run_tiler(tmp_path, source, model_path, labels_db, batch_size=4)
+    assert written == []
+    assert set(submitted) == lost
+    assert query(labels_db, "SELECT count(*) FROM tile_labels") == [(len(labels),)]
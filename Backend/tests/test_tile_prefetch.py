@@ -0,0 +1,48 @@
+import asyncio
+
+from tile_cache import TieredTileCache
+from tile_prefetch import TilePrefetcher, png_key
+
+CONFIG = {"width": 2048, "height": 2048, "tileSize": 512, "maxLevel": 2}
+
+
+def test_prefetch_runs_on_misses_and_prefetched_tiles_only():
+    cache = TieredTileCache(1 << 20)
+    fetched = []
+
+    async def fetch(image_set, z, x, y, fmt):
+        fetched.append((z, x, y))
+        await cache.put(png_key(image_set, z, x, y, fmt), b"tile")
+
+    async def get_config(image_set):
+        return CONFIG
+
+    async def settle(prefetcher):
+        while prefetcher.tasks:
+            await asyncio.gather(*list(prefetcher.tasks))
+
+    async def run():
+        prefetcher = TilePrefetcher(cache, fetch, get_config, budget=4)
+
+        # A miss warms the neighbourhood
+        prefetcher.on_request("demo", 1, 0, 0)
+        await settle(prefetcher)
+        await cache.put(png_key("demo", 1, 0, 0), b"tile")
+        warmed = list(fetched)
+        assert warmed and (1, 0, 0) not in warmed
+
+        # Hitting the same tile again is not a reason to look around it again
+        for _ in range(5):
+            prefetcher.on_request("demo", 1, 0, 0)
+        assert not prefetcher.tasks
+        assert prefetcher.warm_hits == 5
+
+        # Moving onto a prefetched tile keeps prefetching ahead of the viewer
+        prefetcher.on_request("demo", *warmed[0])
+        assert prefetcher.tasks
+        await settle(prefetcher)
+        return prefetcher.stats()
+
+    stats = asyncio.run(run())
+    assert stats["used"] == 1
+    assert stats["scheduled"] == len(fetched)
@@ -0,0 +1,32 @@
+"""
+/tiles through the pooled HTTP client, against the bucket stand-in (see conftest.py).
+The tile cache is shared by the whole session, so each test reads its own tiles.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+IMAGE_SET = "demo"
+
+
+def test_remote_tile_is_relayed_with_the_upstream_validator(client, bucket_server, tile_bytes):
+    upstream = httpx.get(f"{bucket_server.url}/n-large/{IMAGE_SET}/2/1/1.png")
+    response = client.get(f"/tiles/{IMAGE_SET}/2/1/1.png")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert response.content == tile_bytes(2, 1, 1)
+    assert response.headers["content-length"] == str(len(tile_bytes(2, 1, 1)))
+    assert response.headers["etag"] == upstream.headers["etag"]
+
+
+def test_missing_tile_is_404(client):
+    assert client.get(f"/tiles/{IMAGE_SET}/9/0/0.png").status_code == 404
+    assert client.get("/tiles/unknown/0/0/0.png").status_code == 404
+
+
+def test_concurrent_requests(client, tile_bytes):
+    # TestClient runs the app on one event loop, so these overlap on the shared pooled client
+    with ThreadPoolExecutor(8) as pool:
+        responses = list(pool.map(lambda _: client.get(f"/tiles/{IMAGE_SET}/1/1/0.png"), range(20)))
+    assert {r.status_code for r in responses} == {200}
+    assert all(r.content == tile_bytes(1, 1, 0) for r in responses)
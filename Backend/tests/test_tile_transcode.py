@@ -0,0 +1,60 @@
+import io
+
+import pytest
+from PIL import Image
+
+from tile_transcode import negotiate, parse_accept, transcode
+
+CHROME = "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"
+
+
+@pytest.mark.parametrize("accept, preferred, expected", [
+    (CHROME, ["webp"], "webp"),
+    (CHROME, ["avif", "webp"], "avif"),
+    (CHROME, ["jpeg", "webp"], "webp"),
+    (CHROME, [], "png"),
+    (None, ["webp"], "png"),
+    ("*/*", ["webp"], "png"),
+    ("image/*", ["webp"], "png"),
+    ("image/webp;q=0", ["webp"], "png"),
+    ("image/webp;q=0.5, image/png", ["webp"], "webp"),
+    ("IMAGE/WEBP", ["webp"], "webp"),
+])
+def test_negotiate(accept, preferred, expected):
+    assert negotiate(accept, preferred) == expected
+
+
+def test_parse_accept_skips_wildcards_and_bad_q():
+    assert parse_accept("image/webp;q=abc, */*;q=0.8, image/png") == {"image/webp": 0.0, "image/png": 1.0}
+
+
+def test_transcode_to_webp():
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), (10, 20, 30)).save(buffer, format="PNG")
+    with Image.open(io.BytesIO(transcode(buffer.getvalue(), "webp", 80))) as img:
+        assert img.format == "WEBP"
+        assert img.size == (64, 64)
+
+
+# --- Through /tiles (bucket stand-in, see conftest.py) ---
+IMAGE_SET = "demo"
+
+
+def test_accept_negotiation(client, main_module, monkeypatch, tile_bytes):
+    monkeypatch.setattr(main_module, "TILE_FORMATS", ["webp"])
+    response = client.get(f"/tiles/{IMAGE_SET}/1/0/0.png", headers={"Accept": "image/webp,*/*"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert "Accept" in response.headers["vary"]
+    with Image.open(io.BytesIO(response.content)) as img:
+        assert img.format == "WEBP"
+
+    png = client.get(f"/tiles/{IMAGE_SET}/1/0/0.png", headers={"Accept": "image/png,*/*"})
+    assert png.headers["content-type"] == "image/png"
+    assert png.content == tile_bytes(1, 0, 0)
+    assert png.headers["etag"] != response.headers["etag"]
+
+    cached = client.get(f"/tiles/{IMAGE_SET}/1/0/0.png", headers={
+        "Accept": "image/webp", "If-None-Match": response.headers["etag"],
+    })
+    assert cached.status_code == 304
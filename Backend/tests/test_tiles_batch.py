@@ -0,0 +1,62 @@
+"""
+/tiles-batch against the bucket stand-in (see conftest.py).
+"""
+import io
+
+import pytest
+from PIL import Image
+
+IMAGE_SET = "demo"
+
+
+def parse_batch(body):
+    from main import TILE_BATCH_RECORD
+    records = {}
+    offset = 0
+    while offset < len(body):
+        z, x, y, found, length = TILE_BATCH_RECORD.unpack_from(body, offset)
+        offset += TILE_BATCH_RECORD.size
+        records[(z, x, y)] = body[offset:offset + length] if found else None
+        offset += length
+    assert offset == len(body)
+    return records
+
+
+def test_batch_returns_one_record_per_tile(client, tile_bytes):
+    response = client.post(f"/tiles-batch/{IMAGE_SET}", json={"tiles": [[0, 0, 0], [1, 1, 0], [9, 0, 0], [0, 0, 0]]})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-nlarge-tiles"
+    assert response.headers["x-tile-format"] == "png"
+    assert response.headers["x-tile-count"] == "3"  # duplicates are dropped
+    records = parse_batch(response.content)
+    assert records == {(0, 0, 0): tile_bytes(0, 0, 0), (1, 1, 0): tile_bytes(1, 1, 0), (9, 0, 0): None}
+
+
+def test_batch_negotiates_the_format(client, main_module, monkeypatch):
+    monkeypatch.setattr(main_module, "TILE_FORMATS", ["webp"])
+    response = client.post(f"/tiles-batch/{IMAGE_SET}", json={"tiles": [[0, 0, 0]]},
+                           headers={"Accept": "image/webp"})
+    assert response.headers["x-tile-format"] == "webp"
+    with Image.open(io.BytesIO(parse_batch(response.content)[(0, 0, 0)])) as img:
+        assert img.format == "WEBP"
+
+
+@pytest.mark.parametrize("body", [
+    {"tiles": [[0, 0]]},
+    {"tiles": [["a", 0, 0]]},
+    {"tiles": 5},
+    {"tiles": [[256, 0, 0]]},
+    {"tiles": [[0, -1, 0]]},
+])
+def test_batch_rejects_malformed_requests(client, body):
+    assert client.post(f"/tiles-batch/{IMAGE_SET}", json=body).status_code == 400
+
+
+def test_batch_rejects_too_many_tiles(client, main_module, monkeypatch):
+    monkeypatch.setattr(main_module, "TILE_BATCH_MAX", 2)
+    response = client.post(f"/tiles-batch/{IMAGE_SET}", json={"tiles": [[0, 0, 0], [1, 0, 0], [1, 1, 0]]})
+    assert response.status_code == 413
+
+
+def test_batch_rejects_bad_image_set_names(client):
+    assert client.post("/tiles-batch/.hidden", json={"tiles": [[0, 0, 0]]}).status_code == 404
@@ -0,0 +1,169 @@
+"""
+Single-file tile archive.
+
+Layout (all integers little-endian):
+
+    preamble   magic b"NLTA", version u16, reserved u16,
+               header_offset u64, header_length u32,
+               index_offset u64, index_count u32
+    blobs      tile bodies, concatenated
+    header     UTF-8 JSON: the config.json fields plus archive metadata
+    index      index_count entries of (z u8, x u16, y u16, offset u64, length u32),
+               sorted by (z, x, y)
+
+The header and index are written after the blobs so the writer can stream tiles
+without knowing the tile count up front; the preamble is patched on close.
+Several index entries may point at the same blob.
+"""
+import os
+import json
+import mmap
+import struct
+import uuid
+from typing import Dict, Optional, Tuple
+
+MAGIC = b"NLTA"
+VERSION = 1
+PREAMBLE = struct.Struct("<4sHHQIQI")
+INDEX_ENTRY = struct.Struct("<BHHQI")
+
+
+class TileArchiveWriter:
+    """
+    Writes to {path}.tmp and renames it into place on close. With resume=True an
+    existing {path}.tmp from an interrupted run is reopened; restore() then
+    re-registers the blobs that are known to be complete.
+    """
+
+    def __init__(self, path: str, config: Optional[dict] = None, resume: bool = False):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.config = dict(config or {})
+        self.index: Dict[Tuple[int, int, int], Tuple[int, int]] = {}
+        self.resumed = resume and os.path.exists(self.tmp_path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if self.resumed:
+            self.file = open(self.tmp_path, "r+b")
+        else:
+            self.file = open(self.tmp_path, "wb")
+            self.file.write(b"\0" * PREAMBLE.size)
+        self.offset = PREAMBLE.size
+
+    def restore(self, locations: Dict[Tuple[int, int, int], Tuple[int, int]]) -> Dict[Tuple[int, int, int], Tuple[int, int]]:
+        """
+        Adopt tiles written by an interrupted run and drop anything after the last of them.
+        Tiles whose bytes never reached the file are left out; the adopted ones are returned.
+        """
+        size = os.fstat(self.file.fileno()).st_size
+        kept = {key: (offset, length) for key, (offset, length) in locations.items() if offset + length <= size}
+        end = max((offset + length for offset, length in kept.values()), default=PREAMBLE.size)
+        self.file.truncate(end)
+        self.file.seek(end)
+        self.offset = end
+        self.index.update(kept)
+        return kept
+
+    def add_tile(self, z: int, x: int, y: int, data: bytes) -> Tuple[int, int]:
+        """Append a tile body and return its (offset, length) in the archive."""
+        location = (self.offset, len(data))
+        self.file.write(data)
+        self.offset += len(data)
+        self.index[(z, x, y)] = location
+        return location
+
+    def sync(self):
+        """Make every tile added so far durable (before the job manifest lists it)."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def add_alias(self, z: int, x: int, y: int, location: Tuple[int, int]):
+        """Point (z, x, y) at a blob that is already in the archive."""
+        self.index[(z, x, y)] = location
+
+    def set_config(self, config: dict):
+        self.config.update(config)
+
+    def close(self):
+        header = dict(self.config)
+        header["archiveId"] = uuid.uuid4().hex
+        header_bytes = json.dumps(header).encode()
+        header_offset = self.offset
+        self.file.write(header_bytes)
+
+        index_offset = header_offset + len(header_bytes)
+        entries = sorted(self.index.items())
+        self.file.write(b"".join(
+            INDEX_ENTRY.pack(z, x, y, offset, length) for (z, x, y), (offset, length) in entries
+        ))
+
+        self.file.seek(0)
+        self.file.write(PREAMBLE.pack(
+            MAGIC, VERSION, 0, header_offset, len(header_bytes), index_offset, len(entries)
+        ))
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            os.remove(self.tmp_path)
+
+
+class TileArchive:
+    """
+    Read-only view of an archive. The file is memory-mapped and only the preamble,
+    header and index are parsed on open; tile reads are slices of the mapping.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+
+        magic, version, _, header_offset, header_length, index_offset, index_count = \
+            PREAMBLE.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a tile archive")
+        if version != VERSION:
+            raise ValueError(f"Unsupported tile archive version {version} in {path}")
+
+        self.config = json.loads(bytes(self.view[header_offset:header_offset + header_length]))
+        self.archive_id = self.config.pop("archiveId", "")
+        index_bytes = self.view[index_offset:index_offset + index_count * INDEX_ENTRY.size]
+        self.index = {
+            (z, x, y): (offset, length)
+            for z, x, y, offset, length in INDEX_ENTRY.iter_unpack(index_bytes)
+        }
+        index_bytes.release()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def location(self, z: int, x: int, y: int) -> Optional[Tuple[int, int]]:
+        return self.index.get((z, x, y))
+
+    def get(self, z: int, x: int, y: int) -> Optional[memoryview]:
+        """Zero-copy slice of the tile body, or None if the tile is not in the archive."""
+        location = self.index.get((z, x, y))
+        if location is None:
+            return None
+        offset, length = location
+        return self.view[offset:offset + length]
+
+    def close(self):
+        self.view.release()
+        try:
+            self.mm.close()
+        except BufferError:
+            # Slices handed out to in-flight responses still reference the mapping;
+            # it is unmapped once they are garbage collected.
+            pass
@@ -0,0 +1,255 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CachedTile(NamedTuple):
+    body: bytes
+    etag: str
+
+
+class TierStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def as_dict(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag derived from the tile bytes."""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match uses weak comparison, so W/ prefixes are ignored on both sides.
+    """
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+# --- Tier 1: in-memory LRU bounded by total body bytes ---
+class MemoryTileCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.entries = OrderedDict()
+        self.stats = TierStats()
+
+    def get(self, key: str) -> Optional[CachedTile]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats.hits += 1
+        return entry
+
+    def put(self, key: str, entry: CachedTile):
+        size = len(entry.body)
+        if size > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.current_bytes -= len(old.body)
+        self.entries[key] = entry
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.current_bytes -= len(evicted.body)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def info(self):
+        return {"entries": len(self.entries), "bytes": self.current_bytes, "max_bytes": self.max_bytes}
+
+
+# --- Tier 2: on-disk LRU bounded by total file size ---
+class DiskTileCache:
+    """
+    Stores each tile as one file named by the hash of its key. The first line of
+    the file holds the ETag, the rest is the tile body. Recency is tracked in memory
+    and seeded from file mtimes by a background scan of the cache directory
+    (start_scan); until it finishes, tiles from earlier runs count as misses.
+
+    Byte accounting lives in this process only. Several server processes sharing
+    one directory would each count just their own writes, so the directory could
+    grow to max_bytes per process: run one worker per cache directory, or give each
+    worker its own directory with its share of the budget.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.files = OrderedDict()  # path -> size, oldest first
+        self.lock = threading.Lock()
+        self.stats = TierStats()
+        self.scan_thread = None
+        self.scanned = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+
+    def start_scan(self):
+        """Index the tiles already on disk in a background thread."""
+        if self.scan_thread is None:
+            self.scan_thread = threading.Thread(target=self._scan, name="disk-cache-scan", daemon=True)
+            self.scan_thread.start()
+
+    def _scan(self):
+        started = time.time()
+        found = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                    # Leftovers of interrupted writes; newer ones may be puts in progress
+                    if name.endswith(".tmp"):
+                        if st.st_mtime < started:
+                            os.remove(path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                found.append((st.st_mtime, path, st.st_size))
+        with self.lock:
+            # Tiles written since startup are newer than anything found on disk
+            files = OrderedDict((path, size) for _, path, size in sorted(found) if path not in self.files)
+            files.update(self.files)
+            self.files = files
+            self.current_bytes = sum(files.values())
+            self._evict()
+        self.scanned.set()
+        logger.info(f"Disk tile cache: {len(self.files)} tiles, {self.current_bytes} bytes in {self.directory}")
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self.files:
+            path, size = self.files.popitem(last=False)
+            self.current_bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def get(self, key: str) -> Optional[CachedTile]:
+        path = self._path(key)
+        with self.lock:
+            if path not in self.files:
+                self.stats.misses += 1
+                return None
+            self.files.move_to_end(path)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self.lock:
+                self.current_bytes -= self.files.pop(path, 0)
+                self.stats.misses += 1
+            return None
+        etag, _, body = data.partition(b"\n")
+        with self.lock:
+            self.stats.hits += 1
+        return CachedTile(body, etag.decode())
+
+    def __contains__(self, key: str) -> bool:
+        return self._path(key) in self.files
+
+    def put(self, key: str, entry: CachedTile):
+        path = self._path(key)
+        size = len(entry.etag) + 1 + len(entry.body)
+        if size > self.max_bytes:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(entry.etag.encode() + b"\n")
+            f.write(entry.body)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.current_bytes -= self.files.pop(path, 0)
+            self.files[path] = size
+            self.current_bytes += size
+            self._evict()
+
+    def info(self):
+        return {
+            "entries": len(self.files),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "directory": self.directory,
+            "scanned": self.scanned.is_set(),
+        }
+
+
+class TieredTileCache:
+    """
+    Memory LRU in front of the disk cache. Disk hits are promoted to memory and
+    new tiles are written to both tiers. Disk I/O runs in worker threads.
+    Tile pyramids are immutable, so entries are only ever evicted for space.
+    """
+
+    def __init__(self, memory_bytes: int, disk_dir: Optional[str] = None, disk_bytes: int = 0):
+        self.memory = MemoryTileCache(memory_bytes)
+        self.disk = DiskTileCache(disk_dir, disk_bytes) if disk_dir and disk_bytes > 0 else None
+
+    def start(self):
+        """Start indexing the disk tier; call once the server is up."""
+        if self.disk is not None:
+            self.disk.start_scan()
+
+    async def get(self, key: str) -> Optional[CachedTile]:
+        entry = self.memory.get(key)
+        if entry is not None or self.disk is None:
+            return entry
+        entry = await asyncio.to_thread(self.disk.get, key)
+        if entry is not None:
+            self.memory.put(key, entry)
+        return entry
+
+    def contains(self, key: str) -> bool:
+        """Whether either tier holds the key, without touching recency or hit counters."""
+        return key in self.memory or (self.disk is not None and key in self.disk)
+
+    async def put(self, key: str, body: bytes, etag: Optional[str] = None) -> CachedTile:
+        entry = CachedTile(body, etag or make_etag(body))
+        self.memory.put(key, entry)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.put, key, entry)
+            except OSError as e:
+                logger.warning(f"Disk tile cache write failed for {key}: {e}")
+        return entry
+
+    def stats(self):
+        stats = {"memory": {**self.memory.stats.as_dict(), **self.memory.info()}}
+        if self.disk is not None:
+            stats["disk"] = {**self.disk.stats.as_dict(), **self.disk.info()}
+        return stats
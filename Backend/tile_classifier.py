@@ -0,0 +1,155 @@
+"""
+In-process tile classification for the tiler.
+
+The crops generate_fits_tiles.py produces are classified while the pyramid is
+built, instead of interface.py downloading and decoding every PNG again later.
+Each crop is resized to the model input in memory and copied into a
+preallocated uint8 batch; full batches go to an inference thread (torch
+releases the GIL while it computes, so tiling keeps going), and the labels are
+upserted in large execute_values transactions.
+
+The model is an artifact exported by ai/src/export.py (TorchScript with its
+classes and version embedded), or the raw ResNet18 state dict from train.py
+with classes taken from the training dataset's folder names. Preprocessing
+matches interface.py: 224x224 bilinear resize, 0..1 scaling, no normalisation.
+"""
+import os
+import time
+import queue
+import threading
+import numpy as np
+from PIL import Image
+
+from model_artifact import is_artifact, load_artifact, load_weights, model_version_of
+
+INPUT_SIZE = 224
+BATCH_SIZE = 64
+# Label rows per DB transaction
+COMMIT_EVERY = 2000
+TILE_URL_BASE = "https://storage.googleapis.com/n-large"
+
+_STOP = object()
+
+
+def load_classes(classes_dir):
+    """Class names in training order: the sorted folder names of the training set."""
+    return sorted(name for name in os.listdir(classes_dir) if os.path.isdir(os.path.join(classes_dir, name)))
+
+
+class TileClassifier:
+    def __init__(self, model_path, classes_dir, image_set, database_url, batch_size=BATCH_SIZE,
+                 threads=None, model_version=None, commit_every=COMMIT_EVERY):
+        import torch
+        import psycopg2
+        self.torch = torch
+        if threads:
+            torch.set_num_threads(threads)
+        if is_artifact(model_path):
+            self.model, meta = load_artifact(model_path)
+            self.classes = meta["classes"]
+            self.model_version = model_version or meta["model_version"]
+        else:
+            self.classes = load_classes(classes_dir)
+            self.model = load_weights(model_path, len(self.classes))
+            self.model_version = model_version or model_version_of(model_path)
+        self.image_set = image_set
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        self.conn = psycopg2.connect(database_url)
+
+        self.batch = np.empty((batch_size, INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)
+        self.batch_keys = []
+        self.batches = queue.Queue(maxsize=2)
+        self.labels = []
+        self.error = None
+        self.tiles_classified = 0
+        self.labels_written = 0
+        self.inference_seconds = 0.0
+        self.thread = threading.Thread(target=self._run, name="tile-classifier", daemon=True)
+        self.thread.start()
+        print(f"Classifying tiles with {model_path} (version {self.model_version}, "
+              f"{len(self.classes)} classes, batches of {batch_size})")
+
+    def labeled_tiles(self):
+        """(z, x, y) of the tiles of this image set that already have a label from this model version."""
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT z, x, y FROM tile_labels WHERE image_set = %s AND model_version = %s",
+                           (self.image_set, self.model_version))
+            labeled = set(cursor.fetchall())
+        self.conn.rollback()
+        return labeled
+
+    def submit(self, z, x, y, tile):
+        """Queue one crop (a PIL image). Blocks while two full batches wait for inference."""
+        if self.error is not None:
+            raise self.error
+        small = tile.convert("RGB").resize((INPUT_SIZE, INPUT_SIZE), Image.Resampling.BILINEAR)
+        self.batch[len(self.batch_keys)] = np.asarray(small)
+        self.batch_keys.append((z, x, y))
+        if len(self.batch_keys) == self.batch_size:
+            self._dispatch()
+
+    def _dispatch(self):
+        count = len(self.batch_keys)
+        self.batches.put((self.batch_keys, self.batch[:count].copy()))
+        self.batch_keys = []
+
+    def _run(self):
+        torch = self.torch
+        while True:
+            item = self.batches.get()
+            if item is _STOP:
+                return
+            keys, pixels = item
+            try:
+                if self.error is not None:
+                    continue
+                started = time.perf_counter()
+                inputs = torch.from_numpy(pixels).permute(0, 3, 1, 2).float().div_(255.0)
+                with torch.inference_mode():
+                    predicted = self.model(inputs).argmax(dim=1).tolist()
+                self.inference_seconds += time.perf_counter() - started
+                self.labels.extend((*key, self.classes[i]) for key, i in zip(keys, predicted))
+                self.tiles_classified += len(keys)
+                if len(self.labels) >= self.commit_every:
+                    self._write(self.labels)
+                    self.labels = []
+            except Exception as e:
+                self.error = self.error or e
+
+    def _write(self, labels):
+        from psycopg2.extras import execute_values
+        with self.conn.cursor() as cursor:
+            execute_values(cursor, """
+                INSERT INTO nlarge(file_path, value) VALUES %s
+                ON CONFLICT (file_path) DO UPDATE SET value = EXCLUDED.value
+            """, [(f"{TILE_URL_BASE}/{self.image_set}/{z}/{x}/{y}.png", value) for z, x, y, value in labels],
+                page_size=1000)
+            execute_values(cursor, """
+                INSERT INTO tile_labels(image_set, z, x, y, value, model_version) VALUES %s
+                ON CONFLICT (image_set, z, x, y) DO UPDATE
+                SET value = EXCLUDED.value, model_version = EXCLUDED.model_version, updated_at = now()
+            """, [(self.image_set, z, x, y, value, self.model_version) for z, x, y, value in labels],
+                page_size=1000)
+        self.conn.commit()
+        self.labels_written += len(labels)
+
+    def close(self):
+        """Classify the last partial batch, write the remaining labels and re-raise any error."""
+        try:
+            if self.batch_keys and self.error is None:
+                self._dispatch()
+        finally:
+            self.batches.put(_STOP)
+            self.thread.join()
+        try:
+            if self.error is None and self.labels:
+                self._write(self.labels)
+                self.labels = []
+        finally:
+            self.conn.close()
+        if self.error is not None:
+            raise self.error
+        rate = self.tiles_classified / self.inference_seconds if self.inference_seconds > 0 else 0.0
+        print(f"--- Classified {self.tiles_classified} tiles ({rate:.1f} tiles/s of inference), "
+              f"{self.labels_written} labels written ---")
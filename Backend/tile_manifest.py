@@ -0,0 +1,78 @@
+"""
+Job manifest for resumable tiling runs.
+
+A JSON-lines file: the first line describes the job (source, dimensions, tile
+size, sink), every following line records one tile that the sink has durably
+stored, with the SHA-256 of its PNG and any sink-specific location. A rerun of
+the same job skips every tile already listed.
+"""
+import os
+import json
+import threading
+
+
+class JobManifest:
+    def __init__(self, path, job):
+        self.path = path
+        self.job = job
+        self.done = {}
+        self.lock = threading.Lock()
+
+        torn = False
+        if os.path.exists(path):
+            torn = self._load()
+        mode = "a" if self.done else "w"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, mode)
+        if mode == "a" and torn:
+            # Terminate the torn line so the next record starts on a line of its own
+            self.file.write("\n")
+            self.file.flush()
+        if mode == "w":
+            self.file.write(json.dumps({"job": job}) + "\n")
+            self.file.flush()
+
+    def _load(self):
+        """Read the recorded tiles; returns True if the file ends in a torn (unterminated) line."""
+        with open(self.path) as f:
+            text = f.read()
+        lines = text.splitlines()
+        if not lines:
+            return False
+        previous = json.loads(lines[0]).get("job")
+        if previous != self.job:
+            raise ValueError(
+                f"Manifest {self.path} belongs to a different job ({previous}); "
+                f"delete it to start over"
+            )
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A crash can leave a torn last line; that tile is simply redone
+                continue
+            self.done[(entry["z"], entry["x"], entry["y"])] = entry
+        print(f"Resuming job from {self.path}: {len(self.done)} tiles already done")
+        return not text.endswith("\n")
+
+    def reset(self):
+        """Forget recorded tiles (e.g. when the sink lost its partial output)."""
+        with self.lock:
+            self.done = {}
+            self.file.close()
+            self.file = open(self.path, "w")
+            self.file.write(json.dumps({"job": self.job}) + "\n")
+            self.file.flush()
+
+    def is_done(self, z, x, y):
+        return (z, x, y) in self.done
+
+    def record(self, z, x, y, sha256, location=None):
+        entry = {"z": z, "x": x, "y": y, "sha256": sha256, **(location or {})}
+        with self.lock:
+            self.done[(z, x, y)] = entry
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
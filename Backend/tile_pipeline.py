@@ -0,0 +1,138 @@
+"""
+Encode/upload pipeline for generated tiles.
+
+    producer (pyramid builder, main thread)
+        -> process pool: PNG encode, at most max_pending tiles in flight
+        -> bounded upload queue
+        -> uploader threads: sink.put_tile, then the job manifest
+
+A full upload queue blocks the producer, so a slow sink throttles cropping and
+encoding instead of piling tiles up in memory.
+
+Tiles whose pixels match a recently seen tile (blank sky, padded edges) reuse
+that tile's encoding instead of being encoded again. Every stored tile carries
+the SHA-256 of its PNG so content-addressed sinks can keep one copy.
+"""
+import io
+import time
+import queue
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from PIL import Image
+
+_STOP = object()
+# How many distinct pixel hashes to remember for encode reuse
+RECENT_TILES = 256
+
+
+def encode_png(mode, size, raw):
+    """Runs in a worker process; tiles travel as raw pixel bytes to keep pickling cheap."""
+    tile = Image.frombytes(mode, size, raw)
+    in_mem_file = io.BytesIO()
+    tile.save(in_mem_file, format='PNG')
+    return in_mem_file.getvalue()
+
+
+class TilePipeline:
+    def __init__(self, sink, encode_workers=4, upload_workers=8, queue_size=64, manifest=None):
+        self.sink = sink
+        self.manifest = manifest
+        self.encoders = ProcessPoolExecutor(encode_workers) if encode_workers > 0 else None
+        self.max_pending = max(1, encode_workers) * 4
+        self.pending = deque()
+        self.recent = OrderedDict()
+        self.uploads = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.lock = threading.Lock()
+        self.tiles_done = 0
+        self.bytes_done = 0
+        self.tiles_reused = 0
+        self.tiles_skipped = 0
+        self.started = time.perf_counter()
+        self.uploaders = [
+            threading.Thread(target=self._upload_loop, name=f"tile-upload-{i}", daemon=True)
+            for i in range(max(1, upload_workers))
+        ]
+        for thread in self.uploaders:
+            thread.start()
+
+    def _upload_loop(self):
+        while True:
+            item = self.uploads.get()
+            if item is _STOP:
+                return
+            z, x, y, data = item
+            try:
+                if self.error is None:
+                    digest = hashlib.sha256(data).hexdigest()
+                    location = self.sink.put_tile(z, x, y, data, digest)
+                    if self.manifest is not None:
+                        self.manifest.record(z, x, y, digest, location)
+                    with self.lock:
+                        self.tiles_done += 1
+                        self.bytes_done += len(data)
+            except Exception as e:
+                self.error = self.error or e
+
+    def _enqueue(self, z, x, y, encoded):
+        if self.error is not None:
+            raise self.error
+        self.uploads.put((z, x, y, encoded.result()))
+
+    def _encode(self, tile):
+        """Future for the PNG of this tile, shared with any recent tile with identical pixels."""
+        raw = tile.tobytes()
+        key = (tile.mode, tile.size, hashlib.blake2b(raw, digest_size=16).digest())
+        encoded = self.recent.get(key)
+        if encoded is not None:
+            self.recent.move_to_end(key)
+            self.tiles_reused += 1
+            return encoded
+        if self.encoders is None:
+            encoded = Future()
+            encoded.set_result(encode_png(tile.mode, tile.size, raw))
+        else:
+            encoded = self.encoders.submit(encode_png, tile.mode, tile.size, raw)
+        self.recent[key] = encoded
+        if len(self.recent) > RECENT_TILES:
+            self.recent.popitem(last=False)
+        return encoded
+
+    def is_done(self, z, x, y):
+        """True for tiles a previous run of this job already stored."""
+        if self.manifest is not None and self.manifest.is_done(z, x, y):
+            self.tiles_skipped += 1
+            return True
+        return False
+
+    def submit(self, z, x, y, tile):
+        """Queue one tile (a PIL image) for encoding and upload. Blocks when the pipeline is full."""
+        self.pending.append((z, x, y, self._encode(tile)))
+        while len(self.pending) >= self.max_pending or (self.pending and self.pending[0][3].done()):
+            self._enqueue(*self.pending.popleft())
+
+    def close(self):
+        """Drain every stage, stop the workers and re-raise the first upload error."""
+        try:
+            while self.pending:
+                self._enqueue(*self.pending.popleft())
+        finally:
+            for _ in self.uploaders:
+                self.uploads.put(_STOP)
+            for thread in self.uploaders:
+                thread.join()
+            if self.encoders is not None:
+                self.encoders.shutdown(cancel_futures=True)
+        if self.error is not None:
+            raise self.error
+        self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.tiles_done / elapsed if elapsed > 0 else 0.0
+        print(f"--- Pipeline: {self.tiles_done} tiles, {self.bytes_done / 1e6:.1f} MB in {elapsed:.1f} s "
+              f"({rate:.1f} tiles/s, {self.bytes_done / 1e6 / elapsed if elapsed > 0 else 0:.1f} MB/s) ---")
+        print(f"--- {self.tiles_reused} tiles reused an identical encoding, "
+              f"{self.tiles_skipped} skipped as already done ---")
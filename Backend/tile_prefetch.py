@@ -0,0 +1,167 @@
+"""
+Server-side tile prefetching.
+
+When a viewer requests a tile it will usually want the tiles around it next
+(panning) and the four tiles beneath it at z + 1 (zooming in). The prefetcher
+warms the tile cache for those in the background, so the follow-up requests
+are served from memory instead of paying a round trip to the bucket.
+
+Only requests that move the viewer onto cold ground trigger it: a cache miss,
+or the first request for a tile that was itself prefetched. A hit on a tile
+the viewer already had means its surroundings were handled when it was first
+requested, so re-checking them on every hit would only cost event loop time.
+
+Work is bounded twice: at most `budget` tiles are scheduled per request, and
+at most `concurrency` prefetches run at once; anything beyond that is dropped
+rather than queued. Every prefetched key is remembered (up to `track` keys)
+so that the first real request for it counts as "used"; used / fetched is the
+share of prefetch work that paid off.
+"""
+import asyncio
+import logging
+import contextvars
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def level_grid(config, z):
+    """
+    (cols, rows) of the inclusive x/y range at level z, with the same math as
+    get_tiles_for_image in ai/src/interface.py.
+    """
+    scale = 2**(config["maxLevel"] - z)
+    tile_size = config["tileSize"]
+    scaled_width = config["width"] // scale
+    scaled_height = config["height"] // scale
+    if scaled_width == 0 or scaled_height == 0:
+        return -1, -1
+    return scaled_width // tile_size, scaled_height // tile_size
+
+
+def prefetch_candidates(config, z, x, y):
+    """Neighbours at z (nearest first), then the children at z + 1, clipped to the pyramid."""
+    candidates = []
+    cols, rows = level_grid(config, z)
+    for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, -1), (1, -1), (-1, 1)):
+        nx, ny = x + dx, y + dy
+        if 0 <= nx <= cols and 0 <= ny <= rows:
+            candidates.append((z, nx, ny))
+    if z < config["maxLevel"]:
+        cols, rows = level_grid(config, z + 1)
+        for cx in (2 * x, 2 * x + 1):
+            for cy in (2 * y, 2 * y + 1):
+                if cx <= cols and cy <= rows:
+                    candidates.append((z + 1, cx, cy))
+    return candidates
+
+
+def png_key(image_set, z, x, y, fmt="png"):
+    return f"{image_set}/{z}/{x}/{y}.{fmt}"
+
+
+class TilePrefetcher:
+    def __init__(self, cache, fetch, get_config, cache_key=png_key, budget=12, concurrency=8, track=10_000):
+        """
+        cache: the TieredTileCache being warmed; fetch(image_set, z, x, y, fmt) reads a
+        tile in format fmt through it, and cache_key(image_set, z, x, y, fmt) is the
+        key it is cached under; get_config(image_set) returns the pyramid config.
+        """
+        self.cache = cache
+        self.fetch = fetch
+        self.get_config = get_config
+        self.cache_key = cache_key
+        self.budget = budget
+        self.concurrency = concurrency
+        self.running = 0
+        self.configs = {}
+        self.prefetched = OrderedDict()
+        self.track = track
+        self.tasks = set()
+        self.scheduled = 0
+        self.fetched = 0
+        self.already_cached = 0
+        self.dropped = 0
+        self.failed = 0
+        self.used = 0
+        self.warm_hits = 0
+
+    def record_request(self, cache_key):
+        """Count a real request for a tile the prefetcher brought in; returns whether it was one."""
+        if self.prefetched.pop(cache_key, None) is not None:
+            self.used += 1
+            return True
+        return False
+
+    def on_request(self, image_set, z, x, y, fmt="png"):
+        """Record a real request for a tile and prefetch around it unless it was a plain cache hit."""
+        key = self.cache_key(image_set, z, x, y, fmt)
+        if self.record_request(key) or not self.cache.contains(key):
+            self.schedule(image_set, z, x, y, fmt)
+        else:
+            self.warm_hits += 1
+
+    def schedule(self, image_set, z, x, y, fmt="png"):
+        """Start warming the tiles around (z, x, y) in format fmt; returns immediately."""
+        # A fresh context keeps the background fetches out of the request's Server-Timing
+        task = asyncio.create_task(self._schedule(image_set, z, x, y, fmt), context=contextvars.Context())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _schedule(self, image_set, z, x, y, fmt):
+        config = self.configs.get(image_set)
+        if config is None:
+            try:
+                config = self.configs[image_set] = await self.get_config(image_set)
+            except Exception as e:
+                logger.debug(f"Prefetch skipped, no config for {image_set}: {e}")
+                return
+        budget = self.budget
+        for tz, tx, ty in prefetch_candidates(config, z, x, y):
+            if budget == 0:
+                break
+            key = self.cache_key(image_set, tz, tx, ty, fmt)
+            if key in self.prefetched or self.cache.contains(key):
+                self.already_cached += 1
+                continue
+            if self.running >= self.concurrency:
+                self.dropped += 1
+                continue
+            budget -= 1
+            self.scheduled += 1
+            self.running += 1
+            task = asyncio.create_task(self._warm(image_set, tz, tx, ty, fmt, key))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _warm(self, image_set, z, x, y, fmt, key):
+        try:
+            await self.fetch(image_set, z, x, y, fmt)
+            self.fetched += 1
+            self.prefetched[key] = True
+            while len(self.prefetched) > self.track:
+                self.prefetched.popitem(last=False)
+        except Exception:
+            # Mostly edge tiles the grid math allows but the pyramid doesn't have
+            self.failed += 1
+        finally:
+            self.running -= 1
+
+    async def close(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+    def stats(self):
+        return {
+            "budget": self.budget,
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "scheduled": self.scheduled,
+            "fetched": self.fetched,
+            "already_cached": self.already_cached,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "used": self.used,
+            "warm_hits": self.warm_hits,
+            "use_ratio": round(self.used / self.fetched, 4) if self.fetched else 0.0,
+        }
@@ -0,0 +1,304 @@
+import os
+import json
+import asyncio
+import hashlib
+from typing import AsyncIterator, Awaitable, Callable, List, NamedTuple, Optional
+
+import httpx
+
+import metrics
+from tile_archive import TileArchive
+from tile_cache import CachedTile, make_etag
+
+
+class TileNotFound(Exception):
+    pass
+
+
+class StorageError(Exception):
+    pass
+
+
+class TileFile(NamedTuple):
+    """A tile that already sits on local disk and can be sent with sendfile."""
+    path: str
+    etag: str
+    size: int
+
+
+class TileStream(NamedTuple):
+    """A tile body that is still arriving from a remote store."""
+    chunks: AsyncIterator[bytes]
+    aclose: Callable[[], Awaitable[None]]
+    etag: Optional[str]
+    content_length: Optional[str]
+
+
+def check_segment(value: str) -> str:
+    """Reject path segments that could escape the tileset directory."""
+    if not value or value.startswith(".") or "/" in value or "\\" in value:
+        raise TileNotFound(value)
+    return value
+
+
+class TileStorage:
+    """
+    Where pyramids live. /info, /tiles and /tiles-debug only talk to this interface.
+
+    open_tile returns a CachedTile (bytes in memory), a TileFile or a TileStream;
+    read_tile always returns the whole tile as a CachedTile.
+    """
+
+    # Remote backends benefit from the tiered tile cache, local ones do not
+    cacheable = False
+
+    async def get_config(self, image_set: str) -> dict:
+        raise NotImplementedError
+
+    async def list_image_sets(self) -> List[str]:
+        """Names of the image sets this backend holds."""
+        raise NotImplementedError
+
+    async def open_tile(self, image_set: str, z: int, x: int, y: int):
+        raise NotImplementedError
+
+    async def read_tile(self, image_set: str, z: int, x: int, y: int) -> CachedTile:
+        raise NotImplementedError
+
+    def tile_source_url(self, image_set: str) -> Optional[str]:
+        """Direct URL clients may load tiles from, or None to go through /tiles."""
+        return None
+
+    async def close(self):
+        pass
+
+
+# --- Public GCS bucket over HTTP ---
+class GCSHTTPStorage(TileStorage):
+    cacheable = True
+
+    def __init__(self, base_url: str, bucket_name: str, limits: httpx.Limits, timeout: httpx.Timeout,
+                 chunk_size: int = 64 * 1024):
+        self.base_url = base_url.rstrip("/")
+        self.bucket_name = bucket_name
+        self.limits = limits
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.client = None
+
+    def get_client(self) -> httpx.AsyncClient:
+        """
+        Process-wide pooled client used for all bucket fetches. Connections are kept
+        alive between requests instead of being reopened per tile.
+        """
+        if self.client is None:
+            self.client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        return self.client
+
+    def url(self, *parts) -> str:
+        return "/".join([self.base_url, self.bucket_name, *[str(p) for p in parts]])
+
+    def tile_source_url(self, image_set: str) -> Optional[str]:
+        return self.url(image_set)
+
+    async def get_config(self, image_set: str) -> dict:
+        try:
+            with metrics.timed("upstream", metrics.UPSTREAM_SECONDS, "config"):
+                response = await self.get_client().get(self.url(image_set, "config.json"))
+            metrics.UPSTREAM_BYTES.inc("config", amount=len(response.content))
+            if response.status_code == 404:
+                raise TileNotFound(image_set)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            metrics.UPSTREAM_FAILURES.inc("config")
+            raise StorageError(str(e))
+
+    async def list_image_sets(self) -> List[str]:
+        """
+        Top-level "directories" of the bucket, through the JSON API's object listing
+        (works for public buckets without credentials).
+        """
+        names, page_token = [], None
+        try:
+            while True:
+                params = {"delimiter": "/", "fields": "prefixes,nextPageToken"}
+                if page_token:
+                    params["pageToken"] = page_token
+                response = await self.get_client().get(
+                    f"{self.base_url}/storage/v1/b/{self.bucket_name}/o", params=params,
+                )
+                response.raise_for_status()
+                listing = response.json()
+                names.extend(prefix.rstrip("/") for prefix in listing.get("prefixes", []))
+                page_token = listing.get("nextPageToken")
+                if not page_token:
+                    return names
+        except (httpx.HTTPError, ValueError) as e:
+            raise StorageError(f"Listing gs://{self.bucket_name} failed: {e}")
+
+    async def _counted(self, chunks):
+        async for chunk in chunks:
+            metrics.UPSTREAM_BYTES.inc("tile", amount=len(chunk))
+            yield chunk
+
+    async def open_tile(self, image_set: str, z: int, x: int, y: int) -> TileStream:
+        client = self.get_client()
+        try:
+            with metrics.timed("upstream", metrics.UPSTREAM_SECONDS, "tile"):
+                upstream = await client.send(client.build_request("GET", self.url(image_set, z, x, f"{y}.png")), stream=True)
+        except httpx.HTTPError:
+            metrics.UPSTREAM_FAILURES.inc("tile")
+            raise TileNotFound(f"{image_set}/{z}/{x}/{y}")
+        if upstream.status_code != 200:
+            await upstream.aclose()
+            metrics.UPSTREAM_FAILURES.inc("tile")
+            raise TileNotFound(f"{image_set}/{z}/{x}/{y}")
+
+        etag = upstream.headers.get("etag")
+        content_length = None
+        if "content-encoding" not in upstream.headers:
+            content_length = upstream.headers.get("content-length")
+        return TileStream(
+            self._counted(upstream.aiter_bytes(self.chunk_size)),
+            upstream.aclose,
+            etag if etag and not etag.startswith("W/") else None,
+            content_length,
+        )
+
+    async def read_tile(self, image_set: str, z: int, x: int, y: int) -> CachedTile:
+        try:
+            with metrics.timed("upstream", metrics.UPSTREAM_SECONDS, "tile"):
+                response = await self.get_client().get(self.url(image_set, z, x, f"{y}.png"))
+        except httpx.HTTPError:
+            metrics.UPSTREAM_FAILURES.inc("tile")
+            raise TileNotFound(f"{image_set}/{z}/{x}/{y}")
+        if response.status_code != 200:
+            metrics.UPSTREAM_FAILURES.inc("tile")
+            raise TileNotFound(f"{image_set}/{z}/{x}/{y}")
+        metrics.UPSTREAM_BYTES.inc("tile", amount=len(response.content))
+        etag = response.headers.get("etag")
+        if not etag or etag.startswith("W/"):
+            etag = make_etag(response.content)
+        return CachedTile(response.content, etag)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+# --- Pyramids in a local directory (e.g. on NVMe) ---
+class LocalDirectoryStorage(TileStorage):
+    """
+    Expects the same layout the generator writes to the bucket:
+    {root}/{image_set}/config.json and {root}/{image_set}/{z}/{x}/{y}.png
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, image_set: str, *parts) -> str:
+        return os.path.join(self.root, check_segment(image_set), *[str(p) for p in parts])
+
+    async def get_config(self, image_set: str) -> dict:
+        path = self.path(image_set, "config.json")
+
+        def load():
+            with open(path) as f:
+                return json.load(f)
+
+        try:
+            return await asyncio.to_thread(load)
+        except FileNotFoundError:
+            raise TileNotFound(image_set)
+        except (OSError, ValueError) as e:
+            raise StorageError(str(e))
+
+    async def list_image_sets(self) -> List[str]:
+        def scan():
+            entries = os.listdir(self.root)
+            return sorted(name for name in entries if os.path.isfile(os.path.join(self.root, name, "config.json")))
+
+        try:
+            return await asyncio.to_thread(scan)
+        except OSError as e:
+            raise StorageError(str(e))
+
+    async def open_tile(self, image_set: str, z: int, x: int, y: int) -> TileFile:
+        path = self.path(image_set, z, x, f"{y}.png")
+        try:
+            st = await asyncio.to_thread(os.stat, path)
+        except (FileNotFoundError, NotADirectoryError):
+            raise TileNotFound(f"{image_set}/{z}/{x}/{y}")
+        # Tiles are immutable once written, so size + mtime identify the content
+        etag_base = f"{st.st_size}-{st.st_mtime_ns}".encode()
+        return TileFile(path, '"' + hashlib.md5(etag_base).hexdigest() + '"', st.st_size)
+
+    async def read_tile(self, image_set: str, z: int, x: int, y: int) -> CachedTile:
+        tile = await self.open_tile(image_set, z, x, y)
+
+        def read():
+            with open(tile.path, "rb") as f:
+                return f.read()
+
+        return CachedTile(await asyncio.to_thread(read), tile.etag)
+
+
+# --- Pyramids packed into single-file archives ---
+class ArchiveStorage(TileStorage):
+    """
+    Serves {root}/{image_set}.tiles archives written by generate_fits_tiles.py --archive.
+    Each archive is memory-mapped on first use and kept open; only its index is read up front,
+    in a worker thread. Tile bodies are handed out as slices of the mapping without copying.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.archives = {}
+        self.open_lock = asyncio.Lock()
+
+    async def archive(self, image_set: str) -> TileArchive:
+        archive = self.archives.get(image_set)
+        if archive is not None:
+            return archive
+        path = os.path.join(self.root, f"{check_segment(image_set)}.tiles")
+        # Opens are rare; one lock keeps concurrent first requests from mapping an archive twice
+        async with self.open_lock:
+            archive = self.archives.get(image_set)
+            if archive is None:
+                try:
+                    archive = await asyncio.to_thread(TileArchive, path)
+                except FileNotFoundError:
+                    raise TileNotFound(image_set)
+                except (OSError, ValueError) as e:
+                    raise StorageError(str(e))
+                self.archives[image_set] = archive
+        return archive
+
+    async def get_config(self, image_set: str) -> dict:
+        return dict((await self.archive(image_set)).config)
+
+    async def list_image_sets(self) -> List[str]:
+        try:
+            entries = await asyncio.to_thread(os.listdir, self.root)
+        except OSError as e:
+            raise StorageError(str(e))
+        return sorted(name[:-len(".tiles")] for name in entries if name.endswith(".tiles"))
+
+    async def open_tile(self, image_set: str, z: int, x: int, y: int) -> CachedTile:
+        archive = await self.archive(image_set)
+        location = archive.location(z, x, y)
+        if location is None:
+            raise TileNotFound(f"{image_set}/{z}/{x}/{y}")
+        # Archives are immutable and blobs are addressed by offset, so that identifies the content
+        offset, length = location
+        return CachedTile(archive.get(z, x, y), f'"{archive.archive_id}-{offset:x}-{length:x}"')
+
+    async def read_tile(self, image_set: str, z: int, x: int, y: int) -> CachedTile:
+        return await self.open_tile(image_set, z, x, y)
+
+    async def close(self):
+        for archive in self.archives.values():
+            archive.close()
+        self.archives = {}
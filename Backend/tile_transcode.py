@@ -0,0 +1,100 @@
+"""
+Tile format negotiation and transcoding.
+
+Pyramids are stored as PNG. When the client's Accept header allows it, /tiles
+and /tiles-debug answer with a smaller format instead (WebP is usually a
+fraction of the size for this imagery). The server's preference order decides
+among the formats a client accepts; wildcards alone (*/*, image/*) only ever
+get the stored PNG, so clients that didn't ask for a format never receive it.
+
+transcode and render_debug_tile run in worker processes. Fonts are loaded once
+per worker and reused.
+"""
+import io
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+
+# name -> (media type, Pillow format)
+FORMATS = {
+    "png": ("image/png", "PNG"),
+    "webp": ("image/webp", "WEBP"),
+    "avif": ("image/avif", "AVIF"),
+    "jpeg": ("image/jpeg", "JPEG"),
+}
+# zlib level for re-encoded PNGs (debug overlays): much faster than the default
+PNG_COMPRESS_LEVEL = 1
+DEBUG_FONT_SIZE = 20
+
+
+def parse_accept(header):
+    """media type -> q for the explicitly listed types of an Accept header."""
+    accepted = {}
+    for part in (header or "").split(","):
+        fields = part.strip().split(";")
+        media_type = fields[0].strip().lower()
+        if not media_type or "*" in media_type:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[media_type] = q
+    return accepted
+
+
+def negotiate(accept_header, preferred):
+    """The first of the preferred format names the client explicitly accepts, else "png"."""
+    accepted = parse_accept(accept_header)
+    for name in preferred:
+        if accepted.get(FORMATS[name][0], 0.0) > 0:
+            return name
+    return "png"
+
+
+def save_image(img, fmt, quality):
+    buffer = io.BytesIO()
+    if fmt == "png":
+        img.save(buffer, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    elif fmt == "jpeg":
+        if img.mode not in ("L", "RGB"):
+            img = img.convert("RGB")
+        img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    elif fmt == "webp":
+        img.save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(buffer, format=FORMATS[fmt][1], quality=quality)
+    return buffer.getvalue()
+
+
+def transcode(content, fmt, quality):
+    """Re-encode a PNG tile. Runs in a worker process."""
+    with Image.open(io.BytesIO(content)) as img:
+        img.load()
+        return save_image(img, fmt, quality)
+
+
+@lru_cache(maxsize=None)
+def get_debug_font():
+    try:
+        return ImageFont.truetype("arial.ttf", DEBUG_FONT_SIZE)
+    except IOError:
+        return ImageFont.load_default()
+
+
+def render_debug_tile(content, z, x, y, fmt="png", quality=None):
+    """Tile with a border and its coordinates drawn on it. Runs in a worker process."""
+    with Image.open(io.BytesIO(content)) as img:
+        img.load()
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
+
+    # Add debug overlay
+    draw = ImageDraw.Draw(img)
+    debug_text = f"Level: {z}\nCol (x): {x}\nRow (y): {y}"
+    draw.rectangle([0, 0, img.width - 1, img.height - 1], outline="lime", width=2)
+    draw.text((10, 10), debug_text, fill="white", font=get_debug_font())
+    return save_image(img, fmt, quality)
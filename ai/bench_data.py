@@ -0,0 +1,48 @@
+import sys
+import os
+import time
+import argparse
+sys.path.append(os.path.join(os.path.dirname(__file__), "src"))
+from torch.utils.data import DataLoader
+from torchvision import transforms
+from data import get_image_paths
+from train import SpaceDataset, MemmapDataset
+import torch
+
+# Compare loader throughput: decoding image files every epoch vs the uint8 memmap from `python src/data.py`
+parser = argparse.ArgumentParser(description="Benchmark training data loading (samples/s).")
+parser.add_argument("--root", default="dataset/train")
+parser.add_argument("--cache", default="dataset/train_cache")
+parser.add_argument("--num-workers", type=int, default=4)
+parser.add_argument("--batch-size", type=int, default=64)
+parser.add_argument("--batches", type=int, default=50, help="Batches timed per loader")
+args = parser.parse_args()
+
+augment = [
+    transforms.RandomHorizontalFlip(),
+    transforms.RandomRotation(20),
+    transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.1),
+]
+file_ds = SpaceDataset(get_image_paths(args.root),
+                       transform=transforms.Compose([transforms.Resize((224, 224)), transforms.ToTensor()] + augment))
+memmap_ds = MemmapDataset(args.cache, transform=transforms.Compose(augment + [transforms.ConvertImageDtype(torch.float)]))
+
+
+def samples_per_second(dataset, num_workers):
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=True, num_workers=num_workers)
+    samples = 0
+    start = None
+    for i, (imgs, _) in enumerate(loader):
+        if i == 1:
+            # Skip the first batch: worker start-up and cold page cache
+            start = time.perf_counter()
+        elif i > 1:
+            samples += len(imgs)
+        if i == args.batches:
+            break
+    return samples / (time.perf_counter() - start) if start and samples else 0.0
+
+
+for workers in sorted({0, args.num_workers}):
+    print(f"workers={workers}: files {samples_per_second(file_ds, workers):.1f} samples/s, "
+          f"memmap {samples_per_second(memmap_ds, workers):.1f} samples/s")
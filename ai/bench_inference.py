@@ -0,0 +1,67 @@
+import sys
+import os
+import time
+import argparse
+sys.path.append(os.path.join(os.path.dirname(__file__), "src"))
+# model_artifact ships with the tiler and the API
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Backend"))
+import numpy as np
+import torch
+from export import VARIANTS, artifact_path
+from model_artifact import load_artifact, load_weights
+from data import load_dataset_cache
+
+# CPU latency, throughput and accuracy of the eager model and each exported artifact,
+# on the uint8 dataset cache from `python src/data.py`
+parser = argparse.ArgumentParser(description="Benchmark exported inference artifacts on CPU.")
+parser.add_argument("--model", default="ai/models/space_model.pt")
+parser.add_argument("--cache", default="dataset/train_cache")
+parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+parser.add_argument("--batch-size", type=int, default=64)
+parser.add_argument("--latency-runs", type=int, default=100)
+parser.add_argument("--images", type=int, default=2000, help="Images used for throughput and accuracy")
+args = parser.parse_args()
+
+torch.set_num_threads(args.threads)
+images, labels, classes, _ = load_dataset_cache(args.cache)
+images, labels = images[:args.images], labels[:args.images]
+
+
+def batches():
+    for i in range(0, len(images), args.batch_size):
+        yield torch.from_numpy(images[i:i + args.batch_size]).permute(0, 3, 1, 2).float().div_(255.0)
+
+
+def benchmark(name, model):
+    single = torch.zeros(1, 3, 224, 224)
+    with torch.inference_mode():
+        for _ in range(10):
+            model(single)
+        latencies = []
+        for _ in range(args.latency_runs):
+            start = time.perf_counter()
+            model(single)
+            latencies.append(time.perf_counter() - start)
+
+        predicted = []
+        start = time.perf_counter()
+        for batch in batches():
+            predicted.append(model(batch).argmax(dim=1).numpy())
+        elapsed = time.perf_counter() - start
+    accuracy = (np.concatenate(predicted) == labels).mean() * 100
+    print(f"{name:<14}{np.percentile(latencies, 50) * 1000:>9.2f}{np.percentile(latencies, 95) * 1000:>9.2f}"
+          f"{len(images) / elapsed:>12.1f}{accuracy:>10.2f}")
+
+
+print(f"{'variant':<14}{'p50 ms':>9}{'p95 ms':>9}{'images/s':>12}{'acc %':>10}")
+benchmark("eager fp32", load_weights(args.model, len(classes)))
+for variant in VARIANTS:
+    path = artifact_path(args.model, variant)
+    if not os.path.exists(path):
+        print(f"{variant:<14}not exported ({path})")
+        continue
+    module, meta = load_artifact(path)
+    if meta["classes"] != classes:
+        print(f"{variant:<14}class table differs from the dataset cache; skipped")
+        continue
+    benchmark(variant, module)
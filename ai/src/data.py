@@ -1,8 +1,13 @@
 import os
+import json
 import random
+import argparse
+from multiprocessing import Pool
 from PIL import Image
 import numpy as np
 
+IMAGE_EXTENSIONS = (".jpg", ".png", ".bmp", ".tiff", ".jpeg")
+
 # 1. Load and preprocess a single image
 def load_image(path, size=(224,224)):
     img = Image.open(path).convert("RGB")      # ensure 3 channels
@@ -12,13 +17,13 @@ def load_image(path, size=(224,224)):
 
 # 2. Get all image paths and labels
 def get_image_paths(root_dir):
-    classes = os.listdir(root_dir)
     image_paths = []
-    for cls in classes:
+    for cls in sorted(os.listdir(root_dir)):
         cls_path = os.path.join(root_dir, cls)
-        for file in os.listdir(cls_path):
-            if file.lower().endswith((".jpg",".png", ".bmp", ".tiff", ".jpeg")):
-                image_paths.append((os.path.join(cls_path, file), cls))
+        with os.scandir(cls_path) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                if entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    image_paths.append((entry.path, cls))
     return image_paths
 
 # 3. Split into train/val
@@ -38,3 +43,55 @@ def visualize_sample(image_paths, n=5):
         plt.imshow(img)
         plt.title(label)
         plt.show()
+
+
+# 5. One-time preprocessing into a uint8 memmap
+# images.npy: N x H x W x 3 uint8, labels.npy: N int64 class ids, meta.json: classes and source paths
+def _decode_resized(args):
+    path, size = args
+    # Bilinear, like transforms.Resize in training and the resize at inference
+    with Image.open(path) as img:
+        return np.asarray(img.convert("RGB").resize(size, Image.BILINEAR), dtype=np.uint8)
+
+
+def preprocess_dataset(root_dir, out_dir, size=(224,224), workers=None):
+    paths = get_image_paths(root_dir)
+    classes = sorted(set(label for _, label in paths))
+    class_to_idx = {cls: i for i, cls in enumerate(classes)}
+    os.makedirs(out_dir, exist_ok=True)
+
+    images = np.lib.format.open_memmap(os.path.join(out_dir, "images.npy.tmp"), mode="w+", dtype=np.uint8,
+                                       shape=(len(paths), size[1], size[0], 3))
+    with Pool(workers) as pool:
+        for i, pixels in enumerate(pool.imap(_decode_resized, [(path, size) for path, _ in paths], chunksize=16)):
+            images[i] = pixels
+    images.flush()
+    del images
+    os.replace(os.path.join(out_dir, "images.npy.tmp"), os.path.join(out_dir, "images.npy"))
+
+    np.save(os.path.join(out_dir, "labels.npy"), np.array([class_to_idx[label] for _, label in paths], dtype=np.int64))
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump({"classes": classes, "size": list(size), "resample": "bilinear", "paths": paths}, f)
+    print(f"Wrote {len(paths)} images ({len(classes)} classes) to {out_dir}")
+
+
+def load_dataset_cache(cache_dir):
+    """(images memmap, labels, classes, [(path, label)]) written by preprocess_dataset."""
+    with open(os.path.join(cache_dir, "meta.json")) as f:
+        meta = json.load(f)
+    if meta.get("resample") != "bilinear":
+        print(f"Warning: {cache_dir} was resized bicubic, unlike training and inference; rerun data.py to rebuild it")
+    # Copy-on-write: pages are shared with the file until something writes to them
+    images = np.load(os.path.join(cache_dir, "images.npy"), mmap_mode="c")
+    labels = np.load(os.path.join(cache_dir, "labels.npy"))
+    return images, labels, meta["classes"], [tuple(p) for p in meta["paths"]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preprocess a training set into a uint8 memmap.")
+    parser.add_argument("--root", default="dataset/train")
+    parser.add_argument("--out", default="dataset/train_cache")
+    parser.add_argument("--size", type=int, default=224)
+    parser.add_argument("--workers", type=int, help="Decode processes (default: one per CPU)")
+    args = parser.parse_args()
+    preprocess_dataset(args.root, args.out, (args.size, args.size), args.workers)
@@ -0,0 +1,100 @@
+import os
+import sys
+import json
+import argparse
+import torch
+
+from data import get_image_paths, load_dataset_cache
+
+# Artifact loading is shared with the tiler and the API, which ship from Backend/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Backend"))
+from model_artifact import META_FILE, load_weights, model_version_of
+
+# Self-contained inference artifacts: a TorchScript module with the class names,
+# model version and expected input stored alongside it as extra files, so
+# inference needs neither torchvision weights nor the training set on disk.
+#
+# Variants:
+#   fp32          traced and frozen; optimized for inference when loaded
+#   int8-dynamic  Linear layers quantized on the fly (only the fc head in ResNet18)
+#   int8-static   convolutions too: post-training static quantization calibrated on training images
+VARIANTS = ("fp32", "int8-dynamic", "int8-static")
+INPUT_SIZE = 224
+
+
+def artifact_path(model_path, variant):
+    base = os.path.splitext(model_path)[0]
+    return f"{base}.ts" if variant == "fp32" else f"{base}.{variant}.ts"
+
+
+def calibration_batches(dataset_cache, root, count, batch_size=32):
+    """Up to `count` training images as float batches in the model's 0..1 input range."""
+    if dataset_cache:
+        images = load_dataset_cache(dataset_cache)[0][:count]
+        for i in range(0, len(images), batch_size):
+            yield torch.from_numpy(images[i:i + batch_size]).permute(0, 3, 1, 2).float().div_(255.0)
+        return
+    from PIL import Image
+    from torchvision import transforms
+    transform = transforms.Compose([transforms.Resize((INPUT_SIZE, INPUT_SIZE)), transforms.ToTensor()])
+    paths = get_image_paths(root)[:count]
+    for i in range(0, len(paths), batch_size):
+        yield torch.stack([transform(Image.open(path).convert("RGB")) for path, _ in paths[i:i + batch_size]])
+
+
+def quantize_static(model, batches):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+    torch.backends.quantized.engine = "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
+    example = torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE)
+    prepared = prepare_fx(model, get_default_qconfig_mapping(torch.backends.quantized.engine), (example,))
+    with torch.inference_mode():
+        for batch in batches:
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def export_variant(model, variant, classes, version, out_path, calibration=None):
+    if variant == "int8-dynamic":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif variant == "int8-static":
+        model = quantize_static(model, calibration)
+    example = torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE)
+    # optimize_for_inference is left to load_artifact: the MKLDNN weights it bakes in
+    # are saved without their values, and such a file fails to load
+    with torch.inference_mode():
+        scripted = torch.jit.freeze(torch.jit.trace(model, example))
+    meta = {
+        "classes": classes,
+        "model_version": f"{version}-{variant}",
+        "variant": variant,
+        "input_size": INPUT_SIZE,
+        # Same preprocessing as training: RGB, resized, scaled to 0..1, no normalisation
+        "input": "float32 NCHW RGB in [0, 1]",
+    }
+    torch.jit.save(scripted, out_path, _extra_files={META_FILE: json.dumps(meta)})
+    print(f"Exported {variant} to {out_path} ({os.path.getsize(out_path) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the trained classifier as self-contained TorchScript artifacts.")
+    parser.add_argument("--model", default="ai/models/space_model.pt", help="Trained state dict from train.py")
+    parser.add_argument("--classes-dir", default="dataset/train",
+                        help="Training set whose sorted folder names are the classes")
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument("--dataset-cache", metavar="DIR", help="uint8 memmap from data.py, used for calibration")
+    parser.add_argument("--calibration-images", type=int, default=256)
+    args = parser.parse_args()
+
+    if args.dataset_cache:
+        classes = load_dataset_cache(args.dataset_cache)[2]
+    else:
+        classes = sorted(name for name in os.listdir(args.classes_dir)
+                         if os.path.isdir(os.path.join(args.classes_dir, name)))
+    version = model_version_of(args.model)
+    for variant in args.variants:
+        model = load_weights(args.model, len(classes))
+        calibration = None
+        if variant == "int8-static":
+            calibration = calibration_batches(args.dataset_cache, args.classes_dir, args.calibration_images)
+        export_variant(model, variant, classes, version, artifact_path(args.model, variant), calibration)
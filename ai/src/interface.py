@@ -1,43 +1,38 @@
 import torch
 from torchvision import transforms, models
-from torchvision.models import resnet18, ResNet18_Weights
 from PIL import Image
 import os
-from data import get_image_paths, split_dataset
+import sys
+import time
+import queue
+import argparse
+import threading
 import psycopg2
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
 from io import BytesIO
-from data import get_image_paths, split_dataset
+from data import get_image_paths
+# Model loading is shared with the tiler and the API, which ship from Backend/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Backend"))
+from model_artifact import is_artifact, load_artifact, load_weights, model_version_of
 import math
 
 load_dotenv()
 db_url = os.getenv("DATABASE_URL")
 gcs_base_url = "https://storage.googleapis.com/"
 bucket_name = "n-large"
+# Backend that serves the label bundles; asked to rebuild one after an image is labelled
+backend_url = os.getenv("BACKEND_URL", "http://127.0.0.1:8000")
 
-conn = psycopg2.connect(db_url)
-cursor = conn.cursor()
-
-# Device
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-# Load model structure
-model = resnet18(weights=ResNet18_Weights.DEFAULT)
-num_features = model.fc.in_features
-
-# Get classes automatically from training dataset
-train_root = "dataset/train"
-paths = get_image_paths(train_root)
-_, _ = split_dataset(paths, val_ratio=0.2)
-classes = sorted(list(set([label for _, label in paths])))
-num_classes = len(classes)
-
-# Replace fc layer to match number of classes
-model.fc = torch.nn.Linear(num_features, num_classes)
-model.load_state_dict(torch.load("ai/models/space_model.pt", map_location=device))
-model = model.to(device)
-model.eval()
+# Pipeline defaults: tile download threads, decoded tiles waiting for the model,
+# tiles per forward pass, CPU threads for torch and label rows per DB transaction
+FETCH_WORKERS = 16
+PREFETCH = 256
+BATCH_SIZE = 64
+TORCH_THREADS = os.cpu_count() or 1
+COMMIT_EVERY = 2000
 
 # Define transforms
 transform = transforms.Compose([
@@ -45,35 +40,56 @@ transform = transforms.Compose([
     transforms.ToTensor(),
 ])
 
-def load_image_from_url(url):
-    response = requests.get(url)
-    response.raise_for_status()
-    img = Image.open(BytesIO(response.content)).convert("RGB")
-    return img
-
-# Predict from PIL image and store in DB
-def predict_image_from_url(url, model, transform, classes):
-    img = load_image_from_url(url)
-    img = transform(img).unsqueeze(0)  # add batch dimension
-    img = img.to(device)
-    
-    with torch.no_grad():
-        outputs = model(img)
-        _, predicted = torch.max(outputs, 1)
-    prediction = classes[predicted.item()]
-
-    # Insert prediction into existing DB table
+_DONE = object()
+
+
+def load_model(model_path="ai/models/space_model.ts", device="cpu"):
+    """
+    (model, class names, model version). An exported .ts artifact (see export.py)
+    carries its classes and version and runs on the CPU only; a raw state dict
+    from train.py needs the training dataset folders for the class list and can
+    run on any device.
+    """
+    if is_artifact(model_path):
+        if torch.device(device).type != "cpu":
+            raise ValueError(f"Exported artifacts run on the CPU only; use a .pt state dict for {device}")
+        model, meta = load_artifact(model_path)
+        return model, meta["classes"], meta["model_version"]
+
+    # Get classes automatically from training dataset
+    train_root = "dataset/train"
+    paths = get_image_paths(train_root)
+    classes = sorted(list(set([label for _, label in paths])))
+    return load_weights(model_path, len(classes), device), classes, model_version_of(model_path)
+
+
+def load_labeled_tiles(image_name):
+    """(z, x, y) -> model_version of every tile of the image already in tile_labels, in one query."""
+    conn = psycopg2.connect(db_url)
     try:
-        cursor.execute("""
-            INSERT INTO nlarge(file_path, value)
-            VALUES (%s, %s)
-        """, (url, prediction))
-        conn.commit()
-        print(f"Stored in DB: {url} -> {prediction}")
-    except Exception as e:
-        print("DB Error:", e)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT z, x, y, model_version FROM tile_labels WHERE image_set = %s", (image_name,))
+            return {(z, x, y): version for z, x, y, version in cursor}
+    finally:
+        conn.close()
+
+
+def tiles_to_label(tiles, labeled, model_version, skip="any"):
+    """
+    The tiles a run still has to classify. skip="any" leaves every labeled tile
+    alone (resuming an interrupted run); skip="current" only leaves tiles labeled
+    by this model version, so a new model relabels the rest.
+    """
+    if skip == "any":
+        return [tile for tile in tiles if tile not in labeled]
+    if skip == "current":
+        return [tile for tile in tiles if labeled.get(tile) != model_version]
+    raise ValueError(f"Unknown skip mode: {skip}")
+
+
+def tile_url(image_name, z, x, y):
+    return f"{gcs_base_url}{bucket_name}/{image_name}/{z}/{x}/{y}.png"
 
-    return prediction
 
 # Calculate MAX_ZOOM automatically from image dimensions
 def calculate_max_zoom(original_width, original_height, TILE_SIZE=512):
@@ -101,15 +117,207 @@ def get_tiles_for_image(original_width, original_height, TILE_SIZE=512):
                 tiles_info.append((z, x, y))
     return tiles_info
 
+
+class TileFetcher:
+    """
+    Download and preprocess tiles on a pool of threads sharing one keep-alive
+    session. Results wait in a bounded queue, so fetching runs at most
+    `prefetch` tiles ahead of the model.
+    """
+
+    def __init__(self, image_name, tiles, workers=FETCH_WORKERS, prefetch=PREFETCH):
+        self.image_name = image_name
+        self.tiles = iter(tiles)
+        self.lock = threading.Lock()
+        self.results = queue.Queue(maxsize=prefetch)
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+        self.failed = 0
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def _next_tile(self):
+        with self.lock:
+            return next(self.tiles, None)
+
+    def _run(self):
+        while True:
+            tile = self._next_tile()
+            if tile is None:
+                self.results.put(_DONE)
+                return
+            url = tile_url(self.image_name, *tile)
+            try:
+                response = self.session.get(url, timeout=30)
+                response.raise_for_status()
+                img = Image.open(BytesIO(response.content)).convert("RGB")
+                self.results.put((tile, url, transform(img)))
+            except Exception as e:
+                # Edge tiles past the image bounds simply don't exist
+                with self.lock:
+                    self.failed += 1
+                print(f"Skipping {url}: {e}")
+
+    def __iter__(self):
+        running = len(self.threads)
+        while running:
+            item = self.results.get()
+            if item is _DONE:
+                running -= 1
+                continue
+            yield item
+
+
+class LabelWriter:
+    """
+    Write predictions from a background thread in bulk: one execute_values per
+    table for every `commit_every` rows, each batch in a single transaction.
+    Rows are upserted, so rerunning a job never duplicates labels, and every
+    committed batch is a checkpoint: an interrupted run loses at most one batch.
+    """
+
+    def __init__(self, image_name, model_version, commit_every=COMMIT_EVERY):
+        self.image_name = image_name
+        self.model_version = model_version
+        self.commit_every = commit_every
+        self.conn = psycopg2.connect(db_url)
+        self.rows = queue.Queue(maxsize=commit_every * 2)
+        self.error = None
+        self.written = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, tile, url, prediction):
+        if self.error is not None:
+            raise self.error
+        self.rows.put((tile, url, prediction))
+
+    def _flush(self, batch):
+        with self.conn.cursor() as cursor:
+            execute_values(cursor, """
+                INSERT INTO nlarge(file_path, value) VALUES %s
+                ON CONFLICT (file_path) DO UPDATE SET value = EXCLUDED.value
+            """, [(url, prediction) for _, url, prediction in batch], page_size=1000)
+            execute_values(cursor, """
+                INSERT INTO tile_labels(image_set, z, x, y, value, model_version) VALUES %s
+                ON CONFLICT (image_set, z, x, y) DO UPDATE
+                SET value = EXCLUDED.value, model_version = EXCLUDED.model_version, updated_at = now()
+            """, [(self.image_name, *tile, prediction, self.model_version) for tile, _, prediction in batch],
+                page_size=1000)
+        self.conn.commit()
+        self.written += len(batch)
+
+    def _run(self):
+        batch = []
+        while True:
+            item = self.rows.get()
+            if item is not _DONE:
+                batch.append(item)
+            if batch and (item is _DONE or len(batch) >= self.commit_every):
+                try:
+                    if self.error is None:
+                        self._flush(batch)
+                except Exception as e:
+                    self.conn.rollback()
+                    self.error = e
+                batch = []
+            if item is _DONE:
+                return
+
+    def close(self):
+        self.rows.put(_DONE)
+        self.thread.join()
+        self.conn.close()
+        if self.error is not None:
+            raise self.error
+
+
+def classify_batch(model, tensors, classes, device):
+    batch = torch.stack(tensors).to(device)
+    with torch.inference_mode():
+        outputs = model(batch)
+    return [classes[i] for i in outputs.argmax(dim=1).tolist()]
+
+
 # === Main process_image function called by backend ===
-def process_image(image_name, original_width, original_height, TILE_SIZE=512):
-    tiles = get_tiles_for_image(original_width, original_height, TILE_SIZE)
-    for z, x, y in tiles:
-        url = f"{gcs_base_url}{bucket_name}/{image_name}/{z}/{x}/{y}.png"
-        predict_image_from_url(url, model, transform, classes)
+def process_image(image_name, original_width, original_height, model, classes, model_version, TILE_SIZE=512,
+                  device="cpu", batch_size=BATCH_SIZE, fetch_workers=FETCH_WORKERS, prefetch=PREFETCH,
+                  commit_every=COMMIT_EVERY, skip="any"):
+    all_tiles = get_tiles_for_image(original_width, original_height, TILE_SIZE)
+    labeled = load_labeled_tiles(image_name)
+    tiles = tiles_to_label(all_tiles, labeled, model_version, skip)
+    print(f"Classifying {len(tiles)} of {len(all_tiles)} tiles of {image_name} with model {model_version} "
+          f"({len(all_tiles) - len(tiles)} already labeled) in batches of {batch_size}")
+    if not tiles:
+        return
+    fetcher = TileFetcher(image_name, tiles, workers=fetch_workers, prefetch=prefetch)
+    writer = LabelWriter(image_name, model_version, commit_every=commit_every)
+
+    started = time.perf_counter()
+    done = 0
+    pending = []
+
+    def run_batch():
+        nonlocal done
+        predictions = classify_batch(model, [tensor for _, _, tensor in pending], classes, device)
+        for (tile, url, _), prediction in zip(pending, predictions):
+            writer.put(tile, url, prediction)
+        done += len(pending)
+        pending.clear()
+        elapsed = time.perf_counter() - started
+        print(f"{done}/{len(tiles)} tiles, {done / elapsed:.1f} tiles/s")
+
+    try:
+        for item in fetcher:
+            pending.append(item)
+            if len(pending) >= batch_size:
+                run_batch()
+        if pending:
+            run_batch()
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"--- {done} tiles classified and stored in {elapsed:.1f} s "
+          f"({done / elapsed if elapsed > 0 else 0:.1f} tiles/s), {fetcher.failed} not fetched ---")
+    rebuild_label_bundle(image_name)
+
+# Viewers load labels from the per-image bundle, so re-export it once all tiles are stored
+def rebuild_label_bundle(image_name):
+    try:
+        response = requests.post(f"{backend_url}/label-bundles/{image_name}/rebuild", timeout=300)
+        response.raise_for_status()
+        print(f"Rebuilt label bundle for {image_name}: {response.json()}")
+    except Exception as e:
+        print(f"Label bundle rebuild failed ({e}); run Backend/label_bundle.py --image-set {image_name}")
+
 
-process_image("star_birth", 17043, 11710)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify every tile of an image and store the labels.")
+    parser.add_argument("--image", default="star_birth", help="Image set name / bucket prefix")
+    parser.add_argument("--width", type=int, default=17043)
+    parser.add_argument("--height", type=int, default=11710)
+    parser.add_argument("--model", default="ai/models/space_model.ts",
+                        help="Exported artifact (.ts, see export.py) or a raw train.py state dict (.pt)")
+    parser.add_argument("--model-version", help="Recorded with every label (default: the artifact's version)")
+    parser.add_argument("--skip", choices=["any", "current"], default="any",
+                        help="Skip every labeled tile (resume), or only tiles labeled by this model version (relabel)")
+    parser.add_argument("--device",
+                        help="Default: cpu for .ts artifacts, otherwise cuda when available")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Tiles per forward pass")
+    parser.add_argument("--threads", type=int, default=TORCH_THREADS, help="torch CPU threads")
+    parser.add_argument("--fetch-workers", type=int, default=FETCH_WORKERS, help="Tile download threads")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH, help="Decoded tiles queued for the model")
+    parser.add_argument("--commit-every", type=int, default=COMMIT_EVERY, help="Label rows per DB transaction")
+    args = parser.parse_args()
 
-# Close DB connection
-cursor.close()
-conn.close()
+    torch.set_num_threads(args.threads)
+    device = torch.device(args.device or (
+        "cuda" if torch.cuda.is_available() and not is_artifact(args.model) else "cpu"))
+    model, classes, model_version = load_model(args.model, device)
+    model_version = args.model_version or model_version
+    process_image(args.image, args.width, args.height, model, classes, model_version, device=device,
+                  batch_size=args.batch_size, fetch_workers=args.fetch_workers, prefetch=args.prefetch,
+                  commit_every=args.commit_every, skip=args.skip)
@@ -1,11 +1,16 @@
 import os
+import json
+import time
+import random
+import hashlib
+import argparse
 import warnings
 import torch
 import torch.nn as nn
 from torch.utils.data import Dataset, DataLoader
 from torchvision import transforms
 from torchvision.models import resnet18, ResNet18_Weights
-from data import get_image_paths, split_dataset, load_image
+from data import get_image_paths, split_dataset, load_dataset_cache
 from tqdm import tqdm
 from PIL import Image
 import numpy as np
@@ -20,27 +25,152 @@ class SpaceDataset(Dataset):
         self.data = image_label_list
         self.transform = transform
         self.classes = sorted(list(set([label for _, label in image_label_list])))
+        self.class_to_idx = {cls: i for i, cls in enumerate(self.classes)}
 
     def __len__(self):
         return len(self.data)
 
     def __getitem__(self, idx):
         path, label = self.data[idx]
-        img = load_image(path)  # returns NumPy array 0-1
-
-        # Convert NumPy array to PIL Image
-        if isinstance(img, np.ndarray):
-            img = Image.fromarray((img * 255).astype(np.uint8))
+        # Decode straight to an RGB PIL image; the transforms do the resizing
+        img = Image.open(path).convert("RGB")
 
         if self.transform:
             img = self.transform(img)
 
-        label_idx = self.classes.index(label)
+        label_idx = self.class_to_idx[label]
         return img, label_idx
 
 
+class MemmapDataset(Dataset):
+    """
+    Samples from the uint8 cache written by `python data.py`. Images come out as
+    uint8 CHW tensors viewing the memmap (no decode, no resize); the transform
+    should work on uint8 tensors and end with ConvertImageDtype(torch.float).
+    """
+
+    def __init__(self, cache_dir, indices=None, transform=None):
+        self.cache_dir = cache_dir
+        self.transform = transform
+        _, labels, self.classes, paths = load_dataset_cache(cache_dir)
+        self.indices = np.arange(len(labels)) if indices is None else np.asarray(indices)
+        self.labels = labels[self.indices]
+        self.data = [paths[i] for i in self.indices]
+        # Opened lazily so each DataLoader worker maps the file itself instead of pickling it
+        self.images = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        if self.images is None:
+            self.images = load_dataset_cache(self.cache_dir)[0]
+        img = torch.from_numpy(self.images[self.indices[idx]]).permute(2, 0, 1)
+        if self.transform:
+            img = self.transform(img)
+        return img, int(self.labels[idx])
+
+
+# ---- Feature cache ----
+# With the backbone frozen, its pooled 512-d output for an (image, augmentation)
+# pair never changes, so it is computed once and only the linear head is trained.
+def extract_features(backbone, dataset, out_path, variants, feature_dim, batch_size, num_workers, device):
+    """
+    Write backbone features of every image, `variants` times (a fresh random
+    augmentation each pass), to a (variants, N, 512) float32 .npy memmap.
+    """
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    features = np.lib.format.open_memmap(out_path + ".tmp", mode="w+", dtype=np.float32,
+                                         shape=(variants, len(dataset), feature_dim))
+    backbone.eval()
+    with torch.inference_mode():
+        for variant in range(variants):
+            row = 0
+            for imgs, _ in tqdm(loader, desc=f"Features {os.path.basename(out_path)} {variant + 1}/{variants}"):
+                out = backbone(imgs.to(device)).cpu().numpy()
+                features[variant, row:row + len(out)] = out
+                row += len(out)
+    features.flush()
+    del features
+    os.replace(out_path + ".tmp", out_path)
+
+
+def cached_features(backbone, dataset, cache_dir, name, variants, feature_dim, batch_size, num_workers, device):
+    """(features memmap, labels) for a dataset, extracting them only if the cache doesn't match."""
+    key = hashlib.sha1(json.dumps([dataset.data, dataset.classes, variants]).encode()).hexdigest()
+    features_path = os.path.join(cache_dir, f"{name}_features.npy")
+    meta_path = os.path.join(cache_dir, f"{name}_meta.json")
+    meta = None
+    if os.path.exists(meta_path) and os.path.exists(features_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+    if meta is None or meta.get("key") != key:
+        os.makedirs(cache_dir, exist_ok=True)
+        extract_features(backbone, dataset, features_path, variants, feature_dim, batch_size, num_workers, device)
+        with open(meta_path, "w") as f:
+            json.dump({"key": key, "variants": variants, "count": len(dataset)}, f)
+    else:
+        print(f"Using cached {name} features from {features_path}")
+    class_to_idx = {cls: i for i, cls in enumerate(dataset.classes)}
+    labels = np.array([class_to_idx[label] for _, label in dataset.data], dtype=np.int64)
+    return np.load(features_path, mmap_mode="r"), labels
+
+
+def train_head_on_features(fc, train_features, train_labels, val_features, val_labels, epochs, batch_size, lr):
+    """
+    Train the linear head on cached features. Every epoch each image uses one of
+    its augmentation variants at random, so the head still sees augmented data.
+    """
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(fc.parameters(), lr=lr)
+    variants, count = train_features.shape[:2]
+    val_x = torch.from_numpy(np.ascontiguousarray(val_features[0]))
+    val_y = torch.from_numpy(val_labels)
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        fc.train()
+        running_loss = 0
+        order = np.random.permutation(count)
+        chosen = np.random.randint(variants, size=count)
+        batches = range(0, count, batch_size)
+        for i in batches:
+            idx = order[i:i + batch_size]
+            x = torch.from_numpy(train_features[chosen[idx], idx])
+            y = torch.from_numpy(train_labels[idx])
+            optimizer.zero_grad()
+            loss = criterion(fc(x), y)
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item()
+
+        fc.eval()
+        with torch.no_grad():
+            predicted = fc(val_x).argmax(dim=1)
+        val_acc = (predicted == val_y).float().mean().item() * 100 if len(val_y) else 0.0
+        print(f"Epoch {epoch + 1}, Loss: {running_loss / len(batches):.4f}, Val Accuracy: {val_acc:.2f}% "
+              f"({time.perf_counter() - start:.2f} s)")
+
+
 # ---- Main training code ----
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fine-tune the ResNet18 head on dataset/train.")
+    parser.add_argument("--feature-cache", metavar="DIR",
+                        help="Train the head on backbone features cached in DIR instead of running the backbone every epoch")
+    parser.add_argument("--variants", type=int, default=8,
+                        help="Augmented copies of each training image in the feature cache")
+    parser.add_argument("--dataset-cache", metavar="DIR",
+                        help="Read images from the uint8 memmap written by data.py instead of decoding files")
+    parser.add_argument("--num-workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="DataLoader worker processes (0 decodes in the training process)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for the train/val split (kept fixed so the feature cache stays valid)")
+    parser.add_argument("--root", default="dataset/train", help="Training set, one folder per class")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--out", default="ai/models/space_model.pt", help="Where the trained state dict is saved")
+    parser.add_argument("--pretrained", action=argparse.BooleanOptionalAction, default=True,
+                        help="Start from the ImageNet weights (--no-pretrained only makes sense for smoke tests)")
+    args = parser.parse_args()
+
     # ---- Transforms ----
     train_transform = transforms.Compose([
         transforms.Resize((224, 224)),
@@ -55,22 +185,40 @@ if __name__ == "__main__":
         transforms.ToTensor(),
     ])
 
+    # Same augmentations for uint8 CHW tensors from the memmap cache (already 224x224)
+    train_transform_uint8 = transforms.Compose([
+        transforms.RandomHorizontalFlip(),
+        transforms.RandomRotation(20),
+        transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.1),
+        transforms.ConvertImageDtype(torch.float),
+    ])
+
+    val_transform_uint8 = transforms.ConvertImageDtype(torch.float)
+
     # ---- Load Dataset ----
-    root = "dataset/train"
-    paths = get_image_paths(root)
-    train_list, val_list = split_dataset(paths, val_ratio=0.2)
+    random.seed(args.seed)
+    if args.dataset_cache:
+        indices = list(range(len(load_dataset_cache(args.dataset_cache)[1])))
+        train_idx, val_idx = split_dataset(indices, val_ratio=0.2)
+        train_ds = MemmapDataset(args.dataset_cache, sorted(train_idx), transform=train_transform_uint8)
+        val_ds = MemmapDataset(args.dataset_cache, sorted(val_idx), transform=val_transform_uint8)
+    else:
+        paths = sorted(get_image_paths(args.root))
+        train_list, val_list = split_dataset(paths, val_ratio=0.2)
 
-    train_ds = SpaceDataset(train_list, transform=train_transform)
-    val_ds = SpaceDataset(val_list, transform=val_transform)
+        train_ds = SpaceDataset(train_list, transform=train_transform)
+        val_ds = SpaceDataset(val_list, transform=val_transform)
 
     # ---- DataLoader ----
     batch_size = 8
-    train_loader = DataLoader(train_ds, batch_size=batch_size, shuffle=True, num_workers=0, pin_memory=False)
-    val_loader = DataLoader(val_ds, batch_size=batch_size, shuffle=False, num_workers=0, pin_memory=False)
+    loader_options = {"num_workers": args.num_workers, "pin_memory": False,
+                      "persistent_workers": args.num_workers > 0}
+    train_loader = DataLoader(train_ds, batch_size=batch_size, shuffle=True, **loader_options)
+    val_loader = DataLoader(val_ds, batch_size=batch_size, shuffle=False, **loader_options)
 
     # ---- Model Setup ----
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = resnet18(weights=ResNet18_Weights.DEFAULT)
+    model = resnet18(weights=ResNet18_Weights.DEFAULT if args.pretrained else None)
 
     # Freeze all layers except last fc
     for param in model.parameters():
@@ -81,40 +229,52 @@ if __name__ == "__main__":
     model.fc = nn.Linear(num_features, num_classes)  # last layer is trainable
     model = model.to(device)
 
-    # ---- Loss + Optimizer ----
-    criterion = nn.CrossEntropyLoss()
-    optimizer = torch.optim.Adam(model.fc.parameters(), lr=1e-3)  # only last layer
-
-    # ---- Training Loop with Validation ----
-    epochs = 20
-    for epoch in range(epochs):
-        model.train()
-        running_loss = 0
-        for imgs, labels in tqdm(train_loader, desc=f"Epoch {epoch + 1}/{epochs}"):
-            imgs, labels = imgs.to(device), labels.to(device)
-            optimizer.zero_grad()
-            outputs = model(imgs)
-            loss = criterion(outputs, labels)
-            loss.backward()
-            optimizer.step()
-            running_loss += loss.item()
+    epochs = args.epochs
+    if args.feature_cache:
+        # ---- Feature-cache training: backbone runs once per image and variant ----
+        fc = model.fc.cpu()
+        model.fc = nn.Identity()
+        train_features, train_labels = cached_features(model, train_ds, args.feature_cache, "train", args.variants,
+                                                       num_features, 64, args.num_workers, device)
+        val_features, val_labels = cached_features(model, val_ds, args.feature_cache, "val", 1,
+                                                   num_features, 64, args.num_workers, device)
+        train_head_on_features(fc, train_features, train_labels, val_features, val_labels,
+                               epochs, batch_size=256, lr=1e-3)
+        model.fc = fc.to(device)
+    else:
+        # ---- Loss + Optimizer ----
+        criterion = nn.CrossEntropyLoss()
+        optimizer = torch.optim.Adam(model.fc.parameters(), lr=1e-3)  # only last layer
 
-        # ---- Validation ----
-        model.eval()
-        correct = 0
-        total = 0
-        with torch.no_grad():
-            for imgs, labels in val_loader:
+        # ---- Training Loop with Validation ----
+        for epoch in range(epochs):
+            model.train()
+            running_loss = 0
+            for imgs, labels in tqdm(train_loader, desc=f"Epoch {epoch + 1}/{epochs}"):
                 imgs, labels = imgs.to(device), labels.to(device)
+                optimizer.zero_grad()
                 outputs = model(imgs)
-                _, predicted = torch.max(outputs.data, 1)
-                total += labels.size(0)
-                correct += (predicted == labels).sum().item()
+                loss = criterion(outputs, labels)
+                loss.backward()
+                optimizer.step()
+                running_loss += loss.item()
+
+            # ---- Validation ----
+            model.eval()
+            correct = 0
+            total = 0
+            with torch.no_grad():
+                for imgs, labels in val_loader:
+                    imgs, labels = imgs.to(device), labels.to(device)
+                    outputs = model(imgs)
+                    _, predicted = torch.max(outputs.data, 1)
+                    total += labels.size(0)
+                    correct += (predicted == labels).sum().item()
 
-        val_acc = correct / total * 100
-        print(f"Epoch {epoch + 1}, Loss: {running_loss / len(train_loader):.4f}, Val Accuracy: {val_acc:.2f}%")
+            val_acc = correct / total * 100
+            print(f"Epoch {epoch + 1}, Loss: {running_loss / len(train_loader):.4f}, Val Accuracy: {val_acc:.2f}%")
 
     # ---- Save Model ----
-    os.makedirs("models", exist_ok=True)
-    torch.save(model.state_dict(), "ai/models/space_model.pt")
-    print("Model saved to ai/models/space_model.pt")
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    torch.save(model.state_dict(), args.out)
+    print(f"Model saved to {args.out}")
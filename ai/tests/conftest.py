@@ -0,0 +1,70 @@
+"""
+Smoke tests for the ai/ scripts. They need torch and are skipped without it;
+tests of the label writers also need DATABASE_URL, where each test gets a
+throwaway database (created and dropped like Backend/tests does).
+"""
+import os
+import sys
+import uuid
+import asyncio
+import contextlib
+from urllib.parse import urlsplit
+
+import numpy as np
+import pytest
+from PIL import Image
+
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(AI_DIR, "..", "Backend")
+sys.path.insert(0, os.path.join(AI_DIR, "src"))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "bench"))
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+# Class -> mean colour of the synthetic training images
+CLASS_COLOURS = {"galaxy": (200, 120, 60), "nebula": (60, 200, 120), "star": (90, 90, 220)}
+
+
+@pytest.fixture(scope="session")
+def image_folder(tmp_path_factory):
+    """dataset/train layout: 5 noisy 96x80 images per class, told apart by their colour."""
+    root = tmp_path_factory.mktemp("dataset") / "train"
+    rng = np.random.default_rng(0)
+    for cls, colour in CLASS_COLOURS.items():
+        (root / cls).mkdir(parents=True)
+        for i in range(5):
+            pixels = np.clip(rng.normal(colour, 40, (80, 96, 3)), 0, 255).astype(np.uint8)
+            Image.fromarray(pixels).save(root / cls / f"{i}.png")
+    return root
+
+
+@pytest.fixture
+def labels_db():
+    """DSN of a database with nlarge and tile_labels (migrate_labels.py), dropped after the test."""
+    if not DATABASE_URL:
+        pytest.skip("DATABASE_URL is not set")
+    import psycopg2
+    name = f"nlarge_test_{uuid.uuid4().hex[:12]}"
+
+    def admin(statement):
+        conn = psycopg2.connect(DATABASE_URL)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(statement)
+        finally:
+            conn.close()
+
+    admin(f'CREATE DATABASE "{name}"')
+    dsn = urlsplit(DATABASE_URL)._replace(path=f"/{name}").geturl()
+    try:
+        from migrate_labels import migrate
+        conn = psycopg2.connect(dsn)
+        with conn, conn.cursor() as cursor:
+            cursor.execute("CREATE TABLE nlarge (file_path TEXT, value TEXT)")
+        conn.close()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            asyncio.run(migrate(dsn))
+        yield dsn
+    finally:
+        admin(f'DROP DATABASE "{name}" WITH (FORCE)')
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+torch = pytest.importorskip("torch")
+
+from data import get_image_paths, load_dataset_cache, preprocess_dataset
+from train import MemmapDataset, SpaceDataset
+
+
+@pytest.fixture(scope="module")
+def cache(image_folder, tmp_path_factory):
+    out = tmp_path_factory.mktemp("cache")
+    preprocess_dataset(str(image_folder), str(out), size=(64, 48), workers=1)
+    return out
+
+
+def test_cache_round_trip(image_folder, cache):
+    images, labels, classes, paths = load_dataset_cache(str(cache))
+    assert classes == ["galaxy", "nebula", "star"]
+    assert images.shape == (15, 48, 64, 3) and images.dtype == np.uint8
+    assert paths == [tuple(p) for p in get_image_paths(str(image_folder))]
+    assert [classes[i] for i in labels] == [label for _, label in paths]
+    # Bilinear, like the Resize in training and the resize at inference
+    with Image.open(paths[7][0]) as img:
+        expected = np.asarray(img.convert("RGB").resize((64, 48), Image.BILINEAR))
+    assert np.array_equal(images[7], expected)
+
+
+def test_memmap_dataset_matches_the_file_dataset(image_folder, cache):
+    from torchvision import transforms
+    paths = get_image_paths(str(image_folder))
+    files = SpaceDataset(paths, transform=transforms.Compose([transforms.Resize((48, 64)), transforms.ToTensor()]))
+    memmap = MemmapDataset(str(cache), indices=[3, 11], transform=transforms.ConvertImageDtype(torch.float))
+    assert len(memmap) == 2 and memmap.data == [paths[3], paths[11]]
+    for i, index in enumerate([3, 11]):
+        image, label = memmap[i]
+        expected, expected_label = files[index]
+        assert image.shape == (3, 48, 64) and image.dtype == torch.float32
+        assert label == expected_label
+        # torchvision's antialiased resize and PIL's bilinear differ by rounding only
+        assert (image - expected).abs().mean() < 0.01
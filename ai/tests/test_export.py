@@ -0,0 +1,43 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from data import preprocess_dataset
+from export import VARIANTS, artifact_path, calibration_batches, export_variant
+from model_artifact import load_artifact, load_weights, model_version_of
+
+
+@pytest.fixture(scope="module")
+def weights(tmp_path_factory):
+    from torchvision.models import resnet18
+    torch.manual_seed(0)
+    model = resnet18()
+    model.fc = torch.nn.Linear(model.fc.in_features, 3)
+    path = tmp_path_factory.mktemp("models") / "space_model.pt"
+    torch.save(model.state_dict(), path)
+    return str(path)
+
+
+@pytest.mark.parametrize("variant", VARIANTS)
+def test_exported_artifacts_load_and_agree_with_the_weights(tmp_path, image_folder, weights, variant):
+    classes = ["galaxy", "nebula", "star"]
+    calibration = None
+    if variant == "int8-static":
+        preprocess_dataset(str(image_folder), str(tmp_path / "cache"), workers=1)
+        calibration = calibration_batches(str(tmp_path / "cache"), None, 8, batch_size=4)
+    path = artifact_path(weights, variant)
+    export_variant(load_weights(weights, 3), variant, classes, model_version_of(weights), path, calibration)
+
+    module, meta = load_artifact(path)
+    assert meta["classes"] == classes
+    assert meta["model_version"] == f"{model_version_of(weights)}-{variant}"
+    inputs = torch.rand(4, 3, 224, 224)
+    with torch.inference_mode():
+        expected = load_weights(weights, 3)(inputs)
+        logits = module(inputs)
+    assert logits.shape == (4, 3)
+    if variant == "fp32":
+        assert torch.allclose(logits, expected, atol=1e-4)
+    else:
+        # Quantized: same scale of outputs, not the same digits
+        assert (logits - expected).abs().max() < 0.5 * expected.abs().max() + 0.1
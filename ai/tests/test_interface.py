@@ -0,0 +1,101 @@
+"""
+interface.py end to end: tiles served by the bucket stand-in, a tiny TorchScript
+model that calls a tile red or blue by its mean colour, labels in Postgres.
+"""
+import os
+import json
+import contextlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+torch = pytest.importorskip("torch")
+
+import interface
+from model_artifact import META_FILE
+from standins import BucketServer
+
+WIDTH, HEIGHT = 1100, 700
+
+
+class MeanColour(torch.nn.Module):
+    def forward(self, x):
+        mean = x.mean(dim=(2, 3))
+        return torch.stack([mean[:, 0], mean[:, 2]], dim=1)
+
+
+@pytest.fixture(scope="module")
+def model(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("model") / "colour.ts")
+    meta = {"classes": ["red", "blue"], "model_version": "colour-1", "variant": "fp32", "input_size": 224}
+    torch.jit.save(torch.jit.script(MeanColour()), path, _extra_files={META_FILE: json.dumps(meta)})
+    return interface.load_model(path)
+
+
+@pytest.fixture(scope="module")
+def bucket(tmp_path_factory):
+    """The bucket stand-in serving n-large/demo: red left of x = 550, blue to the right."""
+    import generate_fits_tiles
+    root = tmp_path_factory.mktemp("bucket")
+    pixels = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+    pixels[:, :550, 0] = 255
+    pixels[:, 550:, 2] = 255
+    Image.fromarray(pixels).save(root / "source.png")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        sink = generate_fits_tiles.LocalDirectorySink(str(root / "n-large"), "demo")
+        generate_fits_tiles.create_and_upload_tiles(sink, str(root / "source.png"), encode_workers=1)
+    with BucketServer(str(root)) as server:
+        yield server
+
+
+@pytest.fixture
+def served(bucket, monkeypatch):
+    monkeypatch.setattr(interface, "gcs_base_url", bucket.url + "/")
+    # Nothing listens here: the bundle rebuild request fails fast and is only reported
+    monkeypatch.setattr(interface, "backend_url", "http://127.0.0.1:9")
+
+
+def test_fetcher_yields_every_existing_tile(served):
+    tiles = interface.get_tiles_for_image(WIDTH, HEIGHT)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        fetched = list(interface.TileFetcher("demo", tiles, workers=4, prefetch=8))
+    found = [tile for tile, _, _ in fetched]
+    assert sorted(found) == sorted(tiles)
+    assert all(tensor.shape == (3, 224, 224) for _, _, tensor in fetched)
+
+
+def test_process_image_classifies_in_micro_batches_and_resumes(served, model, labels_db, monkeypatch, capsys):
+    monkeypatch.setattr(interface, "db_url", labels_db)
+    batches = []
+    classify_batch = interface.classify_batch
+
+    def recording(model, tensors, classes, device):
+        batches.append(len(tensors))
+        return classify_batch(model, tensors, classes, device)
+
+    monkeypatch.setattr(interface, "classify_batch", recording)
+    net, classes, version = model
+    interface.process_image("demo", WIDTH, HEIGHT, net, classes, version, batch_size=4, fetch_workers=4,
+                            commit_every=5)
+
+    labels = interface.load_labeled_tiles("demo")
+    done = sum(batches)
+    assert len(labels) == done > 4
+    assert set(labels.values()) == {"colour-1"}
+    # Full batches of 4 while tiles keep coming, one partial batch at the end
+    assert all(size == 4 for size in batches[:-1]) and 0 < batches[-1] <= 4
+    out = capsys.readouterr().out
+    assert f"{done} tiles classified and stored" in out
+
+    import psycopg2
+    conn = psycopg2.connect(labels_db)
+    with conn, conn.cursor() as cursor:
+        cursor.execute("SELECT x, value FROM tile_labels WHERE z = 2 AND y = 0 ORDER BY x")
+        assert cursor.fetchall() == [(0, "red"), (1, "blue"), (2, "blue")]
+    conn.close()
+
+    # A rerun finds every fetched tile labeled and classifies nothing
+    batches.clear()
+    interface.process_image("demo", WIDTH, HEIGHT, net, classes, version, batch_size=4, fetch_workers=4)
+    assert batches == []
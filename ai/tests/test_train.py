@@ -0,0 +1,52 @@
+"""
+train.py end to end on the CPU, in each of its data paths. The backbone starts
+from random weights (--no-pretrained) so no download is needed.
+"""
+import os
+import sys
+import subprocess
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from data import preprocess_dataset
+from model_artifact import load_weights
+
+TRAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "train.py")
+CLASSES = 3
+
+
+def train(tmp_path, root, *options):
+    out = tmp_path / "models" / "space_model.pt"
+    result = subprocess.run(
+        [sys.executable, TRAIN, "--root", str(root), "--epochs", "2", "--num-workers", "0", "--no-pretrained",
+         "--out", str(out), *options],
+        cwd=tmp_path, capture_output=True, text=True, timeout=600,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    return out, result.stdout
+
+
+@pytest.mark.parametrize("mode", ["files", "dataset-cache"])
+def test_train_loop_runs_end_to_end(tmp_path, image_folder, mode):
+    options = []
+    if mode == "dataset-cache":
+        preprocess_dataset(str(image_folder), str(tmp_path / "cache"), workers=1)
+        options = ["--dataset-cache", str(tmp_path / "cache")]
+    out, stdout = train(tmp_path, image_folder, *options)
+    assert "Epoch 2, Loss:" in stdout
+    model = load_weights(str(out), CLASSES)
+    assert model(torch.zeros(1, 3, 224, 224)).shape == (1, CLASSES)
+
+
+def test_feature_cache_is_reused(tmp_path, image_folder):
+    options = ["--feature-cache", str(tmp_path / "features"), "--variants", "2"]
+    _, first = train(tmp_path, image_folder, *options)
+    assert "Using cached" not in first and "Epoch 2, Loss:" in first
+    assert sorted(os.listdir(tmp_path / "features")) == [
+        "train_features.npy", "train_meta.json", "val_features.npy", "val_meta.json"]
+
+    out, second = train(tmp_path, image_folder, *options)
+    assert "Using cached train features" in second and "Using cached val features" in second
+    assert load_weights(str(out), CLASSES).fc.out_features == CLASSES